@@ -0,0 +1,110 @@
+"""
+Benchmark de latencia de compras: ruta secuencial anterior vs ejecutar_compra
+
+Requiere un MongoDB accesible en MONGO_URI. Usa una base de datos propia
+(BENCH_DB_NAME, por defecto "mundo_mitico_bench") que se borra al terminar.
+
+Uso:
+    python benchmarks/bench_compras.py [--compras 2000] [--concurrencia 20]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+# Agregar el directorio raíz al path y aislar la base de datos del benchmark
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DB_NAME"] = os.getenv("BENCH_DB_NAME", "mundo_mitico_bench")
+
+from utils import database
+from utils.database import (
+    usuarios_col,
+    logs_col,
+    descontar_balance_usuario,
+    agregar_balance_usuario,
+    agregar_item_inventario,
+    ejecutar_compra,
+    log_action
+)
+
+PRECIO = 0.01
+
+async def compra_secuencial(user_id: int) -> bool:
+    """Ruta anterior: leer balance, descontar, agregar item y registrar log (cuatro viajes)"""
+    usuario = await usuarios_col.find_one({"user_id": user_id})
+    balance = float(usuario.get("balance", 0)) if usuario else 0.0
+    if balance < PRECIO:
+        return False
+    if not await descontar_balance_usuario(user_id, PRECIO):
+        return False
+    if not await agregar_item_inventario(user_id, "bench_item", 1):
+        await agregar_balance_usuario(user_id, PRECIO)
+        return False
+    await log_action(user_id, "item_comprado", details={"item": "bench_item", "precio": PRECIO})
+    return True
+
+async def compra_atomica(user_id: int) -> bool:
+    """Ruta nueva: ejecutar_compra"""
+    comprado, _ = await ejecutar_compra(user_id, "bench_item", PRECIO, "item_comprado", details={
+        "item": "bench_item",
+        "precio": PRECIO
+    })
+    return comprado
+
+async def medir(nombre: str, compra, compras: int, concurrencia: int, usuarios: int) -> dict:
+    """Ejecuta `compras` compras con `concurrencia` tareas y devuelve las latencias"""
+    latencias = []
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def una(i: int):
+        async with semaforo:
+            inicio = time.perf_counter()
+            await compra(i % usuarios)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+
+    inicio_total = time.perf_counter()
+    await asyncio.gather(*(una(i) for i in range(compras)))
+    duracion = time.perf_counter() - inicio_total
+
+    percentiles = statistics.quantiles(latencias, n=100)
+    return {
+        "ruta": nombre,
+        "p50": percentiles[49],
+        "p99": percentiles[98],
+        "compras_por_segundo": compras / duracion
+    }
+
+async def preparar(usuarios: int) -> None:
+    """Crea usuarios con balance suficiente y vacía los logs"""
+    await usuarios_col.delete_many({})
+    await logs_col.delete_many({})
+    await usuarios_col.insert_many([
+        {"user_id": i, "balance": 1_000_000.0} for i in range(usuarios)
+    ])
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de compras")
+    parser.add_argument("--compras", type=int, default=2000)
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--usuarios", type=int, default=100)
+    args = parser.parse_args()
+
+    await database.init_db()
+    try:
+        resultados = []
+        for nombre, compra in (("secuencial", compra_secuencial), ("atomica", compra_atomica)):
+            await preparar(args.usuarios)
+            resultados.append(await medir(nombre, compra, args.compras, args.concurrencia, args.usuarios))
+
+        print(f"transacciones: {database.soporta_transacciones}")
+        print(f"{'ruta':<12}{'p50 (ms)':>10}{'p99 (ms)':>10}{'compras/s':>12}")
+        for r in resultados:
+            print(f"{r['ruta']:<12}{r['p50']:>10.2f}{r['p99']:>10.2f}{r['compras_por_segundo']:>12.1f}")
+    finally:
+        await database.client.drop_database(database.DB_NAME)
+
+if __name__ == "__main__":
+    asyncio.run(main())
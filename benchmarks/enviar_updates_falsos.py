@@ -0,0 +1,88 @@
+"""
+Emisor de updates falsos para probar el modo webhook sin Telegram
+
+Envía updates de mensaje sintéticos al endpoint local del webhook, como lo
+haría Telegram, y reporta el throughput y los códigos de respuesta (200
+aceptado, 503 cola llena, 401 secreto incorrecto).
+
+Uso:
+    python benchmarks/enviar_updates_falsos.py [--updates 5000] [--concurrencia 50]
+        [--url http://127.0.0.1:8080/webhook] [--secreto ...] [--usuarios 1000]
+
+Por defecto toma la URL y el secreto de WEBHOOK_PORT, WEBHOOK_PATH y
+WEBHOOK_SECRET. Los handlers intentarán responder a usuarios inexistentes:
+con un BOT_TOKEN de prueba esos envíos fallan y solo se registran en el log.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from collections import Counter
+
+import aiohttp
+
+# Agregar el directorio raíz al path para importaciones
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+def crear_update(update_id: int, user_id: int, texto: str) -> dict:
+    """Crea un update de mensaje privado con el formato de la Bot API"""
+    usuario = {"id": user_id, "is_bot": False, "first_name": f"Prueba {user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": usuario["first_name"]},
+            "from": usuario,
+            "text": texto
+        }
+    }
+
+async def enviar(args) -> None:
+    """Envía los updates con la concurrencia indicada y muestra el resumen"""
+    codigos = Counter()
+    latencias = []
+    siguiente = iter(range(1, args.updates + 1))
+    cabeceras = {"X-Telegram-Bot-Api-Secret-Token": args.secreto}
+
+    async def emisor(session: aiohttp.ClientSession) -> None:
+        for update_id in siguiente:
+            update = crear_update(update_id, 10_000 + update_id % args.usuarios, args.texto)
+            inicio = time.perf_counter()
+            try:
+                async with session.post(args.url, json=update, headers=cabeceras) as respuesta:
+                    codigos[respuesta.status] += 1
+            except aiohttp.ClientError as e:
+                codigos[type(e).__name__] += 1
+            latencias.append((time.perf_counter() - inicio) * 1000)
+
+    inicio = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(emisor(session) for _ in range(args.concurrencia)))
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    print(f"\n📊 {args.updates} updates en {duracion:.2f}s ({args.updates / duracion:.0f} updates/s)")
+    print(f"Respuestas: {dict(codigos)}")
+    if latencias:
+        print(f"Latencia ms: p50 {statistics.median(latencias):.2f}, "
+              f"p99 {latencias[int(len(latencias) * 0.99) - 1]:.2f}")
+
+def main():
+    """Función principal del emisor"""
+    parser = argparse.ArgumentParser(description="Emisor de updates falsos para el webhook")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secreto", default=WEBHOOK_SECRET)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--usuarios", type=int, default=1000, help="Usuarios distintos que envían")
+    parser.add_argument("--texto", default="/start")
+    asyncio.run(enviar(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
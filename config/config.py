@@ -35,6 +35,8 @@ try:
     REQUIRED_CHANNELS: List[dict] = json.loads(REQUIRED_CHANNELS_RAW)
 except (json.JSONDecodeError, TypeError):
     REQUIRED_CHANNELS: List[dict] = []
+# Tiempo máximo para verificar la suscripción a todos los canales (se consultan a la vez)
+SUSCRIPCION_TIMEOUT: float = float(os.getenv("SUSCRIPCION_TIMEOUT", "5"))  # segundos
 
 # =========================
 # CONFIGURACIÓN DE TOKENS
@@ -60,3 +62,143 @@ TIEMPO_PROCESAMIENTO: str = os.getenv("TIEMPO_PROCESAMIENTO")
 # =========================
 LOG_LEVEL: str = os.getenv("LOG_LEVEL")
 LOG_FORMAT: str = os.getenv("LOG_FORMAT")
+
+# =========================
+# CONFIGURACIÓN DE TAREAS
+# =========================
+# Si está activo, el middleware solo marca al usuario como visto y las tareas
+# se verifican en segundo plano a un ritmo limitado
+TAREAS_VERIFICACION_DIFERIDA: bool = os.getenv("TAREAS_VERIFICACION_DIFERIDA", "false").lower() == "true"
+TAREAS_VERIFICACIONES_POR_SEGUNDO: float = float(os.getenv("TAREAS_VERIFICACIONES_POR_SEGUNDO", "5"))
+TAREAS_INTERVALO_MINIMO: int = int(os.getenv("TAREAS_INTERVALO_MINIMO", "3600"))  # segundos
+TAREAS_MAX_PENDIENTES: int = int(os.getenv("TAREAS_MAX_PENDIENTES", "10000"))
+
+# =========================
+# CONFIGURACIÓN DE CACHÉ
+# =========================
+CACHE_USUARIOS_MAX: int = int(os.getenv("CACHE_USUARIOS_MAX", "10000"))
+CACHE_USUARIOS_TTL: float = float(os.getenv("CACHE_USUARIOS_TTL", "30"))  # segundos
+# Lecturas de la Bot API (get_me, get_chat, get_chat_member)
+CACHE_TELEGRAM_MAX: int = int(os.getenv("CACHE_TELEGRAM_MAX", "10000"))
+CACHE_TELEGRAM_TTL_GET_ME: float = float(os.getenv("CACHE_TELEGRAM_TTL_GET_ME", "3600"))  # segundos
+CACHE_TELEGRAM_TTL_GET_CHAT: float = float(os.getenv("CACHE_TELEGRAM_TTL_GET_CHAT", "300"))  # segundos
+# Solo se guardan suscripciones positivas; los updates chat_member las invalidan
+CACHE_TELEGRAM_TTL_GET_CHAT_MEMBER: float = float(os.getenv("CACHE_TELEGRAM_TTL_GET_CHAT_MEMBER", "600"))  # segundos
+# Errores definitivos (chat inexistente, bot sin acceso...)
+CACHE_TELEGRAM_TTL_ERROR: float = float(os.getenv("CACHE_TELEGRAM_TTL_ERROR", "60"))  # segundos
+
+# =========================
+# CONFIGURACIÓN DEL LOG DE ACCIONES
+# =========================
+LOGS_LOTE_MAX: int = int(os.getenv("LOGS_LOTE_MAX", "500"))
+LOGS_INTERVALO_ESCRITURA: float = float(os.getenv("LOGS_INTERVALO_ESCRITURA", "2"))  # segundos
+LOGS_MAX_PENDIENTES: int = int(os.getenv("LOGS_MAX_PENDIENTES", "10000"))
+
+# =========================
+# CONFIGURACIÓN DE ÚLTIMA ACTIVIDAD
+# =========================
+# Cada usuario se escribe como máximo una vez por ventana
+ACTIVIDAD_VENTANA: int = int(os.getenv("ACTIVIDAD_VENTANA", "300"))  # segundos
+ACTIVIDAD_INTERVALO_ESCRITURA: float = float(os.getenv("ACTIVIDAD_INTERVALO_ESCRITURA", "30"))  # segundos
+
+# =========================
+# CONFIGURACIÓN DE CONTADORES GLOBALES
+# =========================
+# Número de documentos entre los que se reparten los contadores de NFTs
+NFTS_CONTADOR_SLOTS: int = int(os.getenv("NFTS_CONTADOR_SLOTS", "8"))
+NFTS_RECONCILIACION_INTERVALO: float = float(os.getenv("NFTS_RECONCILIACION_INTERVALO", "3600"))  # segundos
+
+# =========================
+# CONFIGURACIÓN DE ESTADÍSTICAS
+# =========================
+ESTADISTICAS_INTERVALO: float = float(os.getenv("ESTADISTICAS_INTERVALO", "300"))  # segundos
+ESTADISTICAS_DIAS_ACTIVOS: int = int(os.getenv("ESTADISTICAS_DIAS_ACTIVOS", "7"))
+# Leer las estadísticas de un secundario si el replica set lo permite
+ESTADISTICAS_LEER_SECUNDARIO: bool = os.getenv("ESTADISTICAS_LEER_SECUNDARIO", "false").lower() == "true"
+
+# =========================
+# CONFIGURACIÓN DE EXPLORAR
+# =========================
+# La Caja Sorpresa paga con la tabla RECOMPENSAS_CAJA_SORPRESA de
+# modules/actividades.py, aún sin aprobar: desactivada hasta entonces
+CAJA_SORPRESA_ACTIVA: bool = os.getenv("CAJA_SORPRESA_ACTIVA", "false").lower() == "true"
+
+# =========================
+# CONFIGURACIÓN DE RECORDATORIOS
+# =========================
+# Avisar al usuario cuando termina el cooldown de una actividad de explorar
+RECORDATORIOS_ACTIVOS: bool = os.getenv("RECORDATORIOS_ACTIVOS", "true").lower() == "true"
+RECORDATORIOS_POR_SEGUNDO: float = float(os.getenv("RECORDATORIOS_POR_SEGUNDO", "20"))
+
+# =========================
+# CONFIGURACIÓN DE INGESTA DE UPDATES
+# =========================
+# "polling" (getUpdates) o "webhook" (endpoint HTTP local, admite varias réplicas)
+MODO_INGESTA: str = os.getenv("MODO_INGESTA", "polling").lower()
+# URL pública que se registra en Telegram con set_webhook (vacía = no registrar)
+WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Token que Telegram envía en la cabecera X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+# Updates procesándose a la vez y updates aceptados en espera (lleno = HTTP 503)
+WEBHOOK_MAX_EN_VUELO: int = int(os.getenv("WEBHOOK_MAX_EN_VUELO", "100"))
+WEBHOOK_MAX_PENDIENTES: int = int(os.getenv("WEBHOOK_MAX_PENDIENTES", "1000"))
+WEBHOOK_ESPERA_CIERRE: float = float(os.getenv("WEBHOOK_ESPERA_CIERRE", "10"))  # segundos
+
+# =========================
+# CONFIGURACIÓN DEL DESPACHO DE UPDATES
+# =========================
+# Procesar en orden los updates de cada usuario y en paralelo entre usuarios
+DESPACHO_POR_USUARIO: bool = os.getenv("DESPACHO_POR_USUARIO", "true").lower() == "true"
+DESPACHO_WORKERS: int = int(os.getenv("DESPACHO_WORKERS", "50"))
+DESPACHO_MAX_PENDIENTES: int = int(os.getenv("DESPACHO_MAX_PENDIENTES", "1000"))
+DESPACHO_ESPERA_CIERRE: float = float(os.getenv("DESPACHO_ESPERA_CIERRE", "10"))  # segundos
+
+# =========================
+# CONFIGURACIÓN DE PROCESOS
+# =========================
+# Con más de 1 (y MODO_INGESTA=polling) un supervisor reparte los updates por
+# user_id entre este número de procesos worker
+PROCESOS_WORKERS: int = int(os.getenv("PROCESOS_WORKERS", "1"))
+
+# =========================
+# CONFIGURACIÓN DE ENVÍOS
+# =========================
+# Telegram admite ~30 mensajes/s por bot. Las respuestas de los handlers
+# gastan del mismo cubo (con prioridad); el margen queda para el resto de
+# llamadas a la API (answer_callback_query, get_chat_member...)
+ENVIOS_POR_SEGUNDO: float = float(os.getenv("ENVIOS_POR_SEGUNDO", "25"))
+ENVIOS_RAFAGA: float = float(os.getenv("ENVIOS_RAFAGA", "25"))
+# Procesos que envían con el mismo token (workers del supervisor o réplicas
+# en modo webhook). ENVIOS_POR_SEGUNDO y ENVIOS_RAFAGA son el total del bot:
+# cada proceso usa su parte, así la suma no pasa el límite de Telegram
+ENVIOS_PROCESOS: int = max(int(os.getenv("ENVIOS_PROCESOS", str(PROCESOS_WORKERS))), 1)
+# Intervalo mínimo entre mensajes al mismo chat (Telegram recomienda ~1 por segundo)
+ENVIOS_INTERVALO_CHAT: float = float(os.getenv("ENVIOS_INTERVALO_CHAT", "1"))  # segundos
+ENVIOS_REINTENTOS: int = int(os.getenv("ENVIOS_REINTENTOS", "3"))
+ENVIOS_MAX_PENDIENTES: int = int(os.getenv("ENVIOS_MAX_PENDIENTES", "10000"))
+ENVIOS_ESPERA_CIERRE: float = float(os.getenv("ENVIOS_ESPERA_CIERRE", "10"))  # segundos
+
+# =========================
+# CONFIGURACIÓN DE DIFUSIONES
+# =========================
+# Usuarios por lote; el progreso se guarda tras cada lote (al reanudar se
+# repite como mucho el lote en curso)
+DIFUSION_LOTE: int = int(os.getenv("DIFUSION_LOTE", "200"))
+# El proceso que envía una difusión la bloquea este tiempo y lo renueva; si
+# se cae, otro proceso la reanuda al vencer (también es la frecuencia con la
+# que cada proceso comprueba si hay una difusión que reanudar)
+DIFUSION_BLOQUEO: float = float(os.getenv("DIFUSION_BLOQUEO", "120"))  # segundos
+
+# =========================
+# CONFIGURACIÓN DE TRABAJOS
+# =========================
+# Cola de trabajos en MongoDB (efectos secundarios de los referidos)
+TRABAJOS_WORKERS: int = int(os.getenv("TRABAJOS_WORKERS", "4"))
+TRABAJOS_INTERVALO: float = float(os.getenv("TRABAJOS_INTERVALO", "2"))  # segundos entre consultas sin trabajo
+TRABAJOS_BLOQUEO: float = float(os.getenv("TRABAJOS_BLOQUEO", "60"))  # segundos antes de que otro worker lo reclame
+TRABAJOS_MAX_INTENTOS: int = int(os.getenv("TRABAJOS_MAX_INTENTOS", "5"))
+# Los trabajos completados se borran pasado este tiempo (índice TTL)
+TRABAJOS_RETENCION: int = int(os.getenv("TRABAJOS_RETENCION", "604800"))  # segundos
@@ -1,38 +1,120 @@
 import asyncio
 from utils.logging_config import setup_logging, get_logger
-from utils.database import init_db
+from utils.database import (
+    init_db,
+    escritor_logs,
+    registro_actividad,
+    servicio_estadisticas,
+    reconciliar_nfts_globales
+)
+from utils.segundo_plano import iniciar_tarea, iniciar_tarea_periodica, detener_tareas
 from modules.commands import register_commands
 from modules.bot import bot, dp
+from modules.tareas import verificador_tareas
+from modules.recordatorios import programador_recordatorios
+from modules.webhook import receptor_webhook
+from modules.despachador import ejecutar_polling
+from modules.difusion import difusor
+from modules.referidos import registrar_trabajos_referidos
+from utils.trabajos import cola_trabajos
+from modules.supervisor import Supervisor, consumir_cola
+from config.config import (
+    TAREAS_VERIFICACION_DIFERIDA,
+    NFTS_RECONCILIACION_INTERVALO,
+    RECORDATORIOS_ACTIVOS,
+    MODO_INGESTA,
+    DESPACHO_POR_USUARIO,
+    PROCESOS_WORKERS,
+    DIFUSION_BLOQUEO
+)
 import time
+import signal
 
 # Configurar logging
 setup_logging()
 logger = get_logger(__name__)
 
+async def iniciar_servicios(indice: int = 0, total: int = 1):
+    """
+    Inicializa la base de datos, los handlers y las tareas en segundo plano.
+
+    Con varios procesos worker, `indice` y `total` identifican al worker: las
+    tareas globales solo corren en el worker 0 y los recordatorios se reparten
+    por user_id igual que los updates.
+    """
+    # Inicializar base de datos
+    await init_db()
+    logger.info("✅ Base de datos inicializada correctamente")
+    escritor_logs.iniciar()
+    registro_actividad.iniciar()
+    
+    # Registrar comandos
+    register_commands(dp)
+    logger.info("✅ Comandos registrados correctamente")
+    
+    # Tareas en segundo plano
+    if TAREAS_VERIFICACION_DIFERIDA:
+        iniciar_tarea("verificador_tareas", verificador_tareas.ejecutar(bot))
+    if indice == 0:
+        iniciar_tarea_periodica("reconciliar_nfts", reconciliar_nfts_globales, NFTS_RECONCILIACION_INTERVALO)
+    # Cualquier worker reclama una difusión cuyo dueño se cayó
+    iniciar_tarea_periodica("reanudar_difusion", lambda: difusor.reanudar(bot), DIFUSION_BLOQUEO)
+    servicio_estadisticas.iniciar()
+    registrar_trabajos_referidos(cola_trabajos)
+    cola_trabajos.iniciar(bot)
+    if RECORDATORIOS_ACTIVOS:
+        programador_recordatorios.iniciar(bot, indice, total)
+
 async def main():
     """Función principal para ejecutar el bot"""
     try:
         logger.info("🚀 Iniciando bot Mundo Mítico...")
-        
-        # Inicializar base de datos
-        await init_db()
-        logger.info("✅ Base de datos inicializada correctamente")
-        
-        # Registrar comandos
-        register_commands(dp)
-        logger.info("✅ Comandos registrados correctamente")
+        await iniciar_servicios()
         
         # Iniciar el bot
-        logger.info("🤖 Iniciando bot de Telegram...")
-        await dp.start_polling(bot)
+        logger.info(f"🤖 Iniciando bot de Telegram (modo {MODO_INGESTA})...")
+        if MODO_INGESTA == "webhook":
+            await receptor_webhook.ejecutar(bot, dp)
+        elif DESPACHO_POR_USUARIO:
+            await ejecutar_polling(bot, dp)
+        else:
+            await dp.start_polling(bot)
         
     except Exception as e:
         logger.error(f"❌ Error iniciando el bot: {e}")
         raise
+    finally:
+        await detener_tareas()
+
+async def main_worker(indice: int, total: int, cola):
+    """Función principal de un proceso worker del modo supervisor"""
+    try:
+        logger.info(f"🚀 Iniciando worker {indice}/{total}...")
+        await iniciar_servicios(indice, total)
+        await consumir_cola(bot, dp, cola)
+    except Exception as e:
+        logger.error(f"❌ Error en worker {indice}: {e}")
+        raise
+    finally:
+        await detener_tareas()
+
+def ejecutar_worker(indice: int, total: int, cola):
+    """Punto de entrada de un proceso worker (lo detiene el supervisor, no Ctrl+C)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(main_worker(indice, total, cola))
+
+def ejecutar_supervisor():
+    """Reparte los updates entre PROCESOS_WORKERS procesos"""
+    register_commands(dp)
+    supervisor = Supervisor(PROCESOS_WORKERS, ejecutar_worker, dp.resolve_used_update_types())
+    asyncio.run(supervisor.ejecutar())
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if PROCESOS_WORKERS > 1 and MODO_INGESTA == "polling":
+            ejecutar_supervisor()
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("🛑 Bot detenido por el usuario")
     except Exception as e:
@@ -0,0 +1,322 @@
+import datetime
+from typing import Any, Dict, Optional
+from pymongo import ReturnDocument
+from utils.database import (
+    usuarios_col,
+    invalidar_usuario,
+    incrementar_contador_nfts,
+    log_action
+)
+from utils.logging_config import get_logger
+from utils.muestreo import MuestreadorAlias
+from config.config import CAJA_SORPRESA_ACTIVA
+
+logger = get_logger(__name__)
+
+# Configuración de cooldowns (en horas)
+COOLDOWNS = {
+    'caja_sorpresa': 24,  # 24 horas de cooldown
+    'pelea': 6,           # 6 horas de cooldown
+    'expedicion': 12,     # 12 horas de cooldown
+    'capturar': 8         # 8 horas de cooldown
+}
+
+# Configuración de recompensas
+# Propuesta pendiente de aprobación: el handler original usaba esta tabla sin
+# definirla, así que la caja nunca llegó a pagar. Cambia la economía (se compra
+# con TON), por eso la actividad solo existe con CAJA_SORPRESA_ACTIVA
+RECOMPENSAS_CAJA_SORPRESA = {
+    "nada": {"probabilidad": 45, "mensaje": "📦 La caja estaba vacía. ¡Suerte la próxima vez!"},
+    "hada": {"probabilidad": 35, "mensaje": "🎉 ¡La caja contenía 1 Hada!", "item": "hada", "cantidad": 1},
+    "elfo": {"probabilidad": 15, "mensaje": "🎉 ¡La caja contenía 1 Elfo!", "item": "elfo", "cantidad": 1},
+    "ton": {"probabilidad": 5, "mensaje": "💰 ¡La caja contenía 0.1 TON!", "ton": 0.1}
+}
+
+RECOMPENSAS_PELEA = {
+    "nada": {"probabilidad": 30, "mensaje": "💥 Perdiste la pelea. Mejora tu estrategia."},
+    "ganar": {"probabilidad": 70, "mensaje": "🏆 ¡Victoria! Ganaste 0.1 TON", "ton": 0.1}
+}
+
+RECOMPENSAS_EXPEDICION = {
+    "nada": {"probabilidad": 50, "mensaje": "🗺️ La expedición no encontró nada valioso."},
+    "hada": {"probabilidad": 40, "mensaje": "🎉 ¡La expedición encontró 1 Hada!", "item": "hada", "cantidad": 1},
+    "ton": {"probabilidad": 10, "mensaje": "💰 ¡La expedición encontró 0.05 TON!", "ton": 0.05}
+}
+
+RECOMPENSAS_CAPTURAR = {
+    "nada": {"probabilidad": 70, "mensaje": "⚔️ La criatura se escapó. Intenta de nuevo."},
+    "hada": {"probabilidad": 25, "mensaje": "🎉 ¡Capturaste 1 Hada!", "item": "hada", "cantidad": 1},
+    "elfo": {"probabilidad": 5, "mensaje": "🎉 ¡Capturaste 1 Elfo!", "item": "elfo", "cantidad": 1}
+}
+
+# Cajas que se abren con el botón de apertura múltiple
+CAJAS_POR_LOTE = 10
+
+# Nombres para mostrar de los items (singular, plural)
+NOMBRES_ITEMS = {
+    "hada": ("Hada", "Hadas"),
+    "elfo": ("Elfo", "Elfos"),
+    "genio": ("Genio", "Genios"),
+    "orco": ("Orco", "Orcos"),
+    "licantropo": ("Licántropo", "Licántropos"),
+}
+
+# Definición de las actividades de explorar. Claves de cada actividad:
+#   accion_log:  nombre de la acción en el log
+#   costo:       TON que se descuentan del balance
+#   requisitos:  items que hay que tener (se verifican, no se gastan)
+#   consume:     items que se gastan al realizar la actividad
+#   cooldown:    horas entre usos (None = sin cooldown)
+#   recompensas: tabla de recompensas con probabilidades que suman 100
+#   emoji:       emoji que se envía antes del resultado
+#   verbo:       texto para el aviso de cooldown ("Puedes <verbo> en ...")
+ACTIVIDADES: Dict[str, Dict[str, Any]] = {
+    "caja_sorpresa": {
+        "accion_log": "caja_sorpresa",
+        "costo": 0.05,
+        "requisitos": {},
+        "consume": {},
+        "cooldown": None,
+        "recompensas": RECOMPENSAS_CAJA_SORPRESA,
+        "emoji": "🎁",
+        "verbo": "abrir otra caja",
+    },
+    "pelea": {
+        "accion_log": "pelea",
+        "costo": 0,
+        "requisitos": {"licantropo": 3},
+        "consume": {},
+        "cooldown": COOLDOWNS["pelea"],
+        "recompensas": RECOMPENSAS_PELEA,
+        "emoji": "⚔️",
+        "verbo": "pelear",
+    },
+    "expedicion": {
+        "accion_log": "expedicion",
+        "costo": 0,
+        "requisitos": {"elfo": 1, "genio": 1, "orco": 1},
+        "consume": {},
+        "cooldown": COOLDOWNS["expedicion"],
+        "recompensas": RECOMPENSAS_EXPEDICION,
+        "emoji": "🗺️",
+        "verbo": "hacer expedición",
+    },
+    "capturar": {
+        "accion_log": "capturar_criatura",
+        "costo": 0,
+        "requisitos": {"licantropo": 1, "orco": 2},
+        "consume": {},
+        "cooldown": COOLDOWNS["capturar"],
+        "recompensas": RECOMPENSAS_CAPTURAR,
+        "emoji": "🏹",
+        "verbo": "capturar",
+    },
+}
+
+# La Caja Sorpresa se queda fuera hasta que se apruebe su tabla (el simulador
+# la sigue evaluando con ACTIVIDAD_CAJA_SORPRESA)
+ACTIVIDAD_CAJA_SORPRESA = ACTIVIDADES["caja_sorpresa"]
+if not CAJA_SORPRESA_ACTIVA:
+    del ACTIVIDADES["caja_sorpresa"]
+
+# Muestreadores compilados una vez por actividad (valida las tablas al importar)
+MUESTREADORES: Dict[str, MuestreadorAlias] = {
+    actividad: MuestreadorAlias(config["recompensas"])
+    for actividad, config in ACTIVIDADES.items()
+}
+
+def elegir_recompensa(actividad: str) -> dict:
+    """Obtiene una recompensa aleatoria de la actividad basada en las probabilidades"""
+    return MUESTREADORES[actividad].muestrear()
+
+def fin_cooldown(cooldowns: dict, actividad: str, ahora: datetime.datetime = None) -> Optional[datetime.datetime]:
+    """Devuelve cuándo termina el cooldown de una actividad, o None si está disponible"""
+    horas = ACTIVIDADES[actividad]["cooldown"] if actividad in ACTIVIDADES else COOLDOWNS.get(actividad, 24)
+    ultima_actividad = (cooldowns or {}).get(actividad)
+    if not horas or not ultima_actividad:
+        return None
+
+    # Convertir string a datetime si es necesario
+    if isinstance(ultima_actividad, str):
+        ultima_actividad = datetime.datetime.fromisoformat(ultima_actividad.replace('Z', '+00:00'))
+
+    fin = ultima_actividad + datetime.timedelta(hours=horas)
+    return fin if fin > (ahora or datetime.datetime.now()) else None
+
+def formatear_items(items: Dict[str, int]) -> str:
+    """Formatea items como '1 Elfo, 1 Genio y 1 Orco'"""
+    partes = []
+    for item, cantidad in items.items():
+        singular, plural = NOMBRES_ITEMS.get(item, (item.title(), item.title()))
+        partes.append(f"{cantidad} {singular if cantidad == 1 else plural}")
+    if len(partes) <= 1:
+        return "".join(partes)
+    return f"{', '.join(partes[:-1])} y {partes[-1]}"
+
+def necesarios_actividad(actividad: str, veces: int = 1) -> Dict[str, int]:
+    """Items que hay que tener para realizar la actividad `veces` veces"""
+    config = ACTIVIDADES[actividad]
+    necesarios = dict(config["requisitos"])
+    for item, cantidad in config["consume"].items():
+        necesarios[item] = max(necesarios.get(item, 0), cantidad * veces)
+    return necesarios
+
+def _sumar_recompensas(actividad: str, veces: int) -> Dict[str, Any]:
+    """Sortea `veces` recompensas en un lote y agrega el TON y los items ganados"""
+    conteos = MUESTREADORES[actividad].conteos(veces)
+    ton = 0.0
+    items: Dict[str, int] = {}
+    for clave, veces_clave in conteos.items():
+        if not veces_clave:
+            continue
+        recompensa = ACTIVIDADES[actividad]["recompensas"][clave]
+        if "ton" in recompensa:
+            ton += recompensa["ton"] * veces_clave
+        if "item" in recompensa:
+            items[recompensa["item"]] = items.get(recompensa["item"], 0) + recompensa["cantidad"] * veces_clave
+    return {"conteos": conteos, "ton": round(ton, 9), "items": items}
+
+def _construir_operacion(user_id: int, config: dict, actividad: str, veces: int, ganado: dict, ahora: datetime.datetime) -> tuple:
+    """Construye el filtro y la actualización de `veces` ejecuciones de la actividad"""
+    filtro: Dict[str, Any] = {"user_id": user_id}
+    incrementos: Dict[str, float] = {}
+
+    def sumar(campo: str, valor: float) -> None:
+        incrementos[campo] = incrementos.get(campo, 0) + valor
+
+    costo = config["costo"] * veces
+    if costo:
+        filtro["balance"] = {"$gte": costo}
+        sumar("balance", -costo)
+
+    for item, cantidad in config["consume"].items():
+        sumar(f"inventario.{item}", -cantidad * veces)
+    # Lo que se consume también tiene que estar disponible
+    for item, cantidad in necesarios_actividad(actividad, veces).items():
+        filtro[f"inventario.{item}"] = {"$gte": cantidad}
+
+    actualizacion: Dict[str, Any] = {}
+    if config["cooldown"]:
+        limite = ahora - datetime.timedelta(hours=config["cooldown"])
+        fin = ahora + datetime.timedelta(hours=config["cooldown"])
+        # Sin campo (o con un valor antiguo en texto) la actividad está disponible
+        filtro[f"cooldowns.{actividad}"] = {"$not": {"$gt": limite}}
+        # El recordatorio de fin de cooldown se guarda en la misma escritura
+        actualizacion["$set"] = {
+            f"cooldowns.{actividad}": ahora,
+            f"recordatorios.{actividad}": fin
+        }
+        actualizacion["$min"] = {"proximo_recordatorio": fin}
+
+    sumar("balance", ganado["ton"])
+    for item, cantidad in ganado["items"].items():
+        sumar(f"inventario.{item}", cantidad)
+
+    incrementos = {campo: valor for campo, valor in incrementos.items() if valor}
+    if incrementos:
+        actualizacion["$inc"] = incrementos
+    if not actualizacion:
+        actualizacion["$set"] = {"ultima_actividad": ahora}
+
+    return filtro, actualizacion
+
+async def _diagnosticar_fallo(user_id: int, config: dict, actividad: str, veces: int, ahora: datetime.datetime) -> Dict[str, Any]:
+    """Lee el usuario para explicar por qué no se pudo realizar la actividad"""
+    usuario = await usuarios_col.find_one(
+        {"user_id": user_id},
+        {"balance": 1, "inventario": 1, f"cooldowns.{actividad}": 1}
+    )
+    if not usuario:
+        return {"ok": False, "motivo": "usuario"}
+
+    balance = float(usuario.get("balance", 0))
+    if config["costo"] and balance < config["costo"] * veces:
+        return {"ok": False, "motivo": "balance", "balance": balance}
+
+    inventario = usuario.get("inventario", {})
+    necesarios = necesarios_actividad(actividad, veces)
+    if any(inventario.get(item, 0) < cantidad for item, cantidad in necesarios.items()):
+        return {
+            "ok": False,
+            "motivo": "requisitos",
+            "tienes": {item: inventario.get(item, 0) for item in necesarios}
+        }
+
+    fin = fin_cooldown(usuario.get("cooldowns", {}), actividad, ahora)
+    if fin:
+        return {"ok": False, "motivo": "cooldown", "disponible_en": fin}
+
+    # Otra operación concurrente cambió el documento entre la escritura y la lectura
+    return {"ok": False, "motivo": "conflicto"}
+
+async def ejecutar_actividad(user_id: int, actividad: str, veces: int = 1) -> Dict[str, Any]:
+    """
+    Realiza una actividad de explorar con una sola actualización condicional.
+
+    Las recompensas se sortean antes de escribir. El filtro comprueba balance,
+    requisitos y cooldown, y la misma actualización descuenta el costo, gasta
+    los items consumidos, fija el cooldown y entrega la recompensa. Solo si la
+    actualización no aplica se lee el usuario para explicar el motivo.
+
+    Con `veces` > 1 (solo actividades sin cooldown) se cobran y sortean todas
+    las ejecuciones en un lote: una escritura, un log y un $inc agregado.
+
+    Args:
+        user_id: ID del usuario
+        actividad: Clave de ACTIVIDADES
+        veces: Número de ejecuciones
+
+    Returns:
+        {"ok": True, "recompensa": ..., "conteos": ..., "ton": ..., "items": ...}
+        o {"ok": False, "motivo": ...} con el motivo "usuario", "balance",
+        "requisitos", "cooldown", "conflicto" o "error". "recompensa" solo
+        está presente cuando `veces` es 1 y "disponible_en" (fin del nuevo
+        cooldown) solo en actividades con cooldown.
+    """
+    config = ACTIVIDADES[actividad]
+    if veces < 1 or (veces > 1 and config["cooldown"]):
+        raise ValueError(f"No se puede realizar {actividad} {veces} veces")
+
+    # MongoDB guarda milisegundos: se trunca para que las fechas escritas y las
+    # devueltas (p. ej. al programar el recordatorio) sean idénticas
+    ahora = datetime.datetime.now()
+    ahora = ahora.replace(microsecond=ahora.microsecond // 1000 * 1000)
+    ganado = _sumar_recompensas(actividad, veces)
+    if veces == 1:
+        recompensa = next(config["recompensas"][c] for c, n in ganado["conteos"].items() if n)
+    filtro, actualizacion = _construir_operacion(user_id, config, actividad, veces, ganado, ahora)
+
+    try:
+        usuario = await usuarios_col.find_one_and_update(
+            filtro, actualizacion,
+            projection={"_id": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if not usuario:
+            return await _diagnosticar_fallo(user_id, config, actividad, veces, ahora)
+    except Exception as e:
+        logger.error(f"Error ejecutando actividad {actividad} para {user_id}: {e}")
+        return {"ok": False, "motivo": "error"}
+    finally:
+        invalidar_usuario(user_id)
+
+    for item, cantidad in ganado["items"].items():
+        await incrementar_contador_nfts(item, cantidad)
+
+    detalles = {
+        "costo": config["costo"] * veces,
+        "requisitos": config["requisitos"],
+        "consume": config["consume"],
+    }
+    if veces == 1:
+        detalles["recompensa"] = recompensa
+    else:
+        detalles.update({"veces": veces, **ganado})
+    await log_action(user_id, config["accion_log"], details=detalles)
+
+    resultado = {"ok": True, **ganado}
+    if veces == 1:
+        resultado["recompensa"] = recompensa
+    if config["cooldown"]:
+        resultado["disponible_en"] = ahora + datetime.timedelta(hours=config["cooldown"])
+    return resultado
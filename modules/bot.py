@@ -12,10 +12,18 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode="HTML")
 )
 
+# Las respuestas de los handlers comparten el límite de la cola de envíos
+from utils.envios import cola_envios, LimitadorEnvios
+bot.session.middleware(LimitadorEnvios(cola_envios))
+
 # Configurar el dispatcher con storage en memoria
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
+# Registrar middleware de contexto de usuario (una lectura por update)
+from modules.contexto import UsuarioContextoMiddleware
+dp.update.outer_middleware(UsuarioContextoMiddleware())
+
 # Registrar middleware para tareas
 from modules.tareas import MundoMiticoNombreMiddleware
 dp.message.middleware(MundoMiticoNombreMiddleware())
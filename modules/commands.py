@@ -11,9 +11,12 @@ from aiogram.filters import Command
 # Constantes
 
 # Handlers principales
-from modules.start import start_handler, verificar_suscripcion_handler, perfil_handler
+from modules.start import start_handler, start_enlace_handler, verificar_suscripcion_handler, perfil_handler, miembro_canal_handler, CANALES_REQUERIDOS
 from modules.referidos import referidos_handler
 from modules.tareas import tareas_handler, register_tareas_handlers
+from modules.explorar import register_explorar_handlers
+from modules.difusion import register_difusion_handlers
+from modules.enrutador import enrutador
 
 # Configuración de administradores
 from config.config import is_admin
@@ -85,26 +88,31 @@ def register_commands(dp: Dispatcher):
     logger.info("🔧 Registrando comandos y handlers...")
     
     # Handlers principales (funcionan con mensajes y callbacks)
-    dp.message.register(start_handler, lambda m: m.text == "/start")
-    dp.callback_query.register(start_handler, lambda c: c.data == "start_volver")
+    enrutador.comando("/start", start_handler)
+    enrutador.comando_con_argumentos("/start", start_enlace_handler)
+    enrutador.callback("start_volver", start_handler)
     # VERIFICACIÓN DE CANALES COMENTADA - NO ES OBLIGATORIA
-    dp.callback_query.register(verificar_suscripcion_handler, lambda c: c.data == "verificar_suscripcion")
+    enrutador.callback("verificar_suscripcion", verificar_suscripcion_handler)
+    if CANALES_REQUERIDOS:
+        # Cambios de miembros de los canales (invalida la caché de suscripciones)
+        dp.chat_member.register(miembro_canal_handler)
     
-    dp.message.register(tareas_handler, lambda m: m.text == "/tareas")
-    dp.callback_query.register(tareas_handler, lambda c: c.data == "tareas")
+    enrutador.comando("/tareas", tareas_handler)
     
-    dp.message.register(referidos_handler, lambda m: m.text == "/referidos")
-    dp.callback_query.register(referidos_handler, lambda c: c.data == "referidos")
+    enrutador.comando("/referidos", referidos_handler)
+    enrutador.callback("referidos", referidos_handler)
     
     # Handler de perfil
-    dp.message.register(perfil_handler, lambda m: m.text == "/perfil")
-    dp.callback_query.register(perfil_handler, lambda c: c.data == "perfil")
+    enrutador.comando("/perfil", perfil_handler)
+    enrutador.callback("perfil", perfil_handler)
     
     # Comando para calcular ganancias manualmente
-    dp.message.register(ganancias_handler, lambda m: m.text == "/ganancias")
+    enrutador.comando("/ganancias", ganancias_handler)
     
     # Registrar handlers específicos de cada módulo
-    register_tareas_handlers(dp)
+    register_tareas_handlers(enrutador)
+    register_explorar_handlers(enrutador)
+    register_difusion_handlers(enrutador)
 
-    
+    enrutador.registrar(dp)
     logger.info("✅ Todos los comandos y handlers registrados correctamente")
\ No newline at end of file
@@ -0,0 +1,78 @@
+from typing import Any, Dict, List, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from utils.database import obtener_usuario
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Campos que necesitan los handlers de tareas (y el middleware de tareas)
+CAMPOS_TAREAS = ["user_id", "username", "first_name", "bio", "tareas", "inventario"]
+
+# Proyección usada cuando la ruta no tiene una específica
+PROYECCION_POR_DEFECTO = [
+    "user_id", "username", "first_name", "bio", "balance", "cooldowns",
+    "tareas", "inventario", "fecha_registro", "activo",
+    "referidos_total", "referidos_activos"
+]
+
+# Campos del documento de usuario que necesita cada ruta (callback_data o comando).
+# Lista vacía: los handlers de la ruta no reciben el documento y no se carga
+PROYECCIONES: Dict[str, List[str]] = {
+    # start_handler solo comprueba que el usuario exista (con obtener_usuario)
+    "start_volver": [],
+    "verificar_suscripcion": [],
+    "tareas": CAMPOS_TAREAS,
+    "actualizar_tareas": CAMPOS_TAREAS,
+    "referidos": ["user_id", "referidos_total", "referidos_activos"],
+    # Las actividades de explorar leen y escriben en una sola operación condicional
+    "explorar_caja_sorpresa": [],
+    "explorar_caja_sorpresa_lote": [],
+    "explorar_pelea": [],
+    "explorar_expedicion": [],
+    "explorar_capturar": [],
+    "explorar_cooldowns": ["user_id", "cooldowns"],
+}
+
+def obtener_ruta(update: Update) -> Optional[str]:
+    """Obtiene la ruta de un update: el callback_data o el comando del mensaje"""
+    if update.callback_query:
+        return update.callback_query.data
+    if update.message and update.message.text:
+        return update.message.text.split(maxsplit=1)[0]
+    return None
+
+class UsuarioContextoMiddleware(BaseMiddleware):
+    """
+    Middleware externo que carga el documento del usuario una sola vez por update.
+
+    El documento se pasa a los handlers y middlewares internos como
+    `data["usuario"]`, con solo los campos que necesita la ruta (None si el
+    usuario no existe). Se lee con obtener_usuario: un acierto de la caché de
+    usuarios no consulta la base de datos y un fallo lee el documento completo
+    y lo guarda en la caché, así los handlers que vuelven a pedir el usuario
+    (p. ej. obtener_inventario_usuario) no hacen otra consulta. Las rutas sin
+    campos no cargan nada.
+    """
+
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]):
+        user = data.get("event_from_user")
+        if user:
+            ruta = obtener_ruta(event)
+            # Los mensajes pasan por el middleware de tareas, que necesita el documento completo
+            if event.message:
+                campos = PROYECCION_POR_DEFECTO
+            else:
+                campos = PROYECCIONES.get(ruta, PROYECCION_POR_DEFECTO)
+
+            if campos:
+                try:
+                    usuario = await obtener_usuario(user.id)
+                    if usuario is not None:
+                        usuario = {campo: usuario[campo] for campo in campos if campo in usuario}
+                    data["usuario"] = usuario
+                except Exception as e:
+                    logger.error(f"Error cargando contexto de usuario {user.id}: {e}")
+                    data["usuario"] = None
+
+        return await handler(event, data)
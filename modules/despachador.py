@@ -0,0 +1,158 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from utils.logging_config import get_logger
+from utils.segundo_plano import al_detener, ORDEN_ENTRADA
+from config.config import DESPACHO_WORKERS, DESPACHO_MAX_PENDIENTES, DESPACHO_ESPERA_CIERRE
+
+logger = get_logger(__name__)
+
+def clave_update(update: Update) -> Hashable:
+    """Clave del carril de un update: el usuario que lo origina (o el propio update si no hay)"""
+    usuario = getattr(update.event, "from_user", None)
+    if usuario is not None:
+        return usuario.id
+    return ("update", update.update_id)
+
+class DespachadorPorUsuario:
+    """
+    Procesa updates en orden por usuario y en paralelo entre usuarios.
+
+    Cada usuario tiene un carril (cola FIFO) que solo atiende un worker a la
+    vez, así dos toques seguidos del mismo usuario nunca se ejecutan a la vez.
+    `workers` tareas atienden los carriles con trabajo; tras cada update el
+    carril vuelve al final de la fila de listos para repartir entre usuarios.
+    Los carriles vacíos se eliminan al momento, así que la memoria está
+    acotada por `max_pendientes` y no por el número de usuarios vistos.
+    """
+
+    def __init__(self, workers: int, max_pendientes: int, espera_cierre: float):
+        self.workers = workers
+        self.max_pendientes = max_pendientes
+        self.espera_cierre = espera_cierre
+        self.procesados = 0
+        # clave -> updates pendientes; el primero es el que se está procesando
+        self._carriles: Dict[Hashable, Deque[Update]] = {}
+        # Claves con trabajo que no está atendiendo ningún worker
+        self._listos: Optional[asyncio.Queue] = None
+        self._pendientes = 0
+        self._hay_espacio = asyncio.Event()
+        self._vacio = asyncio.Event()
+        self._tareas: List[asyncio.Task] = []
+        self._procesar: Optional[Callable[[Update], Awaitable]] = None
+
+    @property
+    def pendientes(self) -> int:
+        return self._pendientes
+
+    def iniciar(self, procesar: Callable[[Update], Awaitable]) -> None:
+        """Inicia los workers. `procesar` recibe cada update (p. ej. dp.feed_update)."""
+        self._procesar = procesar
+        self._listos = asyncio.Queue()
+        self._vacio.set()
+        self._tareas = [
+            asyncio.create_task(self._worker(), name=f"despachador_{i}")
+            for i in range(self.workers)
+        ]
+
+    def encolar_nowait(self, update: Update) -> None:
+        """Encola un update. Lanza asyncio.QueueFull si se alcanzó `max_pendientes`."""
+        if self._pendientes >= self.max_pendientes:
+            raise asyncio.QueueFull
+        self._pendientes += 1
+        self._vacio.clear()
+
+        clave = clave_update(update)
+        carril = self._carriles.get(clave)
+        if carril is None:
+            self._carriles[clave] = deque([update])
+            self._listos.put_nowait(clave)
+        else:
+            # El carril ya está en la fila de listos o lo está atendiendo un worker
+            carril.append(update)
+
+    async def encolar(self, update: Update) -> None:
+        """Encola un update esperando si la cola está llena (contrapresión)"""
+        while self._pendientes >= self.max_pendientes:
+            self._hay_espacio.clear()
+            await self._hay_espacio.wait()
+        self.encolar_nowait(update)
+
+    async def _worker(self) -> None:
+        while True:
+            clave = await self._listos.get()
+            carril = self._carriles[clave]
+            update = carril[0]
+            try:
+                await self._procesar(update)
+            except Exception as e:
+                logger.error(f"Error procesando update {update.update_id}: {e}")
+            finally:
+                carril.popleft()
+                if carril:
+                    self._listos.put_nowait(clave)
+                else:
+                    del self._carriles[clave]
+                self.procesados += 1
+                self._pendientes -= 1
+                self._hay_espacio.set()
+                if self._pendientes == 0:
+                    self._vacio.set()
+
+    async def detener(self) -> None:
+        """Espera hasta `espera_cierre` segundos a que se procesen los pendientes y detiene los workers"""
+        if self._pendientes:
+            vaciado = asyncio.ensure_future(self._vacio.wait())
+            await asyncio.wait({vaciado}, timeout=self.espera_cierre)
+            if not vaciado.done():
+                vaciado.cancel()
+                logger.warning(f"⚠️ {self._pendientes} updates sin procesar al detener")
+
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+async def sondear_updates(bot: Bot, dp: Dispatcher, despachador: DespachadorPorUsuario, timeout: int = 30) -> None:
+    """
+    Bucle de long polling que entrega los updates al despachador.
+
+    Sustituye a dp.start_polling (que lanza una tarea por update sin orden).
+    El offset solo avanza tras encolar, y encolar espera si el despachador
+    está lleno, así que un pico no se acumula en memoria.
+    """
+    offset = None
+    allowed_updates = dp.resolve_used_update_types()
+    espera_error = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset,
+                timeout=timeout,
+                allowed_updates=allowed_updates,
+                request_timeout=timeout + 10
+            )
+            espera_error = 1.0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error obteniendo updates: {e}")
+            await asyncio.sleep(espera_error)
+            espera_error = min(espera_error * 2, 60)
+            continue
+
+        for update in updates:
+            await despachador.encolar(update)
+            offset = update.update_id + 1
+
+async def ejecutar_polling(bot: Bot, dp: Dispatcher) -> None:
+    """Long polling con procesamiento ordenado por usuario (equivalente a start_polling)"""
+    despachador_updates.iniciar(lambda update: dp.feed_update(bot, update))
+    al_detener(despachador_updates.detener, ORDEN_ENTRADA)
+    await bot.delete_webhook()
+    logger.info(f"✅ Polling con despacho por usuario ({despachador_updates.workers} workers)")
+    await sondear_updates(bot, dp, despachador_updates)
+
+despachador_updates = DespachadorPorUsuario(DESPACHO_WORKERS, DESPACHO_MAX_PENDIENTES, DESPACHO_ESPERA_CIERRE)
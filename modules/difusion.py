@@ -0,0 +1,279 @@
+import asyncio
+import datetime
+import time
+from typing import Optional
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramForbiddenError
+from bson import ObjectId
+from pymongo import ReturnDocument
+from utils.database import usuarios_col, difusiones_col, invalidar_usuario
+from utils.envios import cola_envios, PRIORIDAD_DIFUSION
+from utils.logging_config import get_logger
+from utils.segundo_plano import iniciar_tarea
+from config.config import is_admin, DIFUSION_LOTE, DIFUSION_BLOQUEO
+
+logger = get_logger(__name__)
+
+# Destinatarios de una difusión: los usuarios que no bloquearon el bot
+FILTRO_DESTINATARIOS = {"activo": {"$ne": False}}
+
+def formatear_duracion(segundos: float) -> str:
+    """Formatea segundos como '1h 05m' o '3m 20s'"""
+    segundos = int(segundos)
+    if segundos >= 3600:
+        return f"{segundos // 3600}h {segundos % 3600 // 60:02d}m"
+    return f"{segundos // 60}m {segundos % 60:02d}s"
+
+class Difusor:
+    """
+    Envía un mensaje a todos los usuarios y se puede reanudar.
+
+    Recorre los usuarios por user_id ascendente (índice único) en lotes de
+    `tamano_lote`, paginando con `user_id > último`. Cada lote se encola en
+    la cola de envíos con prioridad de difusión, así sale al ritmo máximo
+    seguro sin adelantar a las notificaciones ni a las respuestas. Tras cada
+    lote se guardan en `difusiones` el último user_id y el progreso (con
+    velocidad y ETA): si el bot se reinicia la difusión continúa desde ahí
+    (como mucho se repite el lote en curso) y cualquier proceso puede
+    mostrar el estado. Los usuarios que bloquearon el bot se marcan
+    `activo: False` y las siguientes difusiones los omiten.
+
+    Con varios procesos, la difusión en curso la envía el proceso que tiene
+    su bloqueo (`propietario` y `bloqueo_hasta`), que lo renueva mientras
+    envía. Todos los procesos intentan reclamarla periódicamente
+    (reanudar), así que si el dueño se cae otro la continúa al vencer el
+    bloqueo.
+    """
+
+    def __init__(self, tamano_lote: int, bloqueo: float):
+        self.tamano_lote = tamano_lote
+        self.bloqueo = bloqueo
+        # Identifica a este proceso como dueño del bloqueo
+        self.propietario = ObjectId()
+        self._tarea: Optional[asyncio.Task] = None
+
+    def en_curso(self) -> bool:
+        return self._tarea is not None and not self._tarea.done()
+
+    def _fin_bloqueo(self) -> datetime.datetime:
+        return datetime.datetime.now() + datetime.timedelta(seconds=self.bloqueo)
+
+    async def iniciar(self, bot: Bot, texto: str, creador_id: int) -> dict:
+        """Crea una difusión nueva y empieza a enviarla"""
+        if self.en_curso() or await difusiones_col.find_one({"estado": "en_curso"}, {"_id": 1}):
+            raise ValueError("Ya hay una difusión en curso")
+
+        difusion = {
+            "texto": texto,
+            "creador_id": creador_id,
+            "estado": "en_curso",
+            "ultimo_user_id": None,
+            "total": await usuarios_col.count_documents(FILTRO_DESTINATARIOS),
+            "enviados": 0,
+            "bloqueados": 0,
+            "fallidos": 0,
+            "propietario": self.propietario,
+            "bloqueo_hasta": self._fin_bloqueo(),
+            "fecha_inicio": datetime.datetime.now()
+        }
+        result = await difusiones_col.insert_one(difusion)
+        difusion["_id"] = result.inserted_id
+        self._lanzar(bot, difusion)
+        return difusion
+
+    async def reanudar(self, bot: Bot) -> Optional[dict]:
+        """Reclama y continúa la difusión en curso si su bloqueo venció (dueño caído o reiniciado)"""
+        if self.en_curso():
+            return None
+        difusion = await difusiones_col.find_one_and_update(
+            {
+                "estado": "en_curso",
+                "$or": [
+                    {"bloqueo_hasta": {"$lte": datetime.datetime.now()}},
+                    {"bloqueo_hasta": {"$exists": False}},
+                    {"propietario": self.propietario}
+                ]
+            },
+            {"$set": {"propietario": self.propietario, "bloqueo_hasta": self._fin_bloqueo()}},
+            sort=[("fecha_inicio", -1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if difusion:
+            logger.info(f"📣 Reanudando difusión {difusion['_id']} desde user_id {difusion['ultimo_user_id']}")
+            self._lanzar(bot, difusion)
+        return difusion
+
+    async def cancelar(self) -> bool:
+        """
+        Cancela la difusión en curso. Los mensajes aún no enviados se
+        descartan; si la envía otro proceso, se detiene al renovar su bloqueo.
+        """
+        result = await difusiones_col.update_many(
+            {"estado": "en_curso"},
+            {"$set": {"estado": "cancelada", "fecha_fin": datetime.datetime.now()}}
+        )
+        if self.en_curso():
+            self._tarea.cancel()
+        return result.modified_count > 0
+
+    def _lanzar(self, bot: Bot, difusion: dict) -> None:
+        self._tarea = iniciar_tarea("difusion", self._ejecutar(bot, difusion))
+
+    async def _renovar_bloqueo(self, difusion_id: ObjectId) -> None:
+        """Renueva el bloqueo mientras se envía; si se pierde (cancelada u otro dueño) detiene el envío"""
+        while True:
+            await asyncio.sleep(self.bloqueo / 3)
+            result = await difusiones_col.update_one(
+                {"_id": difusion_id, "estado": "en_curso", "propietario": self.propietario},
+                {"$set": {"bloqueo_hasta": self._fin_bloqueo()}}
+            )
+            if result.matched_count == 0:
+                logger.info(f"🛑 Difusión {difusion_id} cancelada o reclamada por otro proceso")
+                self._tarea.cancel()
+                return
+
+    async def _ejecutar(self, bot: Bot, difusion: dict) -> None:
+        inicio = time.monotonic()
+        ultimo = difusion["ultimo_user_id"]
+        procesados = difusion["enviados"] + difusion["bloqueados"] + difusion["fallidos"]
+        procesados_sesion = 0
+        renovacion = asyncio.ensure_future(self._renovar_bloqueo(difusion["_id"]))
+
+        try:
+            while True:
+                filtro = dict(FILTRO_DESTINATARIOS)
+                if ultimo is not None:
+                    filtro["user_id"] = {"$gt": ultimo}
+                lote = await usuarios_col.find(filtro, {"_id": 0, "user_id": 1}) \
+                    .sort("user_id", 1).limit(self.tamano_lote).to_list(length=None)
+                if not lote:
+                    break
+
+                ids = [usuario["user_id"] for usuario in lote]
+                resultados = await asyncio.gather(*(
+                    cola_envios.encolar(bot, user_id, difusion["texto"], PRIORIDAD_DIFUSION, parse_mode="HTML")
+                    for user_id in ids
+                ), return_exceptions=True)
+
+                bloqueados = [
+                    user_id for user_id, resultado in zip(ids, resultados)
+                    if isinstance(resultado, TelegramForbiddenError)
+                ]
+                fallidos = sum(isinstance(resultado, BaseException) for resultado in resultados) - len(bloqueados)
+                if bloqueados:
+                    await usuarios_col.update_many({"user_id": {"$in": bloqueados}}, {"$set": {"activo": False}})
+                    for user_id in bloqueados:
+                        invalidar_usuario(user_id)
+
+                ultimo = ids[-1]
+                procesados += len(ids)
+                procesados_sesion += len(ids)
+                velocidad = procesados_sesion / max(time.monotonic() - inicio, 1e-6)
+                restantes = max(difusion["total"] - procesados, 0)
+                result = await difusiones_col.update_one(
+                    {"_id": difusion["_id"], "estado": "en_curso", "propietario": self.propietario},
+                    {
+                        "$set": {
+                            "ultimo_user_id": ultimo,
+                            "procesados": procesados,
+                            "velocidad": velocidad,
+                            "eta": restantes / velocidad,
+                            "bloqueo_hasta": self._fin_bloqueo()
+                        },
+                        "$inc": {
+                            "enviados": len(ids) - len(bloqueados) - fallidos,
+                            "bloqueados": len(bloqueados),
+                            "fallidos": fallidos
+                        }
+                    }
+                )
+                if result.matched_count == 0:
+                    logger.info(f"🛑 Difusión {difusion['_id']} cancelada o reclamada por otro proceso")
+                    return
+
+                logger.info(
+                    f"📣 Difusión: {procesados}/{difusion['total']} "
+                    f"({velocidad:.1f} msg/s, ETA {formatear_duracion(restantes / velocidad)})"
+                )
+
+            await difusiones_col.update_one(
+                {"_id": difusion["_id"], "estado": "en_curso", "propietario": self.propietario},
+                {"$set": {"estado": "completada", "fecha_fin": datetime.datetime.now()}}
+            )
+            logger.info(f"✅ Difusión {difusion['_id']} completada: {procesados} destinatarios")
+        except asyncio.CancelledError:
+            # Al detener el proceso se suelta el bloqueo: otro la reanuda sin esperar a que venza
+            try:
+                await difusiones_col.update_one(
+                    {"_id": difusion["_id"], "propietario": self.propietario},
+                    {"$set": {"bloqueo_hasta": datetime.datetime.now()}}
+                )
+            except Exception as e:
+                logger.warning(f"No se pudo soltar el bloqueo de la difusión {difusion['_id']}: {e}")
+            raise
+        except Exception as e:
+            # Queda en curso: al vencer el bloqueo se reanuda desde el último lote guardado
+            logger.error(f"Error en la difusión {difusion['_id']}: {e}")
+        finally:
+            renovacion.cancel()
+
+    async def estado(self) -> Optional[dict]:
+        """Devuelve la última difusión con su progreso (lo guarda el proceso que la envía)"""
+        return await difusiones_col.find_one({}, sort=[("fecha_inicio", -1)])
+
+difusor = Difusor(DIFUSION_LOTE, DIFUSION_BLOQUEO)
+
+# =========================
+# HANDLERS DE ADMINISTRACIÓN
+# =========================
+
+async def difundir_handler(message: types.Message, texto: str):
+    """/difundir <texto>: envía el texto (HTML) a todos los usuarios activos"""
+    if not is_admin(message.from_user.id):
+        return
+    if not texto:
+        await message.answer("Uso: /difundir <texto>")
+        return
+    try:
+        difusion = await difusor.iniciar(message.bot, texto, message.from_user.id)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    await message.answer(f"📣 Difusión iniciada para {difusion['total']} usuarios")
+
+async def difusion_estado_handler(message: types.Message):
+    """/difusion_estado: progreso de la última difusión"""
+    if not is_admin(message.from_user.id):
+        return
+    difusion = await difusor.estado()
+    if not difusion:
+        await message.answer("No hay difusiones")
+        return
+
+    mensaje = (
+        f"📣 Difusión ({difusion['estado']})\n\n"
+        f"Enviados: {difusion['enviados']}\n"
+        f"Bloqueados: {difusion['bloqueados']}\n"
+        f"Fallidos: {difusion['fallidos']}\n"
+    )
+    if "procesados" in difusion:
+        mensaje += f"Progreso: {difusion['procesados']}/{difusion['total']}\n"
+    if difusion.get("velocidad") and difusion["estado"] == "en_curso":
+        mensaje += f"Velocidad: {difusion['velocidad']:.1f} msg/s\n"
+        mensaje += f"Tiempo restante: {formatear_duracion(difusion['eta'])}\n"
+    await message.answer(mensaje)
+
+async def difusion_cancelar_handler(message: types.Message):
+    """/difusion_cancelar: detiene la difusión en curso"""
+    if not is_admin(message.from_user.id):
+        return
+    if await difusor.cancelar():
+        await message.answer("🛑 Difusión cancelada")
+    else:
+        await message.answer("No hay ninguna difusión en curso")
+
+def register_difusion_handlers(enrutador) -> None:
+    """Registra los comandos de difusión (solo administradores) en el enrutador"""
+    enrutador.comando_con_argumentos("/difundir", difundir_handler)
+    enrutador.comando("/difusion_estado", difusion_estado_handler)
+    enrutador.comando("/difusion_cancelar", difusion_cancelar_handler)
@@ -0,0 +1,103 @@
+from typing import Callable, Dict, Optional, Tuple
+from aiogram import Dispatcher
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.types import CallbackQuery, Message
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# (handler, argumentos posicionales extra)
+Destino = Tuple[CallableObject, tuple]
+
+class Enrutador:
+    """
+    Enruta callbacks y comandos con búsquedas en diccionarios.
+
+    Sustituye a registrar cada handler con `lambda c: c.data == "..."`, que
+    aiogram evalúa uno a uno y en orden. Aquí el callback_data o el texto del
+    comando se busca directamente; los callbacks con parámetro (p. ej.
+    `explorar_<actividad>`) se registran con un prefijo terminado en "_" y
+    solo se prueban los prefijos del propio callback_data, del más largo al
+    más corto. Una ruta exacta tiene prioridad sobre un prefijo. Registrar
+    dos veces la misma ruta lanza ValueError al arrancar.
+    """
+
+    def __init__(self):
+        self._callbacks: Dict[str, CallableObject] = {}
+        self._prefijos: Dict[str, CallableObject] = {}
+        self._comandos: Dict[str, CallableObject] = {}
+        self._comandos_con_argumentos: Dict[str, CallableObject] = {}
+
+    @staticmethod
+    def _agregar(tabla: Dict[str, CallableObject], clave: str, handler: Callable, tipo: str) -> None:
+        if clave in tabla:
+            raise ValueError(f"{tipo} registrado dos veces: {clave!r}")
+        tabla[clave] = CallableObject(handler)
+
+    def callback(self, ruta: str, handler: Callable) -> None:
+        """Registra el handler de un callback_data exacto"""
+        self._agregar(self._callbacks, ruta, handler, "Callback")
+
+    def prefijo(self, prefijo: str, handler: Callable) -> None:
+        """Registra `handler(callback, parametro)` para los callback_data `prefijo` + parametro"""
+        if not prefijo.endswith("_"):
+            raise ValueError(f"El prefijo debe terminar en '_': {prefijo!r}")
+        self._agregar(self._prefijos, prefijo, handler, "Prefijo")
+
+    def comando(self, texto: str, handler: Callable) -> None:
+        """Registra el handler de un mensaje con texto exacto (p. ej. '/start')"""
+        self._agregar(self._comandos, texto, handler, "Comando")
+
+    def comando_con_argumentos(self, comando: str, handler: Callable) -> None:
+        """Registra `handler(message, argumentos)` para '/comando' seguido de texto libre"""
+        self._agregar(self._comandos_con_argumentos, comando, handler, "Comando")
+
+    def resolver_callback(self, data: str) -> Optional[Destino]:
+        """Busca el handler de un callback_data: primero exacto y luego por prefijo"""
+        handler = self._callbacks.get(data)
+        if handler is not None:
+            return handler, ()
+
+        fin = data.rfind("_")
+        while fin > 0:
+            handler = self._prefijos.get(data[:fin + 1])
+            if handler is not None:
+                return handler, (data[fin + 1:],)
+            fin = data.rfind("_", 0, fin)
+        return None
+
+    def resolver_comando(self, texto: str) -> Optional[Destino]:
+        """Busca el handler de un mensaje: texto exacto o comando con argumentos"""
+        handler = self._comandos.get(texto)
+        if handler is not None:
+            return handler, ()
+        partes = texto.split(maxsplit=1)
+        handler = self._comandos_con_argumentos.get(partes[0]) if partes else None
+        if handler is None:
+            return None
+        return handler, (partes[1] if len(partes) > 1 else "",)
+
+    def _filtro_callback(self, callback: CallbackQuery):
+        destino = self.resolver_callback(callback.data) if callback.data else None
+        return {"destino_ruta": destino} if destino else False
+
+    def _filtro_mensaje(self, message: Message):
+        destino = self.resolver_comando(message.text) if message.text else None
+        return {"destino_ruta": destino} if destino else False
+
+    async def _ejecutar(self, event, destino_ruta: Destino, **kwargs):
+        # CallableObject pasa al handler solo los argumentos que declara (usuario, bot...)
+        handler, argumentos = destino_ruta
+        return await handler.call(event, *argumentos, **kwargs)
+
+    def registrar(self, dp: Dispatcher) -> None:
+        """Registra el enrutador en el dispatcher: un único handler por tipo de evento"""
+        dp.message.register(self._ejecutar, self._filtro_mensaje)
+        dp.callback_query.register(self._ejecutar, self._filtro_callback)
+        logger.info(
+            f"✅ Enrutador: {len(self._callbacks)} callbacks, "
+            f"{len(self._prefijos)} prefijos, "
+            f"{len(self._comandos) + len(self._comandos_con_argumentos)} comandos"
+        )
+
+enrutador = Enrutador()
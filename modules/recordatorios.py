@@ -0,0 +1,134 @@
+import asyncio
+import datetime
+import heapq
+from typing import List, Tuple
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from utils.database import usuarios_col, invalidar_usuario
+from utils.logging_config import get_logger
+from utils.segundo_plano import iniciar_tarea
+from utils.envios import cola_envios
+from modules.actividades import ACTIVIDADES
+from config.config import RECORDATORIOS_POR_SEGUNDO
+
+logger = get_logger(__name__)
+
+class ProgramadorRecordatorios:
+    """
+    Avisa a cada usuario cuando termina el cooldown de una actividad.
+
+    Los vencimientos pendientes viven en un min-heap en memoria (programar es
+    O(log n)) y el bucle duerme hasta el más próximo, sin recorrer la base de
+    datos. La fuente de verdad es `recordatorios.<actividad>` en el documento
+    del usuario, con `proximo_recordatorio` (indexado) como el más cercano;
+    al iniciar el heap se reconstruye solo desde los usuarios con recordatorios.
+    """
+
+    def __init__(self, avisos_por_segundo: float):
+        self.avisos_por_segundo = avisos_por_segundo
+        # (vencimiento, user_id, actividad)
+        self._heap: List[Tuple[datetime.datetime, int, str]] = []
+        self._cambio = asyncio.Event()
+        self.activo = False
+        # Partición de usuarios de este proceso (índice, total) en modo supervisor
+        self.particion: Tuple[int, int] = (0, 1)
+
+    def iniciar(self, bot: Bot, indice: int = 0, total: int = 1) -> None:
+        """Inicia el envío de recordatorios de los usuarios con user_id % total == indice"""
+        self.activo = True
+        self.particion = (indice, total)
+        iniciar_tarea("recordatorios", self.ejecutar(bot))
+
+    def programar(self, user_id: int, actividad: str, vencimiento: datetime.datetime) -> None:
+        """Programa un aviso. Despierta el bucle si es el vencimiento más próximo."""
+        if not self.activo:
+            return
+        heapq.heappush(self._heap, (vencimiento, user_id, actividad))
+        if self._heap[0][0] == vencimiento:
+            self._cambio.set()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    async def reconstruir(self) -> int:
+        """Carga en el heap los recordatorios guardados en la base de datos"""
+        entradas = []
+        filtro = {"proximo_recordatorio": {"$ne": None}}
+        indice, total = self.particion
+        if total > 1:
+            filtro["user_id"] = {"$mod": [total, indice]}
+        cursor = usuarios_col.find(filtro, {"user_id": 1, "recordatorios": 1})
+        async for usuario in cursor:
+            for actividad, vencimiento in (usuario.get("recordatorios") or {}).items():
+                if isinstance(vencimiento, datetime.datetime):
+                    entradas.append((vencimiento, usuario["user_id"], actividad))
+
+        self._heap.extend(entradas)
+        heapq.heapify(self._heap)
+        self._cambio.set()
+        logger.info(f"✅ {len(entradas)} recordatorios de cooldown cargados")
+        return len(entradas)
+
+    async def ejecutar(self, bot: Bot) -> None:
+        """Bucle principal: espera al próximo vencimiento y envía los avisos"""
+        pausa = 1 / self.avisos_por_segundo if self.avisos_por_segundo > 0 else 0
+        await self.reconstruir()
+
+        while True:
+            self._cambio.clear()
+            if not self._heap:
+                await self._cambio.wait()
+                continue
+
+            espera = (self._heap[0][0] - datetime.datetime.now()).total_seconds()
+            if espera > 0:
+                # asyncio.wait (a diferencia de wait_for) nunca oculta una cancelación
+                cambio = asyncio.ensure_future(self._cambio.wait())
+                try:
+                    await asyncio.wait({cambio}, timeout=espera)
+                finally:
+                    if not cambio.done():
+                        cambio.cancel()
+                continue
+
+            vencimiento, user_id, actividad = heapq.heappop(self._heap)
+            try:
+                await self._avisar(bot, user_id, actividad, vencimiento)
+            except Exception as e:
+                logger.error(f"Error enviando recordatorio de {actividad} a {user_id}: {e}")
+            await asyncio.sleep(pausa)
+
+    async def _avisar(self, bot: Bot, user_id: int, actividad: str, vencimiento: datetime.datetime) -> None:
+        """Marca el recordatorio como enviado y avisa al usuario (como máximo una vez)"""
+        # Se borra el recordatorio y se recalcula el próximo en la misma escritura.
+        # Si ya no coincide (enviado o reprogramado) la entrada del heap está obsoleta.
+        result = await usuarios_col.update_one(
+            {"user_id": user_id, f"recordatorios.{actividad}": vencimiento},
+            [
+                {"$unset": f"recordatorios.{actividad}"},
+                {"$set": {"proximo_recordatorio": {"$ifNull": [
+                    {"$min": {"$map": {
+                        "input": {"$objectToArray": {"$ifNull": ["$recordatorios", {}]}},
+                        "in": "$$this.v"
+                    }}},
+                    "$$REMOVE"
+                ]}}}
+            ]
+        )
+        if result.modified_count == 0:
+            return
+        invalidar_usuario(user_id)
+
+        config = ACTIVIDADES.get(actividad, {})
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🌍 Explorar", callback_data="explorar")]
+        ])
+        # Si el usuario bloqueó el bot el envío falla (lo registra la cola): el recordatorio ya se consumió
+        cola_envios.encolar(
+            bot,
+            user_id,
+            f"{config.get('emoji', '⏰')} ¡Ya puedes {config.get('verbo', actividad)} de nuevo!",
+            reply_markup=keyboard
+        )
+
+programador_recordatorios = ProgramadorRecordatorios(RECORDATORIOS_POR_SEGUNDO)
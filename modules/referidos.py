@@ -1,11 +1,19 @@
 from aiogram import types
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from utils.cache_telegram import cache_telegram
 from utils.database import (
+    agregar_referido,
     contar_referidos,
-    contar_referidos_activos
+    contar_referidos_activos,
+    obtener_usuario,
+    mensaje_nuevo_referido,
+    mensaje_has_sido_referido,
+    entregar_recompensas_referidos
 )
+from utils.envios import cola_envios
+from utils.trabajos import cola_trabajos
 
-async def referidos_handler(event):
+async def referidos_handler(event, usuario: dict = None):
     """Handler de referidos (funciona con mensajes y callbacks)"""
     # Determinar si es un mensaje o callback
     if hasattr(event, 'from_user'):
@@ -14,12 +22,12 @@ async def referidos_handler(event):
     else:
         return
     
-    bot_username = (await event.bot.get_me()).username
+    bot_username = (await cache_telegram.get_me(event.bot)).username
     ref_link = f"https://t.me/{bot_username}?start=ref_{user_id}"
 
     # Obtener progreso de referidos
-    total = await contar_referidos(user_id)
-    activos = await contar_referidos_activos(user_id)
+    total = await contar_referidos(user_id, usuario)
+    activos = await contar_referidos_activos(user_id, usuario)
 
     mensaje = (
         "<b>👥 Referrals</b>\n\n"
@@ -54,4 +62,64 @@ async def referidos_handler(event):
                 await event.message.answer(mensaje, parse_mode="HTML", reply_markup=share_keyboard)
         await event.answer()
     else:
-        await event.answer(mensaje, parse_mode="HTML", reply_markup=share_keyboard)
\ No newline at end of file
+        await event.answer(mensaje, parse_mode="HTML", reply_markup=share_keyboard)
+
+# =========================
+# TRABAJOS DE REFERIDOS
+# =========================
+# /start solo registra el referido; notificaciones y recompensas van a la
+# cola de trabajos (una clave por referido: repetir /start no los duplica).
+# Los trabajos dejan pasar los errores: así la cola los reintenta en vez de
+# darlos por completados
+
+async def encolar_nuevo_referido(referidor_id: int, referido_id: int, referido_name: str,
+                                 numero: int, session=None) -> None:
+    """Encola los efectos secundarios de un referido recién registrado (`numero` lo da agregar_referido)"""
+    datos = {
+        "referidor_id": referidor_id,
+        "referido_id": referido_id,
+        "referido_name": referido_name,
+        "numero": numero
+    }
+    # Uno tras otro: una sesión no admite operaciones concurrentes
+    await cola_trabajos.encolar(
+        "referido_notificaciones", datos,
+        f"referido_notificaciones:{referidor_id}:{referido_id}", session=session
+    )
+    await cola_trabajos.encolar(
+        "referido_recompensas", datos,
+        f"referido_recompensas:{referidor_id}:{referido_id}", session=session
+    )
+
+async def registrar_referido(referidor_id: int, referido_id: int, referido_name: str) -> bool:
+    """
+    Registra el referido y encola sus trabajos con la misma escritura
+    (transacción si hay replica set). Devuelve False si ya estaba registrado.
+    """
+    async def encolar(numero: int, session) -> None:
+        await encolar_nuevo_referido(referidor_id, referido_id, referido_name, numero, session=session)
+
+    return await agregar_referido(referidor_id, referido_id, al_agregar=encolar) is not None
+
+async def trabajo_notificaciones_referido(bot, datos: dict) -> None:
+    """
+    Avisa al referidor del nuevo referido y al referido de quién lo invitó.
+
+    Espera a que Telegram acepte cada mensaje: si el proceso cae con el
+    mensaje aún en la cola de envíos (en memoria) el trabajo se repite.
+    """
+    referidor = await obtener_usuario(datos["referidor_id"])
+    referidor_name = (referidor or {}).get("first_name") or "User"
+    await cola_envios.encolar(
+        bot, datos["referidor_id"], mensaje_nuevo_referido(datos["referido_id"], datos["referido_name"])
+    )
+    await cola_envios.encolar(bot, datos["referido_id"], mensaje_has_sido_referido(referidor_name))
+
+async def trabajo_recompensas_referido(bot, datos: dict) -> None:
+    """Entrega las recompensas del referidor: el Hada según el número de este referido"""
+    await entregar_recompensas_referidos(bot, datos["referidor_id"], datos.get("numero"))
+
+def registrar_trabajos_referidos(cola) -> None:
+    """Registra los tipos de trabajo de referidos en la cola de trabajos"""
+    cola.registrar("referido_notificaciones", trabajo_notificaciones_referido)
+    cola.registrar("referido_recompensas", trabajo_recompensas_referido)
@@ -1,46 +1,78 @@
 from aiogram import types
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from utils.database import procesar_nuevo_referido, obtener_usuario_por_username
+from modules.referidos import registrar_referido
+from utils.cache_telegram import cache_telegram, ESTADOS_NO_MIEMBRO
+import asyncio
 import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
 # Importar configuración de canales
-from config.config import REQUIRED_CHANNELS
+from config.config import REQUIRED_CHANNELS, SUSCRIPCION_TIMEOUT
 
 # Configuración de canales requeridos
 CANALES_REQUERIDOS = REQUIRED_CHANNELS
 
-async def verificar_suscripcion_canales(bot, user_id: int) -> tuple[bool, list]:
+async def _es_miembro(bot, canal: dict, user_id: int, refrescar: bool) -> bool:
+    """Consulta (con caché) si el usuario está en un canal; ante un error cuenta como no suscrito"""
+    try:
+        chat_member = await cache_telegram.get_chat_member(bot, canal["id"], user_id, refrescar)
+        return chat_member.status not in ESTADOS_NO_MIEMBRO
+    except Exception as e:
+        logger.warning(f"Error verificando suscripción a {canal['id']} para user_id={user_id}: {e}")
+        return False
+
+async def verificar_suscripcion_canales(bot, user_id: int, refrescar: bool = False) -> tuple[bool, list]:
     """
     Verifica si el usuario está suscrito a los canales requeridos.
     
+    Los canales se consultan a la vez y como mucho SUSCRIPCION_TIMEOUT
+    segundos; un canal que no responde a tiempo cuenta como no suscrito.
+    
     Args:
         bot: Instancia del bot
         user_id: ID del usuario
+        refrescar: Consultar a Telegram aunque el estado esté en caché
         
     Returns:
         Tuple con (está_suscrito, canales_faltantes)
     """
+    if not CANALES_REQUERIDOS:
+        return True, []
+
+    tareas = [
+        asyncio.ensure_future(_es_miembro(bot, canal, user_id, refrescar))
+        for canal in CANALES_REQUERIDOS
+    ]
+    try:
+        terminadas, _ = await asyncio.wait(tareas, timeout=SUSCRIPCION_TIMEOUT)
+    finally:
+        for tarea in tareas:
+            if not tarea.done():
+                tarea.cancel()
+
     canales_faltantes = []
-    
-    for canal in CANALES_REQUERIDOS:
-        try:
-            # Intentar obtener el estado del usuario en el canal
-            chat_member = await bot.get_chat_member(canal["id"], user_id)
-            
-            # Verificar si el usuario está suscrito
-            if chat_member.status in ["left", "kicked"]:
-                canales_faltantes.append(canal)
-                
-        except Exception as e:
-            logger.warning(f"Error verificando suscripción a {canal['id']} para user_id={user_id}: {e}")
+    for canal, tarea in zip(CANALES_REQUERIDOS, tareas):
+        if tarea not in terminadas:
+            logger.warning(f"Tiempo agotado verificando suscripción a {canal['id']} para user_id={user_id}")
+            canales_faltantes.append(canal)
+        elif not tarea.result():
             canales_faltantes.append(canal)
     
     return len(canales_faltantes) == 0, canales_faltantes
 
+async def miembro_canal_handler(event: types.ChatMemberUpdated):
+    """
+    Update chat_member de un canal requerido (llega si el bot es administrador):
+    invalida la suscripción en caché del usuario para que se vuelva a consultar.
+    """
+    user_id = event.new_chat_member.user.id
+    cache_telegram.invalidar_miembro(event.chat.id, user_id)
+    if event.chat.username:
+        cache_telegram.invalidar_miembro(f"@{event.chat.username}", user_id)
+
 def crear_teclado_verificacion_canales(canales_faltantes: list) -> InlineKeyboardMarkup:
     """
     Crea el teclado para la verificación de canales con estilo similar a la imagen.
@@ -61,7 +93,7 @@ def crear_teclado_verificacion_canales(canales_faltantes: list) -> InlineKeyboar
     
     return builder.as_markup()
 
-async def start_handler(event):
+async def start_handler(event, usuario: dict = None):
     """Handler de start (funciona con mensajes y callbacks)"""
     # Determinar si es un mensaje o callback
     if hasattr(event, 'from_user'):
@@ -73,10 +105,11 @@ async def start_handler(event):
         return
     
     # Importación local para evitar import circular
-    from utils.database import usuarios_col
+    from utils.database import usuarios_col, obtener_usuario
     
-    # Verificar si el usuario ya existe
-    usuario = await usuarios_col.find_one({"user_id": user_id})
+    # Verificar si el usuario ya existe (si no lo cargó el middleware de contexto)
+    if usuario is None:
+        usuario = await obtener_usuario(user_id)
     
     if not usuario:
         # Usuario nuevo - crear usuario
@@ -89,6 +122,11 @@ async def start_handler(event):
             "activo": True
         })
         usuario = await usuarios_col.find_one({"user_id": user_id})
+    elif not is_callback and usuario.get("activo") is False:
+        # Marcado inactivo por una difusión (había bloqueado el bot): vuelve a recibirlas
+        from utils.database import invalidar_usuario
+        await usuarios_col.update_one({"user_id": user_id}, {"$set": {"activo": True}})
+        invalidar_usuario(user_id)
     
     # VERIFICACIÓN DE CANALES COMENTADA - NO ES OBLIGATORIA
      # Usuario existe - verificar canales
@@ -118,23 +156,12 @@ async def start_handler(event):
             try:
                 referidor_id = int(args.replace("ref_", ""))
                 if referidor_id != user_id:
-                    # Obtener nombres para las notificaciones
-                    referidor = await obtener_usuario_por_username(username) or await usuarios_col.find_one({"user_id": referidor_id})
-                    referidor_name = referidor.get("first_name", "User") if referidor else "User"
-                    referido_name = first_name or username or "User"
-                    
-                    # Procesar referido con notificaciones
-                    await procesar_nuevo_referido(
-                        event.bot, 
-                        referidor_id, 
-                        user_id, 
-                        referido_name, 
-                        referidor_name
-                    )
+                    # Solo se registra el referido; notificaciones y recompensas van a la cola de trabajos
+                    await registrar_referido(referidor_id, user_id, first_name or username or "User")
             except ValueError:
                 pass  # El argumento no es un número válido
             except Exception as e:
-                print(f"Error al procesar referido: {e}")
+                logger.error(f"Error al procesar referido {args} para user_id={user_id}: {e}")
 
     welcome_text = (
         "👋 <b>Welcome to Mystic World!\n\n"
@@ -167,13 +194,17 @@ async def start_handler(event):
     else:
         await event.answer(welcome_text, parse_mode="HTML", reply_markup=keyboard)
     
+async def start_enlace_handler(message: types.Message, argumentos: str, usuario: dict = None):
+    """/start con parámetro (enlace t.me/bot?start=ref_<id>): start_handler lee el parámetro del texto"""
+    await start_handler(message, usuario)
+
 # VERIFICACIÓN DE CANALES COMENTADA - NO ES OBLIGATORIA
-async def verificar_suscripcion_handler(callback: types.CallbackQuery):
+async def verificar_suscripcion_handler(callback: types.CallbackQuery, usuario: dict = None):
     """Handler para verificar la suscripción a canales"""
     user_id = callback.from_user.id
     
     try:
-        # Verificar suscripción nuevamente
+        # Verificar suscripción nuevamente (solo se cachean los canales en los que ya está)
         esta_suscrito, canales_faltantes = await verificar_suscripcion_canales(callback.bot, user_id)
         
         if esta_suscrito:
@@ -181,7 +212,7 @@ async def verificar_suscripcion_handler(callback: types.CallbackQuery):
             await callback.answer("Welcome to Mystic World!", show_alert=True)
             
             # Llamar al start_handler para mostrar el menú principal
-            await start_handler(callback)
+            await start_handler(callback, usuario)
             
         else:
             # Usuario aún no está suscrito
@@ -0,0 +1,223 @@
+import asyncio
+import signal
+import time
+import multiprocessing
+from typing import Callable, List, Optional
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from utils.logging_config import get_logger
+from modules.despachador import despachador_updates
+from config.config import BOT_TOKEN, DESPACHO_MAX_PENDIENTES, DESPACHO_ESPERA_CIERRE
+
+logger = get_logger(__name__)
+
+# Los workers se crean con "spawn": cada uno arranca limpio con su propio
+# pool de MongoDB y su propio bucle de eventos
+CONTEXTO = multiprocessing.get_context("spawn")
+
+# Segundos sin caerse para considerar estable a un worker (se reinicia el backoff)
+WORKER_ESTABLE = 30
+
+def user_id_de_update(datos: dict) -> int:
+    """Obtiene el usuario que origina un update sin validarlo con aiogram"""
+    for clave, evento in datos.items():
+        if clave == "update_id" or not isinstance(evento, dict):
+            continue
+        usuario = evento.get("from") or evento.get("user")
+        if usuario:
+            return usuario["id"]
+        chat = evento.get("chat") or {}
+        return chat.get("id", datos["update_id"])
+    return datos["update_id"]
+
+async def consumir_cola(bot: Bot, dp: Dispatcher, cola) -> None:
+    """
+    Bucle de un worker: lee updates (dicts) de su cola y los procesa en el
+    despachador por usuario. Termina al recibir None.
+    """
+    loop = asyncio.get_running_loop()
+    despachador_updates.iniciar(lambda update: dp.feed_update(bot, update))
+    while True:
+        datos = await loop.run_in_executor(None, cola.get)
+        if datos is None:
+            break
+        try:
+            update = Update.model_validate(datos, context={"bot": bot})
+        except Exception as e:
+            logger.warning(f"Update inválido descartado: {e}")
+            continue
+        await despachador_updates.encolar(update)
+    await despachador_updates.detener()
+
+class Supervisor:
+    """
+    Reparte los updates de getUpdates entre `total` procesos worker.
+
+    Cada update va al worker `user_id % total`, así los updates de un usuario
+    siempre los procesa el mismo worker y en orden. El supervisor no valida
+    los updates: solo decodifica el JSON y los reenvía. Reinicia los workers
+    que se caen (con espera creciente si se caen al arrancar), hace reinicio
+    escalonado con SIGHUP y detención ordenada con SIGINT/SIGTERM.
+    """
+
+    def __init__(self, total: int, objetivo: Callable, allowed_updates: List[str]):
+        self.total = total
+        self.objetivo = objetivo
+        self.allowed_updates = allowed_updates
+        self.colas = [CONTEXTO.Queue(maxsize=DESPACHO_MAX_PENDIENTES) for _ in range(total)]
+        self.procesos: List[Optional[multiprocessing.Process]] = [None] * total
+        self._inicios = [0.0] * total
+        self._esperas = [1.0] * total
+        # Momento en que se relanza cada worker caído (None = vivo o sin detectar)
+        self._relanzar_en: List[Optional[float]] = [None] * total
+        self._deteniendo = False
+        self._reiniciando = False
+        self._tarea_reinicio: Optional[asyncio.Task] = None
+
+    def _lanzar(self, indice: int) -> None:
+        proceso = CONTEXTO.Process(
+            target=self.objetivo,
+            args=(indice, self.total, self.colas[indice]),
+            name=f"worker_{indice}"
+        )
+        proceso.start()
+        self.procesos[indice] = proceso
+        self._inicios[indice] = time.monotonic()
+        self._relanzar_en[indice] = None
+        logger.info(f"✅ Worker {indice} iniciado (pid {proceso.pid})")
+
+    async def _vigilar(self) -> None:
+        """
+        Relanza los workers caídos, con espera creciente si se caen al arrancar.
+
+        La espera de cada worker es una hora límite propia: mientras uno
+        espera, los demás se siguen vigilando y relanzando.
+        """
+        while True:
+            await asyncio.sleep(1)
+            if self._reiniciando:
+                continue
+            ahora = time.monotonic()
+            for indice, proceso in enumerate(self.procesos):
+                if proceso.is_alive():
+                    continue
+                if self._relanzar_en[indice] is None:
+                    logger.error(f"❌ Worker {indice} terminó con código {proceso.exitcode}")
+                    if ahora - self._inicios[indice] < WORKER_ESTABLE:
+                        self._relanzar_en[indice] = ahora + self._esperas[indice]
+                        self._esperas[indice] = min(self._esperas[indice] * 2, 60)
+                    else:
+                        self._relanzar_en[indice] = ahora
+                        self._esperas[indice] = 1.0
+                if ahora >= self._relanzar_en[indice] and not self._deteniendo:
+                    self._lanzar(indice)
+
+    async def _detener_worker(self, indice: int) -> None:
+        """Pide al worker que termine tras procesar su cola y espera a que salga"""
+        proceso = self.procesos[indice]
+        loop = asyncio.get_running_loop()
+        if not proceso.is_alive():
+            # Sin marca de fin: la leería el worker que lo sustituya
+            proceso.join()
+            return
+        await loop.run_in_executor(None, self.colas[indice].put, None)
+        await loop.run_in_executor(None, proceso.join, DESPACHO_ESPERA_CIERRE + 5)
+        if proceso.is_alive():
+            logger.warning(f"⚠️ Worker {indice} no terminó a tiempo, se fuerza la salida")
+            proceso.terminate()
+            await loop.run_in_executor(None, proceso.join)
+
+    async def reiniciar(self) -> None:
+        """Reinicio escalonado: un worker a la vez, sin perder los updates encolados"""
+        if self._reiniciando:
+            return
+        self._reiniciando = True
+        try:
+            for indice in range(self.total):
+                if self._deteniendo:
+                    return
+                await self._detener_worker(indice)
+                if self._deteniendo:
+                    return
+                self._lanzar(indice)
+            logger.info("✅ Reinicio escalonado de workers completado")
+        finally:
+            self._reiniciando = False
+
+    async def _sondear(self, timeout: int = 30) -> None:
+        """Long polling con JSON crudo: reenvía cada update a la cola de su worker"""
+        api = f"https://api.telegram.org/bot{BOT_TOKEN}"
+        loop = asyncio.get_running_loop()
+        offset = None
+        espera_error = 1.0
+        webhook_borrado = False
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout + 10)) as session:
+            while True:
+                try:
+                    if not webhook_borrado:
+                        # Con un webhook registrado (p. ej. tras el modo webhook) getUpdates da 409
+                        async with session.post(f"{api}/deleteWebhook") as respuesta:
+                            cuerpo = await respuesta.json()
+                        if not cuerpo.get("ok"):
+                            raise RuntimeError(cuerpo.get("description"))
+                        webhook_borrado = True
+                    async with session.post(f"{api}/getUpdates", json={
+                        "offset": offset,
+                        "timeout": timeout,
+                        "allowed_updates": self.allowed_updates
+                    }) as respuesta:
+                        cuerpo = await respuesta.json()
+                    if not cuerpo.get("ok"):
+                        raise RuntimeError(cuerpo.get("description"))
+                    espera_error = 1.0
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error obteniendo updates: {e}")
+                    await asyncio.sleep(espera_error)
+                    espera_error = min(espera_error * 2, 60)
+                    continue
+
+                for datos in cuerpo["result"]:
+                    cola = self.colas[user_id_de_update(datos) % self.total]
+                    # put bloquea si la cola del worker está llena (contrapresión)
+                    await loop.run_in_executor(None, cola.put, datos)
+                    offset = datos["update_id"] + 1
+
+    def _pedir_reinicio(self) -> None:
+        if self._deteniendo or (self._tarea_reinicio and not self._tarea_reinicio.done()):
+            return
+        self._tarea_reinicio = asyncio.ensure_future(self.reiniciar())
+
+    async def ejecutar(self) -> None:
+        """Lanza los workers y reparte updates hasta recibir SIGINT o SIGTERM"""
+        loop = asyncio.get_running_loop()
+        detener = asyncio.Event()
+        for senal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(senal, detener.set)
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, self._pedir_reinicio)
+
+        for indice in range(self.total):
+            self._lanzar(indice)
+        tareas = [asyncio.ensure_future(self._sondear()), asyncio.ensure_future(self._vigilar())]
+        logger.info(f"🤖 Supervisor repartiendo updates entre {self.total} workers")
+
+        try:
+            await detener.wait()
+        finally:
+            logger.info("🛑 Deteniendo supervisor...")
+            self._deteniendo = True
+            if self._tarea_reinicio:
+                # El reinicio en curso termina el worker que está deteniendo y no lanza más
+                await asyncio.gather(self._tarea_reinicio, return_exceptions=True)
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+            await asyncio.gather(*(
+                self._detener_worker(indice)
+                for indice, proceso in enumerate(self.procesos)
+                if proceso and proceso.is_alive()
+            ))
+            logger.info("🛑 Todos los workers detenidos")
@@ -1,4 +1,6 @@
 import re
+import time
+import asyncio
 import datetime
 import logging
 import unicodedata
@@ -6,7 +8,15 @@ from typing import Dict, List, Optional, Tuple
 from aiogram import types, Bot, BaseMiddleware
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from utils.database import usuarios_col
+from utils.database import usuarios_col, invalidar_usuario
+from utils.envios import cola_envios
+from utils.cache_telegram import cache_telegram
+from config.config import (
+    TAREAS_VERIFICACION_DIFERIDA,
+    TAREAS_VERIFICACIONES_POR_SEGUNDO,
+    TAREAS_INTERVALO_MINIMO,
+    TAREAS_MAX_PENDIENTES
+)
 
 logger = logging.getLogger(__name__)
 
@@ -40,7 +50,7 @@ def crear_teclado_tareas() -> InlineKeyboardMarkup:
     builder.adjust(2)
     return builder.as_markup()
 
-async def tareas_handler(event) -> None:
+async def tareas_handler(event, usuario: Optional[Dict] = None) -> None:
     """Handler principal de tareas (funciona con mensajes y callbacks)"""
     if not hasattr(event, 'from_user'):
         return
@@ -49,7 +59,8 @@ async def tareas_handler(event) -> None:
     is_callback = hasattr(event, 'data')
 
     try:
-        usuario = await usuarios_col.find_one({"user_id": user_id})
+        if usuario is None:
+            usuario = await usuarios_col.find_one({"user_id": user_id})
         if not usuario:
             await event.answer("❌ User not found")
             return
@@ -71,12 +82,13 @@ async def tareas_handler(event) -> None:
         logger.error(f"Error en tareas_handler para user_id={user_id}: {e}")
         await event.answer("❌ Error loading tasks", show_alert=True)
 
-async def verificar_tareas_handler(callback: types.CallbackQuery) -> None:
+async def verificar_tareas_handler(callback: types.CallbackQuery, usuario: Optional[Dict] = None) -> None:
     """Handler para actualizar tareas manualmente"""
     user_id = callback.from_user.id
     
     try:
-        usuario = await usuarios_col.find_one({"user_id": user_id})
+        if usuario is None:
+            usuario = await usuarios_col.find_one({"user_id": user_id})
         if not usuario:
             await callback.answer("❌ Usuario no encontrado", show_alert=True)
             return
@@ -85,11 +97,11 @@ async def verificar_tareas_handler(callback: types.CallbackQuery) -> None:
             callback.bot,
             user_id,
             usuario.get("username", ""),
-            usuario.get("first_name", "")
+            usuario.get("first_name", ""),
+            usuario
         )
 
-        # Recargar usuario para obtener tareas e inventario actualizados
-        usuario = await usuarios_col.find_one({"user_id": user_id})
+        # check_tareas_usuario actualiza las tareas e inventario de `usuario`
         mensaje_actualizado = await generar_mensaje_tareas(user_id, usuario)
         keyboard = crear_teclado_tareas()
 
@@ -187,35 +199,40 @@ class MundoMiticoNombreMiddleware(BaseMiddleware):
     """
     Middleware para detectar nombres que contienen 'Mundo Mitico'
     y verificar tareas automáticamente.
+
+    En modo diferido solo marca al usuario como visto y la verificación
+    la hace `verificador_tareas` en segundo plano.
     """
 
+    def __init__(self, verificacion_diferida: bool = TAREAS_VERIFICACION_DIFERIDA):
+        self.verificacion_diferida = verificacion_diferida
+
     async def __call__(self, handler, event, data):
         user = getattr(event, 'from_user', None)
+        usuario = data.get("usuario")
         if user:
             # Verificar nombre
             nombre_usuario = f"{getattr(user, 'first_name', '') or ''} {getattr(user, 'username', '') or ''}".strip()
-            if contiene_mundo_mitico(nombre_usuario):
-                await self._procesar_nombre_mundo_mitico(user, nombre_usuario, event)
 
-            # Ejecutar revisión de tareas
-            await self._verificar_tareas_automaticas(event, user)
+            if self.verificacion_diferida:
+                verificador_tareas.marcar_visto(
+                    user.id,
+                    getattr(user, 'username', ''),
+                    getattr(user, 'first_name', ''),
+                    nombre_usuario
+                )
+            else:
+                if contiene_mundo_mitico(nombre_usuario):
+                    await self._procesar_nombre_mundo_mitico(user, nombre_usuario, event)
+
+                # Ejecutar revisión de tareas
+                await self._verificar_tareas_automaticas(event, user, usuario)
 
         return await handler(event, data)
 
     async def _procesar_nombre_mundo_mitico(self, user, nombre_usuario: str, event) -> None:
         """Procesa cuando se detecta 'Mundo Mitico' en el nombre."""
-        logger.info(f"[MUNDO_MITICO] Usuario {user.id} tiene 'Mundo Mitico' en su nombre: {nombre_usuario}")
-
-                # Guardar registro en la base de datos
-        await usuarios_col.update_one(
-                    {"user_id": user.id},
-                    {"$set": {
-                        "detectado_mundo_mitico": True,
-                        "nombre_detectado": nombre_usuario,
-                        "fecha_detectado": datetime.datetime.now()
-                    }},
-                    upsert=True
-                )
+        await _registrar_nombre_mundo_mitico(user.id, nombre_usuario)
 
         # Ya no notificamos al usuario para evitar spam
 
@@ -224,23 +241,122 @@ class MundoMiticoNombreMiddleware(BaseMiddleware):
         # Esta función ya no se usa para evitar spam
         pass
 
-    async def _verificar_tareas_automaticas(self, event, user) -> None:
+    async def _verificar_tareas_automaticas(self, event, user, usuario: Optional[Dict] = None) -> None:
         """Verifica tareas automáticamente."""
         try:
                 await check_tareas_usuario(
                     event.bot,
                     user.id,
                     getattr(user, 'username', ''),
-                    getattr(user, 'first_name', '')
+                    getattr(user, 'first_name', ''),
+                    usuario
                 )
         except Exception as e:
             logger.warning(f"Error en check_tareas_usuario para user_id={user.id}: {e}")
 
+async def _registrar_nombre_mundo_mitico(user_id: int, nombre_usuario: str) -> None:
+    """Guarda en la base de datos que el usuario tiene 'Mundo Mitico' en su nombre."""
+    logger.info(f"[MUNDO_MITICO] Usuario {user_id} tiene 'Mundo Mitico' en su nombre: {nombre_usuario}")
+
+    await usuarios_col.update_one(
+        {"user_id": user_id},
+        {"$set": {
+            "detectado_mundo_mitico": True,
+            "nombre_detectado": nombre_usuario,
+            "fecha_detectado": datetime.datetime.now()
+        }},
+        upsert=True
+    )
+    invalidar_usuario(user_id)
+
+# =========================
+# VERIFICACIÓN EN SEGUNDO PLANO
+# =========================
+
+class VerificadorTareas:
+    """
+    Verifica en segundo plano las tareas de los usuarios marcados como vistos.
+
+    Procesa como máximo `verificaciones_por_segundo` usuarios por segundo y no
+    vuelve a verificar a un usuario antes de `intervalo_minimo` segundos.
+    """
+
+    def __init__(self, verificaciones_por_segundo: float, intervalo_minimo: int, max_pendientes: int):
+        self.verificaciones_por_segundo = verificaciones_por_segundo
+        self.intervalo_minimo = intervalo_minimo
+        self.max_pendientes = max_pendientes
+        # user_id -> (username, first_name, nombre_usuario), en orden de llegada
+        self._pendientes: Dict[int, Tuple[str, str, str]] = {}
+        # user_id -> momento (monotónico) de la última verificación
+        self._ultima_verificacion: Dict[int, float] = {}
+        self._ultima_purga = time.monotonic()
+        self._hay_pendientes = asyncio.Event()
+
+    def marcar_visto(self, user_id: int, username: str, first_name: str, nombre_usuario: str) -> None:
+        """Marca a un usuario para ser verificado. No hace ninguna llamada externa."""
+        if user_id in self._pendientes:
+            self._pendientes[user_id] = (username, first_name, nombre_usuario)
+            return
+
+        ultima = self._ultima_verificacion.get(user_id)
+        if ultima is not None and time.monotonic() - ultima < self.intervalo_minimo:
+            return
+
+        # Si la cola está llena el usuario se marcará de nuevo en su próximo mensaje
+        if len(self._pendientes) >= self.max_pendientes:
+            return
+
+        self._pendientes[user_id] = (username, first_name, nombre_usuario)
+        self._hay_pendientes.set()
+
+    async def ejecutar(self, bot: Bot) -> None:
+        """Bucle principal: verifica los usuarios pendientes a ritmo limitado."""
+        pausa = 1 / self.verificaciones_por_segundo if self.verificaciones_por_segundo > 0 else 0
+
+        while True:
+            if not self._pendientes:
+                self._hay_pendientes.clear()
+                await self._hay_pendientes.wait()
+                continue
+
+            user_id = next(iter(self._pendientes))
+            username, first_name, nombre_usuario = self._pendientes.pop(user_id)
+            self._ultima_verificacion[user_id] = time.monotonic()
+
+            try:
+                if contiene_mundo_mitico(nombre_usuario):
+                    await _registrar_nombre_mundo_mitico(user_id, nombre_usuario)
+                await check_tareas_usuario(bot, user_id, username, first_name)
+            except Exception as e:
+                logger.warning(f"Error en check_tareas_usuario para user_id={user_id}: {e}")
+
+            self._purgar_verificaciones_antiguas()
+            await asyncio.sleep(pausa)
+
+    def _purgar_verificaciones_antiguas(self) -> None:
+        """Elimina marcas de verificación que ya superaron el intervalo mínimo."""
+        ahora = time.monotonic()
+        if ahora - self._ultima_purga < self.intervalo_minimo:
+            return
+
+        self._ultima_purga = ahora
+        self._ultima_verificacion = {
+            user_id: momento
+            for user_id, momento in self._ultima_verificacion.items()
+            if ahora - momento < self.intervalo_minimo
+        }
+
+verificador_tareas = VerificadorTareas(
+    TAREAS_VERIFICACIONES_POR_SEGUNDO,
+    TAREAS_INTERVALO_MINIMO,
+    TAREAS_MAX_PENDIENTES
+)
+
 # =========================
 # FUNCIONES DE VERIFICACIÓN DE TAREAS
 # =========================
 
-async def check_tareas_usuario(bot: Bot, user_id: int, username: str, first_name: str) -> bool:
+async def check_tareas_usuario(bot: Bot, user_id: int, username: str, first_name: str, usuario: Optional[Dict] = None) -> bool:
     """
     Verifica y procesa tareas del usuario.
 
@@ -249,11 +365,14 @@ async def check_tareas_usuario(bot: Bot, user_id: int, username: str, first_name
         user_id: ID del usuario
         username: Username del usuario
         first_name: Nombre del usuario
+        usuario: Documento del usuario ya cargado (opcional). Si hay cambios
+            se actualizan sus tareas e inventario.
 
     Returns:
         True si hubo cambios, False en caso contrario
     """
-    usuario = await usuarios_col.find_one({"user_id": user_id})
+    if usuario is None:
+        usuario = await usuarios_col.find_one({"user_id": user_id})
     if not usuario:
         return False
 
@@ -266,6 +385,7 @@ async def check_tareas_usuario(bot: Bot, user_id: int, username: str, first_name
     now = datetime.datetime.now()
     tareas = usuario.get("tareas", {})
     inventario = usuario.get("inventario", {})
+    hadas_antes = inventario.get("hada", 0)
     cambios = False
 
     # Verificar tarea de enlace en bio
@@ -276,7 +396,9 @@ async def check_tareas_usuario(bot: Bot, user_id: int, username: str, first_name
 
     # Guardar cambios si hubo
     if cambios:
-        await _guardar_cambios_tareas(user_id, tareas, inventario)
+        usuario["tareas"] = tareas
+        usuario["inventario"] = inventario
+        await _guardar_cambios_tareas(user_id, tareas, inventario.get("hada", 0) - hadas_antes)
         logger.info(f"✅ Tareas actualizadas para user_id={user_id}")
 
     return cambios
@@ -293,7 +415,7 @@ async def _obtener_info_chat(bot: Bot, user_id: int) -> Optional[Tuple[str, str]
         Tupla con (nombre, bio) o None si hay error
     """
     try:
-        chat = await bot.get_chat(user_id)
+        chat = await cache_telegram.get_chat(bot, user_id)
         nombre_actual = f"{chat.first_name or ''} {chat.last_name or ''}".strip()
         bio_actual = (chat.bio or "").lower()
         return nombre_actual, bio_actual
@@ -407,7 +529,7 @@ async def _procesar_recompensas_mundo_nombre(bot: Bot, user_id: int, dias: int,
 
 async def _enviar_notificacion_recompensa(bot: Bot, user_id: int, mensaje: str) -> None:
     """
-    Envía notificación de recompensa al usuario.
+    Encola la notificación de recompensa al usuario.
 
     Args:
         bot: Instancia del bot
@@ -415,30 +537,29 @@ async def _enviar_notificacion_recompensa(bot: Bot, user_id: int, mensaje: str)
         mensaje: Mensaje a enviar
     """
     try:
-        # Enviar emoji en un mensaje separado
-        await bot.send_message(user_id, "🎉")
-
-        # Enviar texto en otro mensaje
+        # Emoji y texto en mensajes separados (el mismo carril de la cola mantiene el orden)
+        cola_envios.encolar(bot, user_id, "🎉")
         texto_sin_emoji = mensaje.replace("🎉 ", "").replace("🎉", "")
-        await bot.send_message(user_id, texto_sin_emoji)
+        cola_envios.encolar(bot, user_id, texto_sin_emoji)
 
     except Exception as e:
-        logger.warning(f"Error al enviar mensaje de recompensa a {user_id}: {e}")
+        logger.warning(f"Error al encolar mensaje de recompensa a {user_id}: {e}")
 
-async def _guardar_cambios_tareas(user_id: int, tareas: Dict, inventario: Dict) -> None:
+async def _guardar_cambios_tareas(user_id: int, tareas: Dict, hadas_ganadas: int) -> None:
     """
     Guarda los cambios de tareas en la base de datos.
 
     Args:
         user_id: ID del usuario
         tareas: Tareas actualizadas
-        inventario: Inventario actualizado
+        hadas_ganadas: Hadas a sumar al inventario (con $inc, sin pisar el inventario)
     """
     try:
-            await usuarios_col.update_one(
-                {"user_id": user_id},
-                {"$set": {"tareas": tareas, "inventario": inventario}}
-            )
+            actualizacion = {"$set": {"tareas": tareas}}
+            if hadas_ganadas:
+                actualizacion["$inc"] = {"inventario.hada": hadas_ganadas}
+            await usuarios_col.update_one({"user_id": user_id}, actualizacion)
+            invalidar_usuario(user_id)
     except Exception as e:
             logger.error(f"Error al actualizar usuario {user_id} en la base de datos: {e}")
     
@@ -446,8 +567,8 @@ async def _guardar_cambios_tareas(user_id: int, tareas: Dict, inventario: Dict)
 # REGISTRO DE HANDLERS
 # =========================
 
-def register_tareas_handlers(dp) -> None:
-    """Registra todos los handlers del módulo tareas"""
+def register_tareas_handlers(enrutador) -> None:
+    """Registra todos los handlers del módulo tareas en el enrutador"""
     # Callbacks principales
-    dp.callback_query.register(verificar_tareas_handler, lambda c: c.data == "actualizar_tareas")
-    dp.callback_query.register(tareas_handler, lambda c: c.data == "tareas")
\ No newline at end of file
+    enrutador.callback("actualizar_tareas", verificar_tareas_handler)
+    enrutador.callback("tareas", tareas_handler)
\ No newline at end of file
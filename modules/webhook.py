@@ -0,0 +1,116 @@
+import asyncio
+import hmac
+from typing import Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from utils.logging_config import get_logger
+from utils.segundo_plano import al_detener, ORDEN_ENTRADA
+from modules.despachador import DespachadorPorUsuario
+from config.config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_EN_VUELO,
+    WEBHOOK_MAX_PENDIENTES,
+    WEBHOOK_ESPERA_CIERRE
+)
+
+logger = get_logger(__name__)
+
+# Cabecera con la que Telegram envía el secret_token configurado en set_webhook
+CABECERA_SECRETO = "X-Telegram-Bot-Api-Secret-Token"
+
+class ReceptorWebhook:
+    """
+    Recibe updates de Telegram por HTTP y los procesa con `dp.feed_update`.
+
+    El endpoint solo valida el secreto, encola el update y responde 200; el
+    procesamiento lo hacen `max_en_vuelo` workers de un DespachadorPorUsuario
+    (en orden por usuario, en paralelo entre usuarios). La cola está acotada
+    a `max_pendientes`: si se llena se responde 503 y Telegram reintenta más
+    tarde. Al ser HTTP sin estado, se pueden poner varias réplicas detrás de
+    un balanceador.
+    """
+
+    def __init__(self, secreto: str, max_en_vuelo: int, max_pendientes: int, espera_cierre: float):
+        self.secreto = secreto
+        self.max_en_vuelo = max_en_vuelo
+        self.aceptados = 0
+        self.rechazados = 0
+        self._despachador = DespachadorPorUsuario(max_en_vuelo, max_pendientes, espera_cierre)
+        self._runner: Optional[web.AppRunner] = None
+        self._bot: Optional[Bot] = None
+        self._dp: Optional[Dispatcher] = None
+
+    def crear_app(self, bot: Bot, dp: Dispatcher) -> web.Application:
+        """Crea la aplicación aiohttp y los workers (sin abrir el puerto)"""
+        self._bot = bot
+        self._dp = dp
+        self._despachador.iniciar(lambda update: dp.feed_update(bot, update))
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self._recibir)
+        return app
+
+    async def _recibir(self, request: web.Request) -> web.Response:
+        """Endpoint del webhook: valida, encola y responde sin esperar al handler"""
+        if not hmac.compare_digest(request.headers.get(CABECERA_SECRETO, ""), self.secreto):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self._bot})
+        except Exception as e:
+            logger.warning(f"Update inválido recibido en el webhook: {e}")
+            return web.Response(status=400)
+
+        try:
+            self._despachador.encolar_nowait(update)
+        except asyncio.QueueFull:
+            self.rechazados += 1
+            return web.Response(status=503)
+
+        self.aceptados += 1
+        return web.Response()
+
+    async def iniciar(self, bot: Bot, dp: Dispatcher) -> None:
+        """Abre el endpoint y, si hay WEBHOOK_URL, registra el webhook en Telegram"""
+        if not self.secreto:
+            raise ValueError("WEBHOOK_SECRET es obligatorio en modo webhook")
+
+        self._runner = web.AppRunner(self.crear_app(bot, dp), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        al_detener(self.detener, ORDEN_ENTRADA)
+        logger.info(f"✅ Webhook escuchando en {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=self.secreto,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(100, self.max_en_vuelo)
+            )
+            logger.info(f"✅ Webhook registrado en Telegram: {WEBHOOK_URL}")
+
+    async def ejecutar(self, bot: Bot, dp: Dispatcher) -> None:
+        """Inicia el webhook y espera hasta que se cancele (equivalente a start_polling)"""
+        await self.iniciar(bot, dp)
+        await asyncio.Event().wait()
+
+    async def detener(self) -> None:
+        """Deja de aceptar updates, procesa los ya aceptados y detiene los workers"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+        await self._despachador.detener()
+        logger.info(f"🛑 Webhook detenido ({self.aceptados} aceptados, {self.rechazados} rechazados por cola llena)")
+
+receptor_webhook = ReceptorWebhook(
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_EN_VUELO,
+    WEBHOOK_MAX_PENDIENTES,
+    WEBHOOK_ESPERA_CIERRE
+)
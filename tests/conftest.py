@@ -0,0 +1,54 @@
+"""
+Configuración común de los tests del bot Mundo Mítico.
+
+config.config lee variables de entorno obligatorias al importarse: aquí se
+dan valores de prueba antes de importar nada del bot. La base de datos se
+sustituye por mongomock (fixture `db`) y las funciones de test `async def`
+se ejecutan con asyncio.run, sin plugins.
+"""
+
+import asyncio
+import inspect
+import os
+
+import pytest
+
+for _variable, _valor in {
+    "ADMIN_IDS": "1",
+    "CHANNEL_IDS": "-1001",
+    "BOT_TOKEN": "123456:TEST",
+    "MONGO_URI": "mongodb://localhost:27017",
+    "DB_NAME": "mundo_mitico_test",
+    "MIN_DEPOSITO": "1",
+    "MIN_RETIRO": "1",
+    "COMISION_RETIRO": "0",
+    "TIEMPO_PROCESAMIENTO": "24h",
+    "LOG_LEVEL": "WARNING",
+    "LOG_FORMAT": "%(levelname)s %(name)s %(message)s",
+}.items():
+    os.environ.setdefault(_variable, _valor)
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Ejecuta los tests async def en un bucle de eventos nuevo"""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    argumentos = {nombre: pyfuncitem.funcargs[nombre] for nombre in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**argumentos))
+    return True
+
+@pytest.fixture
+def db(monkeypatch):
+    """Sustituye las colecciones de utils.database (y sus copias) por mongomock"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import utils.database as database
+    import utils.trabajos as trabajos
+
+    base = mongomock_motor.AsyncMongoMockClient()["mundo_mitico_test"]
+    for nombre in ("usuarios", "inventarios", "depositos", "creditos", "referidos",
+                   "logs", "promos", "contadores", "difusiones", "trabajos"):
+        monkeypatch.setattr(database, f"{nombre}_col", base[nombre])
+    monkeypatch.setattr(trabajos, "trabajos_col", base["trabajos"])
+    monkeypatch.setattr(database, "soporta_transacciones", False)
+    database.cache_usuarios.limpiar()
+    return base
@@ -0,0 +1,49 @@
+"""Tests de la compra atómica (ejecutar_compra)"""
+
+import asyncio
+
+from utils.database import ejecutar_compra, obtener_usuario
+
+async def test_compra_con_fondos_descuenta_y_agrega_item(db):
+    await db.usuarios.insert_one({"user_id": 1, "balance": 10.0})
+
+    comprado, balance = await ejecutar_compra(1, "moguri", 4.0, "nft_comprado", cantidad=2)
+
+    assert comprado is True
+    assert balance == 6.0
+    usuario = await db.usuarios.find_one({"user_id": 1})
+    assert usuario["balance"] == 6.0
+    assert usuario["inventario"]["moguri"] == 2
+    assert await db.logs.count_documents({"action": "nft_comprado"}) == 1
+
+async def test_compra_sin_fondos_no_cambia_nada(db):
+    await db.usuarios.insert_one({"user_id": 1, "balance": 3.0})
+
+    assert await ejecutar_compra(1, "moguri", 4.0, "nft_comprado") == (False, None)
+
+    usuario = await db.usuarios.find_one({"user_id": 1})
+    assert usuario["balance"] == 3.0
+    assert "inventario" not in usuario
+    assert await db.logs.count_documents({}) == 0
+
+async def test_compras_concurrentes_no_dejan_balance_negativo(db):
+    await db.usuarios.insert_one({"user_id": 1, "balance": 10.0})
+
+    resultados = await asyncio.gather(*(
+        ejecutar_compra(1, "gargola", 4.0, "nft_comprado") for _ in range(5)
+    ))
+
+    assert sum(comprado for comprado, _ in resultados) == 2
+    usuario = await db.usuarios.find_one({"user_id": 1})
+    assert usuario["balance"] == 2.0
+    assert usuario["inventario"]["gargola"] == 2
+
+async def test_compra_actualiza_contador_global_e_invalida_cache(db):
+    await db.usuarios.insert_one({"user_id": 1, "balance": 5.0})
+    assert (await obtener_usuario(1))["balance"] == 5.0
+
+    await ejecutar_compra(1, "ghost", 5.0, "nft_comprado")
+
+    assert (await obtener_usuario(1))["balance"] == 0.0
+    contadores = await db.contadores.find({"_id": {"$regex": "^nfts:"}}).to_list(length=None)
+    assert sum(contador.get("ghost", 0) for contador in contadores) == 1
@@ -0,0 +1,63 @@
+"""Tests de la reconciliación de los contadores globales de NFTs"""
+
+import asyncio
+
+import utils.database as database
+
+async def preparar(db) -> None:
+    await db.usuarios.insert_many([
+        {"user_id": 1, "inventario": {"moguri": 2, "ghost": 1}},
+        {"user_id": 2, "inventario": {"moguri": 1}}
+    ])
+
+async def test_primera_lectura_inicializa_los_contadores(db):
+    await preparar(db)
+
+    assert await database.obtener_nfts_activos() == {"total_moguri": 3, "total_gargola": 0, "total_ghost": 1}
+    assert await db.contadores.find_one({"_id": database.NFTS_BLOQUEO_ID}) is None
+
+async def test_reconciliaciones_concurrentes_no_duplican(db):
+    await preparar(db)
+
+    resultados = await asyncio.gather(
+        database.obtener_nfts_activos(),
+        database.reconciliar_nfts_globales(),
+        database.reconciliar_nfts_globales()
+    )
+
+    assert await database._leer_contadores_nfts() == {"moguri": 3, "gargola": 0, "ghost": 1}
+    assert resultados[0]["total_moguri"] in (0, 3)
+
+async def test_compra_durante_la_reconciliacion_no_se_anula(db, monkeypatch):
+    await preparar(db)
+    await database.reconciliar_nfts_globales()
+    await db.contadores.update_one({"_id": "nfts:1"}, {"$inc": {"ghost": 5}}, upsert=True)
+    leer = database._leer_contadores_nfts
+    lecturas = []
+
+    async def leer_y_comprar():
+        totales = await leer()
+        lecturas.append(totales)
+        if len(lecturas) == 1:
+            # Una compra entre la lectura de los contadores y la de los inventarios
+            await db.usuarios.update_one({"user_id": 2}, {"$inc": {"inventario.moguri": 1}})
+            await database.incrementar_contador_nfts("moguri", 1)
+        return totales
+
+    monkeypatch.setattr(database, "_leer_contadores_nfts", leer_y_comprar)
+    correccion = await database.reconciliar_nfts_globales()
+
+    assert correccion == {"moguri": 0, "gargola": 0, "ghost": -5}
+    assert await leer() == {"moguri": 4, "gargola": 0, "ghost": 1}
+
+async def test_bloqueo_vigente_de_otro_proceso(db):
+    await preparar(db)
+    await database.reconciliar_nfts_globales()
+    await db.contadores.update_one({"_id": "nfts:0"}, {"$inc": {"moguri": 7}})
+    hasta = database.datetime.datetime.now() + database.datetime.timedelta(minutes=5)
+    await db.contadores.insert_one({"_id": database.NFTS_BLOQUEO_ID, "hasta": hasta, "propietario": None})
+
+    assert await database.reconciliar_nfts_globales() is None
+    assert (await database._leer_contadores_nfts())["moguri"] == 10
+    # El bloqueo ajeno no se libera
+    assert await db.contadores.find_one({"_id": database.NFTS_BLOQUEO_ID}) is not None
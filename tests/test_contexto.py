@@ -0,0 +1,59 @@
+"""Tests del middleware de contexto: una lectura por update compartida con la caché de usuarios"""
+
+from aiogram.types import CallbackQuery, Update, User
+
+import utils.database as database
+from modules.contexto import UsuarioContextoMiddleware
+
+USUARIO = User(id=5, is_bot=False, first_name="Ana")
+
+def callback(data: str) -> Update:
+    return Update(update_id=1, callback_query=CallbackQuery(
+        id="1", from_user=USUARIO, chat_instance="c", data=data
+    ))
+
+async def contar_lecturas(db, monkeypatch) -> list:
+    await db.usuarios.insert_one({"user_id": 5, "first_name": "Ana", "balance": 1.5, "cooldowns": {}, "inventario": {"hada": 2}})
+    lecturas = []
+    find_one = database.usuarios_col.find_one
+
+    async def contar(*args, **kwargs):
+        lecturas.append(args)
+        return await find_one(*args, **kwargs)
+
+    monkeypatch.setattr(database.usuarios_col, "find_one", contar)
+    return lecturas
+
+async def ejecutar(ruta: str) -> dict:
+    data = {"event_from_user": USUARIO}
+
+    async def handler(event, data):
+        return data
+
+    return await UsuarioContextoMiddleware()(handler, callback(ruta), data)
+
+async def test_fallo_llena_la_cache_para_los_handlers(db, monkeypatch):
+    lecturas = await contar_lecturas(db, monkeypatch)
+
+    data = await ejecutar("explorar_cooldowns")
+    assert data["usuario"] == {"user_id": 5, "cooldowns": {}}
+    # El handler vuelve a pedir el usuario: sale de la caché
+    assert await database.obtener_inventario_usuario(5) == {"hada": 2}
+    data = await ejecutar("explorar")
+    assert data["usuario"]["balance"] == 1.5
+    assert len(lecturas) == 1
+
+async def test_rutas_sin_campos_no_leen(db, monkeypatch):
+    lecturas = await contar_lecturas(db, monkeypatch)
+
+    data = await ejecutar("explorar_pelea")
+    assert "usuario" not in data
+    assert lecturas == []
+
+async def test_usuario_inexistente(db):
+    data = {"event_from_user": User(id=9, is_bot=False, first_name="Nadie")}
+
+    async def handler(event, data):
+        return data
+
+    assert (await UsuarioContextoMiddleware()(handler, callback("referidos"), data))["usuario"] is None
@@ -0,0 +1,86 @@
+"""Tests del enrutador de callbacks y comandos (Enrutador)"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from modules.enrutador import Enrutador
+
+async def inicio(event):
+    return "inicio"
+
+async def actividad(event, actividad: str):
+    return f"actividad:{actividad}"
+
+async def caja(event, parametro: str):
+    return f"caja:{parametro}"
+
+async def lote(event, usuario: dict = None):
+    return f"lote:{usuario['user_id']}"
+
+async def difundir(message, texto: str):
+    return f"difundir:{texto}"
+
+@pytest.fixture
+def enrutador():
+    enrutador = Enrutador()
+    enrutador.callback("explorar", inicio)
+    enrutador.prefijo("explorar_", actividad)
+    enrutador.prefijo("explorar_caja_", caja)
+    enrutador.callback("explorar_caja_lote", lote)
+    enrutador.comando("/start", inicio)
+    enrutador.comando_con_argumentos("/difundir", difundir)
+    return enrutador
+
+@pytest.mark.parametrize("registro", [
+    lambda e: e.callback("explorar", inicio),
+    lambda e: e.prefijo("explorar_", inicio),
+    lambda e: e.comando("/start", inicio),
+    lambda e: e.comando_con_argumentos("/difundir", inicio),
+])
+def test_ruta_duplicada_lanza_error(enrutador, registro):
+    with pytest.raises(ValueError):
+        registro(enrutador)
+
+def test_prefijo_debe_terminar_en_guion_bajo(enrutador):
+    with pytest.raises(ValueError):
+        enrutador.prefijo("tienda", inicio)
+
+@pytest.mark.parametrize("data, funcion, argumentos", [
+    ("explorar", inicio, ()),
+    ("explorar_caja_lote", lote, ()),
+    ("explorar_pelea", actividad, ("pelea",)),
+    ("explorar_caja_sorpresa", caja, ("sorpresa",)),
+    ("explorar_expedicion_larga", actividad, ("expedicion_larga",)),
+    # Sin el "_" final no coincide con explorar_caja_: cae en el prefijo más corto
+    ("explorar_caja", actividad, ("caja",)),
+])
+def test_resolver_callback(enrutador, data, funcion, argumentos):
+    handler, encontrados = enrutador.resolver_callback(data)
+    assert handler.callback is funcion
+    assert encontrados == argumentos
+
+@pytest.mark.parametrize("data", ["tienda", "explorarx", "_explorar"])
+def test_callback_sin_ruta(enrutador, data):
+    assert enrutador.resolver_callback(data) is None
+
+def test_resolver_comando(enrutador):
+    assert enrutador.resolver_comando("/start")[0].callback is inicio
+    handler, argumentos = enrutador.resolver_comando("/difundir Hola a todos")
+    assert handler.callback is difundir
+    assert argumentos == ("Hola a todos",)
+    assert enrutador.resolver_comando("/difundir")[1] == ("",)
+    assert enrutador.resolver_comando("/start ref_1") is None
+    assert enrutador.resolver_comando("hola") is None
+
+async def test_ejecutar_pasa_argumentos_y_datos_declarados(enrutador):
+    callback = SimpleNamespace(data="explorar_caja_lote")
+    datos = enrutador._filtro_callback(callback)
+    assert await enrutador._ejecutar(callback, **datos, usuario={"user_id": 5}, bot=None) == "lote:5"
+
+    callback = SimpleNamespace(data="explorar_pelea")
+    datos = enrutador._filtro_callback(callback)
+    assert await enrutador._ejecutar(callback, **datos, usuario={"user_id": 5}) == "actividad:pelea"
+
+    assert enrutador._filtro_callback(SimpleNamespace(data="tienda")) is False
+    assert enrutador._filtro_mensaje(SimpleNamespace(text=None)) is False
@@ -0,0 +1,184 @@
+"""Tests de la cola de envíos (CuboTokens, ColaEnvios, LimitadorEnvios)"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+import utils.envios as envios
+import utils.segundo_plano as segundo_plano
+from modules.despachador import DespachadorPorUsuario
+from utils.envios import (
+    ColaEnvios,
+    CuboTokens,
+    LimitadorEnvios,
+    PRIORIDAD_DIFUSION,
+    PRIORIDAD_NOTIFICACION
+)
+
+def error_429(chat_id: int, segundos: float = 0.05) -> TelegramRetryAfter:
+    return TelegramRetryAfter(
+        method=SendMessage(chat_id=chat_id, text="x"), message="Too Many Requests", retry_after=segundos
+    )
+
+class BotFalso:
+    """Registra los envíos; `fallos` da los errores a lanzar por texto (uno por intento)"""
+
+    def __init__(self, fallos: dict = None):
+        self.enviados = []
+        self.fallos = fallos or {}
+
+    async def send_message(self, chat_id, texto, **kwargs):
+        await asyncio.sleep(0.01)
+        errores = self.fallos.get(texto)
+        if errores:
+            raise errores.pop(0)
+        self.enviados.append((chat_id, texto))
+        return texto
+
+def nueva_cola(por_segundo: float = 1000, rafaga: float = 1000, reintentos: int = 3) -> ColaEnvios:
+    return ColaEnvios(por_segundo, rafaga, 0.0, reintentos, 100, 1)
+
+def test_cubo_tokens(monkeypatch):
+    ahora = [100.0]
+    monkeypatch.setattr(envios.time, "monotonic", lambda: ahora[0])
+    cubo = CuboTokens(tasa=10, capacidad=2)
+
+    for _ in range(2):
+        assert cubo.espera() == 0
+        cubo.consumir()
+    assert cubo.espera() == pytest.approx(0.1)
+
+    ahora[0] += 0.05
+    assert cubo.espera() == pytest.approx(0.05)
+    # No acumula más de la capacidad
+    ahora[0] += 60
+    cubo.espera()
+    assert cubo.tokens == 2
+
+async def test_429_pausa_y_reintenta_sin_desordenar_el_chat():
+    cola = nueva_cola()
+    bot = BotFalso({"a1": [error_429(1)]})
+
+    futuros = [cola.encolar(bot, 1, f"a{i}") for i in range(4)] + [cola.encolar(bot, 2, "b0")]
+    await asyncio.gather(*futuros)
+
+    assert [texto for chat_id, texto in bot.enviados if chat_id == 1] == ["a0", "a1", "a2", "a3"]
+    assert cola.pausas_429 == 1
+    assert cola.enviados == 5
+    await cola.detener()
+
+async def test_429_agota_reintentos():
+    cola = nueva_cola(reintentos=1)
+    bot = BotFalso({"x": [error_429(1, 0.01), error_429(1, 0.01)]})
+
+    with pytest.raises(TelegramRetryAfter):
+        await cola.encolar(bot, 1, "x")
+    assert cola.fallidos == 1
+    await cola.detener()
+
+async def test_error_de_envio_llega_al_futuro():
+    cola = nueva_cola()
+    bot = BotFalso({"x": [TelegramForbiddenError(method=SendMessage(chat_id=1, text="x"), message="blocked")]})
+
+    with pytest.raises(TelegramForbiddenError):
+        await cola.encolar(bot, 1, "x")
+    await cola.detener()
+
+async def test_prioridad_menor_sale_antes():
+    cola = nueva_cola(por_segundo=50, rafaga=1)
+    bot = BotFalso()
+
+    futuros = [cola.encolar(bot, chat_id, f"d{chat_id}", PRIORIDAD_DIFUSION) for chat_id in range(3)]
+    futuros.append(cola.encolar(bot, 9, "n9", PRIORIDAD_NOTIFICACION))
+    await asyncio.gather(*futuros)
+
+    assert bot.enviados[0] == (9, "n9")
+    await cola.detener()
+
+async def test_respuestas_interactivas_van_antes_que_las_notificaciones():
+    cola = nueva_cola(por_segundo=50, rafaga=1)
+    limitador = LimitadorEnvios(cola)
+    bot = BotFalso()
+    orden = []
+
+    async def make_request(bot, method):
+        orden.append(getattr(method, "text", "get_me"))
+        return True
+
+    notificaciones = [cola.encolar(bot, chat_id, f"n{chat_id}") for chat_id in range(3)]
+    await asyncio.sleep(0)
+    respuesta = asyncio.ensure_future(limitador(make_request, bot, SendMessage(chat_id=7, text="respuesta")))
+    # Los métodos que no envían mensajes no esperan turno
+    await limitador(make_request, bot, GetMe())
+    await asyncio.gather(respuesta, *notificaciones)
+
+    assert orden == ["get_me", "respuesta"]
+    assert [texto for _, texto in bot.enviados].index("n1") > 0
+    assert len(bot.enviados) == 3
+    await cola.detener()
+
+async def test_respuesta_interactiva_se_reintenta_tras_429():
+    cola = nueva_cola()
+    limitador = LimitadorEnvios(cola)
+    intentos = []
+
+    async def make_request(bot, method):
+        intentos.append(method.text)
+        if len(intentos) == 1:
+            raise error_429(method.chat_id)
+        return True
+
+    assert await limitador(make_request, BotFalso(), SendMessage(chat_id=1, text="hola")) is True
+    assert intentos == ["hola", "hola"]
+    assert cola.pausas_429 == 1
+    await cola.detener()
+
+async def test_encolar_tras_detener_se_rechaza():
+    cola = nueva_cola()
+    await cola.detener()
+
+    with pytest.raises(RuntimeError):
+        await cola.encolar(BotFalso(), 1, "tarde")
+    assert not cola.activo
+
+async def test_detener_tareas_deja_responder_a_los_updates_pendientes(monkeypatch):
+    monkeypatch.setattr(segundo_plano, "_al_detener", [])
+    cola = nueva_cola()
+    limitador = LimitadorEnvios(cola)
+    despachador = DespachadorPorUsuario(1, 10, 3.0)
+    respuestas = []
+
+    async def make_request(bot, method):
+        respuestas.append(method.text)
+        return True
+
+    async def procesar(update):
+        # El handler pide turno cuando detener_tareas ya canceló las tareas
+        await asyncio.sleep(0.05)
+        await limitador(make_request, BotFalso(), SendMessage(chat_id=5, text="respuesta"))
+
+    await cola.encolar(BotFalso(), 1, "aviso")
+    despachador.iniciar(procesar)
+    segundo_plano.al_detener(despachador.detener, segundo_plano.ORDEN_ENTRADA)
+    despachador.encolar_nowait(SimpleNamespace(update_id=1, event=SimpleNamespace(from_user=SimpleNamespace(id=5))))
+
+    inicio = time.monotonic()
+    await segundo_plano.detener_tareas()
+
+    assert respuestas == ["respuesta"]
+    assert despachador.pendientes == 0
+    assert time.monotonic() - inicio < 1
+    assert cola.detenida
+
+async def test_turno_no_espera_sin_bucle():
+    cola = nueva_cola()
+    await cola.encolar(BotFalso(), 1, "aviso")
+    cola._bucle.cancel()
+    await asyncio.sleep(0)
+
+    await asyncio.wait_for(cola.turno(), 1)
+    await cola.detener()
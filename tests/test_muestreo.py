@@ -0,0 +1,59 @@
+"""Tests del muestreador alias (MuestreadorAlias)"""
+
+import pytest
+
+from utils.muestreo import MuestreadorAlias
+
+TABLA = {
+    "nada": {"probabilidad": 50},
+    "comun": {"probabilidad": 30},
+    "raro": {"probabilidad": 15},
+    "epico": {"probabilidad": 5},
+}
+
+@pytest.mark.parametrize("tabla", [
+    {},
+    {"a": {"probabilidad": 60}, "b": {"probabilidad": 30}},
+    {"a": {"probabilidad": 110}, "b": {"probabilidad": -10}},
+    {"a": {"probabilidad": "100"}},
+])
+def test_tabla_invalida(tabla):
+    with pytest.raises(ValueError):
+        MuestreadorAlias(tabla)
+
+def test_columnas_alias_conservan_las_probabilidades():
+    muestreador = MuestreadorAlias(TABLA)
+    n = len(TABLA)
+    # Masa de cada entrada: su parte de su columna más lo que aporta como alias
+    masa = [0.0] * n
+    for columna in range(n):
+        masa[columna] += muestreador.umbral[columna] / n
+        masa[muestreador.alias[columna]] += (1 - muestreador.umbral[columna]) / n
+    for i, clave in enumerate(muestreador.claves):
+        assert masa[i] == pytest.approx(TABLA[clave]["probabilidad"] / 100)
+
+@pytest.mark.parametrize("con_numpy", [True, False])
+def test_frecuencias_cercanas_a_las_probabilidades(con_numpy):
+    muestreador = MuestreadorAlias(TABLA, semilla=7)
+    if not con_numpy:
+        muestreador._np_rng = None
+    elif muestreador._np_rng is None:
+        pytest.skip("numpy no está instalado")
+
+    n = 100_000
+    conteos = muestreador.conteos(n)
+
+    assert sum(conteos.values()) == n
+    for clave, config in TABLA.items():
+        assert conteos[clave] / n == pytest.approx(config["probabilidad"] / 100, abs=0.01)
+
+def test_entrada_con_probabilidad_cero_nunca_sale():
+    muestreador = MuestreadorAlias({"si": {"probabilidad": 100}, "no": {"probabilidad": 0}}, semilla=1)
+    assert {muestreador.muestrear()["probabilidad"] for _ in range(1000)} == {100}
+    assert muestreador.conteos(1000)["no"] == 0
+
+def test_misma_semilla_mismos_resultados():
+    a = MuestreadorAlias(TABLA, semilla=42)
+    b = MuestreadorAlias(TABLA, semilla=42)
+    assert [a.indice() for _ in range(100)] == [b.indice() for _ in range(100)]
+    assert a.indices(500) == b.indices(500)
@@ -0,0 +1,129 @@
+"""Tests de los trabajos de referidos: recompensas y avisos que la cola reintenta"""
+
+import asyncio
+
+import pytest
+
+import modules.referidos as referidos
+import utils.database as database
+from utils.envios import ColaEnvios
+from utils.trabajos import ColaTrabajos
+
+class BotFalso:
+    """Registra los envíos; con `falla` cada envío lanza esa excepción"""
+
+    def __init__(self, falla: Exception = None):
+        self.enviados = []
+        self.falla = falla
+
+    async def send_message(self, chat_id, texto, **kwargs):
+        if self.falla is not None:
+            raise self.falla
+        self.enviados.append((chat_id, texto))
+        return texto
+
+async def preparar(db) -> ColaTrabajos:
+    await db.trabajos.create_index("clave", unique=True)
+    await db.usuarios.insert_many([
+        {"user_id": 1, "first_name": "Ana", "inventario": {}},
+        {"user_id": 2, "first_name": "Beto", "inventario": {}}
+    ])
+    cola = ColaTrabajos(1, 1, 60, 3)
+    referidos.registrar_trabajos_referidos(cola)
+    return cola
+
+async def ejecutar_trabajo(cola: ColaTrabajos, db, bot) -> dict:
+    cola._bot = bot
+    trabajo = await cola.reclamar()
+    await cola._procesar(trabajo)
+    return await db.trabajos.find_one({"_id": trabajo["_id"]})
+
+def datos_referido(numero: int = 1) -> dict:
+    return {"referidor_id": 1, "referido_id": 2, "referido_name": "Beto", "numero": numero}
+
+async def test_recompensa_con_error_de_mongo_se_reintenta(db, monkeypatch):
+    cola = await preparar(db)
+    await cola.encolar("referido_recompensas", datos_referido(10), "referido_recompensas:1:2")
+
+    async def falla(*args, **kwargs):
+        raise ConnectionError("mongo caído")
+
+    monkeypatch.setattr(database.usuarios_col, "update_one", falla)
+    trabajo = await ejecutar_trabajo(cola, db, BotFalso())
+
+    assert trabajo["estado"] == "pendiente"
+    assert trabajo["error"] == "mongo caído"
+
+async def test_hada_se_entrega_una_vez_aunque_el_trabajo_se_repita(db, monkeypatch):
+    await preparar(db)
+    monkeypatch.setattr(database, "notificar_recompensa", lambda *args, **kwargs: asyncio.sleep(0))
+
+    for _ in range(2):
+        await database.entregar_recompensas_referidos(None, 1, 10)
+
+    usuario = await db.usuarios.find_one({"user_id": 1})
+    assert usuario["inventario"]["hada"] == 1
+    assert usuario["hadas_referidos"] == [10]
+
+async def test_aviso_sin_enviar_se_reintenta(db, monkeypatch):
+    cola = await preparar(db)
+    envios = ColaEnvios(1000, 1000, 0.0, 0, 100, 1)
+    monkeypatch.setattr(referidos, "cola_envios", envios)
+    await cola.encolar("referido_notificaciones", datos_referido(), "referido_notificaciones:1:2")
+
+    trabajo = await ejecutar_trabajo(cola, db, BotFalso(falla=ConnectionError("telegram caído")))
+    assert trabajo["estado"] == "pendiente"
+
+    await db.trabajos.update_one({"_id": trabajo["_id"]}, {"$set": {"disponible_en": trabajo["fecha_creacion"]}})
+    bot = BotFalso()
+    trabajo = await ejecutar_trabajo(cola, db, bot)
+    assert trabajo["estado"] == "completado"
+    assert [chat_id for chat_id, _ in bot.enviados] == [1, 2]
+    assert "Ana" in bot.enviados[1][1]
+    await envios.detener()
+
+async def preparar_activos(db, referidos_ids) -> None:
+    await db.referidos.insert_many([
+        {"referidor_id": 1, "referido_id": referido_id, "activo": True, "recompensa_entregada": False}
+        for referido_id in referidos_ids
+    ])
+
+async def test_elfos_se_entregan_antes_de_marcar_los_referidos(db, monkeypatch):
+    await preparar(db)
+    await preparar_activos(db, [2, 3])
+    monkeypatch.setattr(database, "notificar_recompensa", lambda *args, **kwargs: asyncio.sleep(0))
+
+    async def falla(*args, **kwargs):
+        raise ConnectionError("mongo caído")
+
+    # Falla el inventario: los referidos siguen pendientes para el reintento
+    with monkeypatch.context() as parche:
+        parche.setattr(database.usuarios_col, "update_one", falla)
+        with pytest.raises(ConnectionError):
+            await database.entregar_recompensas_referidos(None, 1)
+    assert await db.referidos.count_documents({"recompensa_entregada": False}) == 2
+
+    # Falla el marcado tras entregar: el reintento no vuelve a entregar
+    with monkeypatch.context() as parche:
+        parche.setattr(database.referidos_col, "update_many", falla)
+        with pytest.raises(ConnectionError):
+            await database.entregar_recompensas_referidos(None, 1)
+    await database.entregar_recompensas_referidos(None, 1)
+
+    usuario = await db.usuarios.find_one({"user_id": 1})
+    assert usuario["inventario"]["elfo"] == 2
+    assert sorted(usuario["elfos_referidos"]) == [2, 3]
+    assert await db.referidos.count_documents({"recompensa_entregada": False}) == 0
+
+async def test_elfos_solo_de_los_referidos_nuevos(db, monkeypatch):
+    await preparar(db)
+    await preparar_activos(db, [2, 3])
+    monkeypatch.setattr(database, "notificar_recompensa", lambda *args, **kwargs: asyncio.sleep(0))
+    # El Elfo del referido 2 ya se entregó pero el referido quedó sin marcar
+    await db.usuarios.update_one({"user_id": 1}, {"$set": {"inventario.elfo": 1, "elfos_referidos": [2]}})
+
+    await database.entregar_recompensas_referidos(None, 1)
+
+    usuario = await db.usuarios.find_one({"user_id": 1})
+    assert usuario["inventario"]["elfo"] == 2
+    assert await db.referidos.count_documents({"recompensa_entregada": False}) == 0
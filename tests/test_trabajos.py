@@ -0,0 +1,111 @@
+"""Tests de la cola de trabajos (reclamo con bloqueo, reintentos e idempotencia)"""
+
+import datetime
+
+from utils.trabajos import ColaTrabajos
+
+def nueva_cola(bloqueo: float = 60, max_intentos: int = 3) -> ColaTrabajos:
+    return ColaTrabajos(1, 1, bloqueo, max_intentos)
+
+async def preparar(db) -> None:
+    await db.trabajos.create_index("clave", unique=True)
+
+async def test_encolar_es_idempotente_por_clave(db):
+    await preparar(db)
+    cola = nueva_cola()
+
+    assert await cola.encolar("saludo", {"x": 1}, "saludo:1") is True
+    assert await cola.encolar("saludo", {"x": 2}, "saludo:1") is False
+    assert await db.trabajos.count_documents({}) == 1
+
+async def test_reclamo_bloquea_el_trabajo(db):
+    await preparar(db)
+    cola = nueva_cola()
+    await cola.encolar("saludo", {}, "saludo:1")
+
+    trabajo = await cola.reclamar()
+    assert trabajo["estado"] == "en_proceso"
+    assert trabajo["intentos"] == 1
+    assert "reclamo" in trabajo
+    # Mientras dura el bloqueo nadie más lo reclama
+    assert await cola.reclamar() is None
+
+async def test_bloqueo_vencido_lo_reclama_otro_y_el_anterior_no_escribe(db):
+    await preparar(db)
+    cola = nueva_cola(bloqueo=0)
+    ejecutados = []
+
+    async def saludo(bot, datos):
+        ejecutados.append(datos)
+
+    cola.registrar("saludo", saludo)
+    await cola.encolar("saludo", {"x": 1}, "saludo:1")
+
+    viejo = await cola.reclamar()
+    nuevo = await cola.reclamar()
+    assert nuevo is not None
+    assert nuevo["intentos"] == 2
+    assert nuevo["reclamo"] != viejo["reclamo"]
+
+    # El dueño anterior termina tarde: su reclamo ya no vale
+    await cola._procesar(viejo)
+    guardado = await db.trabajos.find_one({"clave": "saludo:1"})
+    assert guardado["estado"] == "en_proceso"
+    assert guardado["reclamo"] == nuevo["reclamo"]
+
+    await cola._procesar(nuevo)
+    guardado = await db.trabajos.find_one({"clave": "saludo:1"})
+    assert guardado["estado"] == "completado"
+    assert "reclamo" not in guardado
+    assert len(ejecutados) == 2
+    assert cola.completados == 2
+
+async def test_error_reprograma_con_espera(db):
+    await preparar(db)
+    cola = nueva_cola()
+
+    async def falla(bot, datos):
+        raise RuntimeError("sin conexión")
+
+    cola.registrar("falla", falla)
+    await cola.encolar("falla", {}, "falla:1")
+
+    await cola._procesar(await cola.reclamar())
+    guardado = await db.trabajos.find_one({"clave": "falla:1"})
+    assert guardado["estado"] == "pendiente"
+    assert guardado["error"] == "sin conexión"
+    assert guardado["disponible_en"] > datetime.datetime.now()
+    # Todavía no toca reintentarlo
+    assert await cola.reclamar() is None
+
+async def test_agotar_intentos_lo_marca_fallido(db):
+    await preparar(db)
+    cola = nueva_cola(max_intentos=2)
+
+    async def falla(bot, datos):
+        raise RuntimeError("sin conexión")
+
+    cola.registrar("falla", falla)
+    await cola.encolar("falla", {}, "falla:1")
+
+    for _ in range(2):
+        await cola._procesar(await cola.reclamar())
+        # Adelanta el reintento programado
+        await db.trabajos.update_one({"clave": "falla:1"}, {"$set": {"disponible_en": datetime.datetime.now()}})
+
+    guardado = await db.trabajos.find_one({"clave": "falla:1"})
+    assert guardado["estado"] == "fallido"
+    assert guardado["intentos"] == 2
+    assert await cola.reclamar() is None
+    assert cola.fallidos == 1
+    assert await cola.resumen() == {"fallido": 1}
+
+async def test_tipo_desconocido_falla_sin_reintentos(db):
+    await preparar(db)
+    cola = nueva_cola()
+    await cola.encolar("inexistente", {}, "inexistente:1")
+
+    await cola._procesar(await cola.reclamar())
+    guardado = await db.trabajos.find_one({"clave": "inexistente:1"})
+    assert guardado["estado"] == "fallido"
+    assert "desconocido" in guardado["error"]
@@ -0,0 +1,111 @@
+"""
+Caché en memoria con expiración (TTL) y desalojo LRU para el bot Mundo Mítico
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+class CacheLRU:
+    """
+    Caché acotada en memoria.
+
+    Cada entrada expira a los `ttl` segundos y, cuando se supera
+    `max_entradas`, se desaloja la entrada usada hace más tiempo.
+    Lleva contadores de aciertos y fallos para poder dimensionarla.
+
+    Cada invalidación sube una generación. Una lectura que tomó
+    generacion() antes de ir a la base de datos guarda su resultado con
+    guardar_si_vigente(), que lo rechaza si la clave se invalidó mientras
+    tanto: así una lectura lenta no vuelve a meter el documento de antes de
+    una escritura.
+    """
+
+    def __init__(self, max_entradas: int, ttl: float):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        # clave -> (momento de expiración, valor)
+        self._datos: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._generacion = 0
+        # clave -> generación de su última invalidación
+        self._invalidadas: Dict[Hashable, int] = {}
+        # Las lecturas de una generación anterior se rechazan (tras podar o limpiar)
+        self._corte = 0
+
+    def obtener(self, clave: Hashable, por_defecto: Any = None) -> Any:
+        """Devuelve el valor en caché o `por_defecto` si no está o expiró"""
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            self.fallos += 1
+            return por_defecto
+
+        expira, valor = entrada
+        if expira <= time.monotonic():
+            del self._datos[clave]
+            self.fallos += 1
+            return por_defecto
+
+        self._datos.move_to_end(clave)
+        self.aciertos += 1
+        return valor
+
+    def consultar(self, clave: Hashable) -> Any:
+        """Devuelve el valor vigente sin alterar los contadores ni el orden LRU"""
+        entrada = self._datos.get(clave)
+        if entrada is None or entrada[0] <= time.monotonic():
+            return None
+        return entrada[1]
+
+    def guardar(self, clave: Hashable, valor: Any, ttl: Optional[float] = None) -> None:
+        """Guarda un valor, desalojando la entrada menos usada si hace falta"""
+        if self.max_entradas <= 0:
+            return
+
+        self._datos[clave] = (time.monotonic() + (self.ttl if ttl is None else ttl), valor)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+
+    def generacion(self) -> int:
+        """Generación actual: tomarla antes de leer el valor de la fuente"""
+        return self._generacion
+
+    def guardar_si_vigente(self, clave: Hashable, valor: Any, generacion: int, ttl: Optional[float] = None) -> bool:
+        """Guarda un valor leído en `generacion` salvo que la clave se haya invalidado después"""
+        if generacion < self._corte or self._invalidadas.get(clave, 0) > generacion:
+            return False
+        self.guardar(clave, valor, ttl)
+        return True
+
+    def invalidar(self, clave: Hashable) -> None:
+        """Elimina una entrada de la caché y rechaza las lecturas en curso de esa clave"""
+        self._datos.pop(clave, None)
+        self._generacion += 1
+        self._invalidadas[clave] = self._generacion
+        if len(self._invalidadas) > max(self.max_entradas, 1000):
+            # Se olvidan las invalidaciones: a cambio se rechaza toda lectura anterior
+            self._invalidadas.clear()
+            self._corte = self._generacion
+
+    def limpiar(self) -> None:
+        """Vacía la caché y rechaza las lecturas en curso (los contadores se conservan)"""
+        self._datos.clear()
+        self._generacion += 1
+        self._invalidadas.clear()
+        self._corte = self._generacion
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """Devuelve los contadores de uso de la caché"""
+        total = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / total if total else 0.0,
+            "entradas": len(self._datos),
+            "max_entradas": self.max_entradas
+        }
+
+    def __len__(self) -> int:
+        return len(self._datos)
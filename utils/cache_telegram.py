@@ -0,0 +1,143 @@
+"""
+Caché de lecturas de la Bot API (get_me, get_chat, get_chat_member)
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Union
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNotFound
+from aiogram.types import ChatFullInfo, ChatMember, User
+from utils.cache import CacheLRU
+from config.config import (
+    CACHE_TELEGRAM_MAX,
+    CACHE_TELEGRAM_TTL_GET_ME,
+    CACHE_TELEGRAM_TTL_GET_CHAT,
+    CACHE_TELEGRAM_TTL_GET_CHAT_MEMBER,
+    CACHE_TELEGRAM_TTL_ERROR
+)
+
+# Errores definitivos de Telegram (chat inexistente, sin acceso...) que se
+# guardan en caché. Los de red o de límite (429) no: se reintenta al momento.
+ERRORES_CACHEABLES = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound)
+
+# Estados de get_chat_member que no cuentan como suscrito
+ESTADOS_NO_MIEMBRO = ("left", "kicked")
+
+class _ErrorCacheado:
+    """Error de Telegram guardado en caché (caché negativa)"""
+    __slots__ = ("excepcion",)
+
+    def __init__(self, excepcion: Exception):
+        self.excepcion = excepcion
+
+class CacheTelegram:
+    """
+    Caché de lecturas de la Bot API con TTL por método.
+
+    - Cada método tiene su CacheLRU con su TTL (get_me casi no cambia, el
+      estado de un miembro sí).
+    - Caché negativa: los errores definitivos se guardan `ttl_error`
+      segundos y se vuelven a lanzar sin llamar a Telegram.
+    - Agrupación de peticiones: llamadas concurrentes con la misma clave
+      comparten una única petición en vuelo.
+    """
+
+    def __init__(self, max_entradas: int, ttl_get_me: float, ttl_get_chat: float,
+                 ttl_get_chat_member: float, ttl_error: float):
+        self.ttl_error = ttl_error
+        self._caches: Dict[str, CacheLRU] = {
+            "get_me": CacheLRU(16, ttl_get_me),
+            "get_chat": CacheLRU(max_entradas, ttl_get_chat),
+            "get_chat_member": CacheLRU(max_entradas, ttl_get_chat_member),
+        }
+        self._en_vuelo: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        self.llamadas_api = {metodo: 0 for metodo in self._caches}
+        self.agrupadas = {metodo: 0 for metodo in self._caches}
+
+    async def _obtener(self, metodo: str, clave: Hashable, llamada: Callable[[], Awaitable],
+                       refrescar: bool = False, cachear: Optional[Callable[[Any], bool]] = None) -> Any:
+        cache = self._caches[metodo]
+        if not refrescar:
+            valor = cache.obtener(clave)
+            if isinstance(valor, _ErrorCacheado):
+                raise valor.excepcion.with_traceback(None)
+            if valor is not None:
+                return valor
+
+        en_vuelo = (metodo, clave)
+        tarea = self._en_vuelo.get(en_vuelo)
+        if tarea is None:
+            self.llamadas_api[metodo] += 1
+            tarea = asyncio.ensure_future(self._llamar(cache, clave, llamada, cachear))
+            self._en_vuelo[en_vuelo] = tarea
+            tarea.add_done_callback(lambda t: self._terminar(en_vuelo, t))
+        else:
+            self.agrupadas[metodo] += 1
+        # shield: si un llamador se cancela, la petición sigue para los demás
+        return await asyncio.shield(tarea)
+
+    async def _llamar(self, cache: CacheLRU, clave: Hashable, llamada: Callable[[], Awaitable],
+                      cachear: Optional[Callable[[Any], bool]]) -> Any:
+        # Un invalidar_* durante la llamada descarta el resultado (p. ej. update chat_member)
+        generacion = cache.generacion()
+        try:
+            valor = await llamada()
+        except ERRORES_CACHEABLES as e:
+            cache.guardar_si_vigente(clave, _ErrorCacheado(e), generacion, self.ttl_error)
+            raise
+        if cachear is None or cachear(valor):
+            cache.guardar_si_vigente(clave, valor, generacion)
+        return valor
+
+    def _terminar(self, en_vuelo: Tuple[str, Hashable], tarea: asyncio.Future) -> None:
+        self._en_vuelo.pop(en_vuelo, None)
+        # Marca la excepción como leída aunque todos los llamadores se hayan cancelado
+        if not tarea.cancelled():
+            tarea.exception()
+
+    async def get_me(self, bot: Bot) -> User:
+        """bot.get_me() en caché"""
+        return await self._obtener("get_me", bot.id, bot.get_me)
+
+    async def get_chat(self, bot: Bot, chat_id: Union[int, str], refrescar: bool = False) -> ChatFullInfo:
+        """bot.get_chat(chat_id) en caché"""
+        return await self._obtener("get_chat", chat_id, lambda: bot.get_chat(chat_id), refrescar)
+
+    async def get_chat_member(self, bot: Bot, chat_id: Union[int, str], user_id: int,
+                              refrescar: bool = False) -> ChatMember:
+        """
+        bot.get_chat_member(chat_id, user_id) en caché; `refrescar` ignora la entrada guardada.
+
+        Solo se guardan los miembros: si el usuario no está (left/kicked) se
+        vuelve a consultar la próxima vez, así se ve enseguida cuando se une.
+        """
+        return await self._obtener(
+            "get_chat_member", (chat_id, user_id),
+            lambda: bot.get_chat_member(chat_id, user_id), refrescar,
+            cachear=lambda miembro: miembro.status not in ESTADOS_NO_MIEMBRO
+        )
+
+    def invalidar_chat(self, chat_id: Union[int, str]) -> None:
+        self._caches["get_chat"].invalidar(chat_id)
+
+    def invalidar_miembro(self, chat_id: Union[int, str], user_id: int) -> None:
+        self._caches["get_chat_member"].invalidar((chat_id, user_id))
+
+    def estadisticas(self) -> Dict[str, Dict[str, Any]]:
+        """Aciertos, fallos, llamadas a la API y peticiones agrupadas por método"""
+        return {
+            metodo: {
+                **cache.estadisticas(),
+                "llamadas_api": self.llamadas_api[metodo],
+                "agrupadas": self.agrupadas[metodo]
+            }
+            for metodo, cache in self._caches.items()
+        }
+
+cache_telegram = CacheTelegram(
+    CACHE_TELEGRAM_MAX,
+    CACHE_TELEGRAM_TTL_GET_ME,
+    CACHE_TELEGRAM_TTL_GET_CHAT,
+    CACHE_TELEGRAM_TTL_GET_CHAT_MEMBER,
+    CACHE_TELEGRAM_TTL_ERROR
+)
@@ -1,8 +1,27 @@
 import motor.motor_asyncio
+import asyncio
+import copy
+import random
+import time
 import datetime
 import logging
-from typing import Optional, Dict, Any, List
-from config.config import MONGO_URI, DB_NAME
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+from bson import ObjectId
+from pymongo import ReadPreference, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from config.config import (
+    MONGO_URI, DB_NAME,
+    CACHE_USUARIOS_MAX, CACHE_USUARIOS_TTL,
+    LOGS_LOTE_MAX, LOGS_INTERVALO_ESCRITURA, LOGS_MAX_PENDIENTES,
+    ACTIVIDAD_VENTANA, ACTIVIDAD_INTERVALO_ESCRITURA,
+    NFTS_CONTADOR_SLOTS,
+    ESTADISTICAS_INTERVALO, ESTADISTICAS_DIAS_ACTIVOS, ESTADISTICAS_LEER_SECUNDARIO,
+    TRABAJOS_RETENCION
+)
+from utils.cache import CacheLRU
+from utils.cache_telegram import cache_telegram
+from utils.segundo_plano import iniciar_tarea, iniciar_tarea_periodica, al_detener
+from utils.envios import cola_envios
 from utils.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -25,20 +44,62 @@ except Exception as e:
 
 # Colecciones
 usuarios_col = db.usuarios
+# Colección antigua de inventarios: el inventario vive en usuarios.inventario
+# y esta colección solo se lee para migrar (ver migrar_inventarios)
 inventarios_col = db.inventarios
 depositos_col = db.depositos
 creditos_col = db.creditos
 referidos_col = db.referidos
 logs_col = db.logs
 promos_col = db.promos
+contadores_col = db.contadores
+difusiones_col = db.difusiones
+trabajos_col = db.trabajos
+
+# NFTs con contador global (documentos "nfts:<slot>" en contadores_col)
+NFTS_RASTREADOS = ("moguri", "gargola", "ghost")
+# Bloqueo de la reconciliación de esos contadores (fuera del prefijo "nfts:")
+NFTS_BLOQUEO_ID = "bloqueo:reconciliar_nfts"
+NFTS_BLOQUEO_DURACION = 600  # segundos
+# Lecturas estables que intenta una reconciliación antes de dejarlo para la siguiente
+NFTS_RECONCILIACION_INTENTOS = 3
+
+# Se activa en init_db si el servidor es un replica set o un clúster
+soporta_transacciones = False
+
+# Caché de lectura de documentos de usuario (incluye el inventario) por user_id.
+# Toda escritura de este módulo sobre un usuario actualiza o invalida su entrada.
+cache_usuarios = CacheLRU(CACHE_USUARIOS_MAX, CACHE_USUARIOS_TTL)
+
+def invalidar_usuario(user_id: int) -> None:
+    """Invalida el documento de usuario en caché (llamar tras escribir en él)"""
+    cache_usuarios.invalidar(user_id)
+
+def estadisticas_cache() -> Dict[str, Dict[str, Any]]:
+    """Devuelve aciertos, fallos y ocupación de la caché de usuarios y de la Bot API"""
+    return {
+        "usuarios": cache_usuarios.estadisticas(),
+        **{f"telegram_{metodo}": datos for metodo, datos in cache_telegram.estadisticas().items()}
+    }
 
 async def init_db():
     """Inicializa la base de datos y crea índices necesarios"""
+    global soporta_transacciones
     try:
+        # Las transacciones multi-documento requieren replica set o mongos
+        try:
+            hello = await client.admin.command("hello")
+            soporta_transacciones = "setName" in hello or hello.get("msg") == "isdbgrid"
+            logger.info(f"ℹ️ Transacciones disponibles: {soporta_transacciones}")
+        except Exception as hello_error:
+            logger.warning(f"⚠️ No se pudo detectar soporte de transacciones: {hello_error}")
+
         # Intentar crear índices para optimizar consultas
         try:
             await usuarios_col.create_index("user_id", unique=True)
             await usuarios_col.create_index("username")
+            await usuarios_col.create_index("ultima_actividad")
+            await usuarios_col.create_index("proximo_recordatorio", sparse=True)
             await inventarios_col.create_index("user_id", unique=True)
             await depositos_col.create_index("user_id")
             await depositos_col.create_index("estado")
@@ -47,9 +108,15 @@ async def init_db():
             await creditos_col.create_index("estado")
             await creditos_col.create_index("fecha")
             await referidos_col.create_index([("referidor_id", 1), ("referido_id", 1)], unique=True)
+            await referidos_col.create_index("referido_id")
+            await referidos_col.create_index([("referidor_id", 1), ("activo", 1), ("recompensa_entregada", 1)])
             await logs_col.create_index("fecha")
             await logs_col.create_index("actor_id")
             await promos_col.create_index("user_id", unique=True)
+            await difusiones_col.create_index("estado")
+            await trabajos_col.create_index("clave", unique=True)
+            await trabajos_col.create_index([("estado", 1), ("disponible_en", 1)])
+            await trabajos_col.create_index("fecha_fin", expireAfterSeconds=TRABAJOS_RETENCION)
             logger.info("✅ Índices de base de datos creados correctamente")
         except Exception as index_error:
             # Si no se pueden crear índices (permisos X509), continuar sin ellos
@@ -61,10 +128,11 @@ async def init_db():
         logger.error(f"❌ Error inicializando base de datos: {e}")
         raise
 
-async def obtener_o_crear_usuario(user_id: int, username: str = None, first_name: str = None):
-    """Obtiene o crea un usuario en la base de datos"""
+async def obtener_o_crear_usuario(user_id: int, username: str = None, first_name: str = None, usuario: dict = None):
+    """Obtiene o crea un usuario en la base de datos (usa `usuario` si ya fue cargado)"""
     try:
-        usuario = await usuarios_col.find_one({"user_id": user_id})
+        if usuario is None:
+            usuario = await obtener_usuario(user_id)
         if not usuario:
             usuario_data = {
                 "user_id": user_id,
@@ -86,10 +154,24 @@ async def obtener_o_crear_usuario(user_id: int, username: str = None, first_name
         logger.error(f"Error obteniendo/creando usuario {user_id}: {e}")
         return None
 
-async def obtener_balance_usuario(user_id: int) -> float:
-    """Obtiene el balance de un usuario"""
-    try:
+async def obtener_usuario(user_id: int) -> Optional[dict]:
+    """Obtiene el documento de un usuario pasando por la caché"""
+    usuario = cache_usuarios.obtener(user_id)
+    if usuario is None:
+        # Si se escribe en el usuario durante la lectura, el resultado no se guarda
+        generacion = cache_usuarios.generacion()
         usuario = await usuarios_col.find_one({"user_id": user_id})
+        if not usuario:
+            return None
+        cache_usuarios.guardar_si_vigente(user_id, usuario, generacion)
+    # Copia para que los cambios del llamador no alteren la caché
+    return copy.deepcopy(usuario)
+
+async def obtener_balance_usuario(user_id: int, usuario: dict = None) -> float:
+    """Obtiene el balance de un usuario (usa `usuario` si ya fue cargado)"""
+    try:
+        if usuario is None:
+            usuario = await obtener_usuario(user_id)
         return float(usuario.get("balance", 0)) if usuario else 0.0
     except Exception as e:
         logger.error(f"Error obteniendo balance para {user_id}: {e}")
@@ -102,6 +184,7 @@ async def descontar_balance_usuario(user_id: int, cantidad: float) -> bool:
             {"user_id": user_id, "balance": {"$gte": cantidad}},
             {"$inc": {"balance": -cantidad}}
         )
+        invalidar_usuario(user_id)
         return result.modified_count > 0
     except Exception as e:
         logger.error(f"Error descontando balance para {user_id}: {e}")
@@ -114,16 +197,18 @@ async def agregar_balance_usuario(user_id: int, cantidad: float) -> bool:
             {"user_id": user_id},
             {"$inc": {"balance": cantidad}}
         )
+        invalidar_usuario(user_id)
         return result.modified_count > 0
     except Exception as e:
         logger.error(f"Error agregando balance para {user_id}: {e}")
         return False
 
-async def obtener_inventario_usuario(user_id: int) -> dict:
-    """Obtiene el inventario de un usuario"""
+async def obtener_inventario_usuario(user_id: int, usuario: dict = None) -> dict:
+    """Obtiene el inventario de un usuario (usa `usuario` si ya fue cargado)"""
     try:
-        inventario = await inventarios_col.find_one({"user_id": user_id})
-        return inventario.get("items", {}) if inventario else {}
+        if usuario is None or "inventario" not in usuario:
+            usuario = await obtener_usuario(user_id)
+        return dict(usuario.get("inventario", {})) if usuario else {}
     except Exception as e:
         logger.error(f"Error obteniendo inventario para {user_id}: {e}")
         return {}
@@ -131,11 +216,14 @@ async def obtener_inventario_usuario(user_id: int) -> dict:
 async def agregar_item_inventario(user_id: int, item: str, cantidad: int = 1) -> bool:
     """Agrega un item al inventario de un usuario"""
     try:
-        result = await inventarios_col.update_one(
+        result = await usuarios_col.update_one(
             {"user_id": user_id},
-            {"$inc": {f"items.{item}": cantidad}},
-            upsert=True
+            {"$inc": {f"inventario.{item}": cantidad}}
         )
+        invalidar_usuario(user_id)
+        if result.matched_count == 0:
+            return False
+        await incrementar_contador_nfts(item, cantidad)
         return True
     except Exception as e:
         logger.error(f"Error agregando item {item} para {user_id}: {e}")
@@ -149,40 +237,172 @@ async def obtener_usuario_por_username(username: str):
         logger.error(f"Error obteniendo usuario por username {username}: {e}")
         return None
 
+class RegistroActividad:
+    """
+    Guarda en memoria la última actividad de cada usuario y la escribe en lote.
+
+    Cada usuario se escribe como máximo una vez por `ventana` segundos; las
+    escrituras pendientes se envían con bulk_write cada `intervalo` segundos.
+    """
+
+    def __init__(self, ventana: int, intervalo: float):
+        self.ventana = ventana
+        self.intervalo = intervalo
+        self.activo = False
+        # user_id -> última actividad aún no escrita
+        self._pendientes: Dict[int, datetime.datetime] = {}
+        # user_id -> momento (monotónico) de la última escritura
+        self._escritos: Dict[int, float] = {}
+
+    def iniciar(self) -> None:
+        """Inicia la escritura periódica en segundo plano"""
+        self.activo = True
+        iniciar_tarea_periodica("registro_actividad", self.escribir, self.intervalo)
+        al_detener(self.detener)
+
+    def registrar(self, user_id: int, momento: datetime.datetime) -> None:
+        """Registra actividad; se descarta si el usuario ya se escribió en esta ventana"""
+        if user_id not in self._pendientes:
+            escrito = self._escritos.get(user_id)
+            if escrito is not None and time.monotonic() - escrito < self.ventana:
+                return
+        self._pendientes[user_id] = momento
+
+    async def escribir(self) -> None:
+        """Escribe en lote la actividad pendiente"""
+        if not self._pendientes:
+            return
+
+        lote, self._pendientes = self._pendientes, {}
+        operaciones = [
+            UpdateOne({"user_id": user_id}, {"$max": {"ultima_actividad": momento}})
+            for user_id, momento in lote.items()
+        ]
+        try:
+            await usuarios_col.bulk_write(operaciones, ordered=False)
+        except Exception as e:
+            logger.error(f"Error escribiendo actividad de {len(lote)} usuarios: {e}")
+
+        ahora = time.monotonic()
+        self._escritos = {
+            user_id: escrito
+            for user_id, escrito in self._escritos.items()
+            if ahora - escrito < self.ventana
+        }
+        for user_id in lote:
+            self._escritos[user_id] = ahora
+
+    async def detener(self) -> None:
+        """Escribe la actividad pendiente. Las siguientes se escriben directamente."""
+        self.activo = False
+        await self.escribir()
+
+registro_actividad = RegistroActividad(ACTIVIDAD_VENTANA, ACTIVIDAD_INTERVALO_ESCRITURA)
+
 async def actualizar_ultima_actividad(user_id: int):
-    """Actualiza la última actividad de un usuario"""
+    """Actualiza la última actividad de un usuario (en lote si el registro está activo)"""
     try:
-        await usuarios_col.update_one(
-            {"user_id": user_id},
-            {"$set": {"ultima_actividad": datetime.datetime.now()}}
-        )
+        ahora = datetime.datetime.now()
+        if registro_actividad.activo:
+            registro_actividad.registrar(user_id, ahora)
+        else:
+            await usuarios_col.update_one(
+                {"user_id": user_id},
+                {"$set": {"ultima_actividad": ahora}}
+            )
+        usuario = cache_usuarios.consultar(user_id)
+        if usuario is not None:
+            usuario["ultima_actividad"] = ahora
     except Exception as e:
         logger.error(f"Error actualizando actividad para {user_id}: {e}")
 
-async def agregar_referido(referidor_id: int, referido_id: int):
-    """Agrega una relación de referido"""
-    try:
+async def _incrementar_contador_referidos(referidor_id: int, campo: str, session=None) -> Optional[int]:
+    """
+    Incrementa `campo` (referidos_total o referidos_activos) del referidor y
+    devuelve su valor nuevo (0 si el referidor no existe).
+
+    Solo hace $inc si el contador ya existe: en un referidor sin contadores
+    el $inc lo crearía con 1 y contar_referidos dejaría de contar su total
+    real. En ese caso los dos contadores se inicializan contando en
+    referidos_col, que ya incluye la relación recién escrita.
+    """
+    usuario = await usuarios_col.find_one_and_update(
+        {"user_id": referidor_id, campo: {"$exists": True}},
+        {"$inc": {campo: 1}},
+        projection={campo: 1},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    if usuario is None:
+        total = await referidos_col.count_documents({"referidor_id": referidor_id}, session=session)
+        activos = await referidos_col.count_documents(
+            {"referidor_id": referidor_id, "activo": True}, session=session
+        )
+        # $max: si otro referido lo inicializa a la vez se queda el conteo más reciente
+        usuario = await usuarios_col.find_one_and_update(
+            {"user_id": referidor_id},
+            {"$max": {"referidos_total": total, "referidos_activos": activos}},
+            projection={campo: 1},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+    invalidar_usuario(referidor_id)
+    return usuario[campo] if usuario else 0
+
+async def agregar_referido(referidor_id: int, referido_id: int,
+                           al_agregar: Optional[Callable[[int, Any], Awaitable]] = None) -> Optional[int]:
+    """
+    Agrega una relación de referido.
+
+    `al_agregar(numero, session)` se ejecuta tras registrarlo (p. ej. para
+    encolar sus trabajos). Con replica set la relación, el contador y lo que
+    escriba `al_agregar` con esa sesión van en una misma transacción, que se
+    reintenta ante conflictos; sin replica set se escriben en ese orden.
+
+    Returns:
+        Número del referido para el referidor (referidos_total tras contarlo;
+        0 si el referidor no existe) o None si ya estaba registrado
+
+    Raises:
+        Los errores de MongoDB distintos de la clave duplicada
+    """
+    async def registrar(session=None) -> int:
         await referidos_col.insert_one({
             "referidor_id": referidor_id,
             "referido_id": referido_id,
             "fecha": datetime.datetime.now(),
             "activo": False,
             "recompensa_entregada": False
-        })
-        logger.info(f"✅ Referido agregado: {referidor_id} -> {referido_id}")
-        return True
-    except Exception as e:
-        if "duplicate key error" not in str(e).lower():
-            logger.error(f"Error agregando referido {referidor_id} -> {referido_id}: {e}")
-        return False
+        }, session=session)
+        # Solo se cuenta si la inserción no fue un duplicado
+        numero = await _incrementar_contador_referidos(referidor_id, "referidos_total", session=session)
+        if al_agregar is not None:
+            await al_agregar(numero, session)
+        return numero
+
+    try:
+        if soporta_transacciones:
+            async with await client.start_session() as session:
+                numero = await session.with_transaction(registrar)
+            invalidar_usuario(referidor_id)
+        else:
+            numero = await registrar()
+    except DuplicateKeyError:
+        return None
+    logger.info(f"✅ Referido agregado: {referidor_id} -> {referido_id} (#{numero})")
+    return numero
 
 async def marcar_referido_activo(referido_id: int):
     """Marca un referido como activo (primer depósito)"""
     try:
-        await referidos_col.update_one(
-            {"referido_id": referido_id},
-            {"$set": {"activo": True}}
+        referido = await referidos_col.find_one_and_update(
+            {"referido_id": referido_id, "activo": {"$ne": True}},
+            {"$set": {"activo": True}},
+            projection={"referidor_id": 1}
         )
+        # Solo se cuenta la primera vez que pasa a activo
+        if referido:
+            await _incrementar_contador_referidos(referido["referidor_id"], "referidos_activos")
         return True
     except Exception as e:
         logger.error(f"Error marcando referido activo {referido_id}: {e}")
@@ -197,17 +417,27 @@ async def obtener_referidos(referidor_id: int):
         logger.error(f"Error obteniendo referidos para {referidor_id}: {e}")
         return []
 
-async def contar_referidos(referidor_id: int):
-    """Cuenta el total de referidos de un usuario"""
+async def contar_referidos(referidor_id: int, usuario: dict = None):
+    """Cuenta el total de referidos de un usuario (contador del documento de usuario)"""
     try:
+        if usuario is None:
+            usuario = await obtener_usuario(referidor_id)
+        if usuario and "referidos_total" in usuario:
+            return usuario["referidos_total"]
+        # Usuario sin contadores (aún no reconstruidos)
         return await referidos_col.count_documents({"referidor_id": referidor_id})
     except Exception as e:
         logger.error(f"Error contando referidos para {referidor_id}: {e}")
         return 0
 
-async def contar_referidos_activos(referidor_id: int):
-    """Cuenta los referidos activos de un usuario"""
+async def contar_referidos_activos(referidor_id: int, usuario: dict = None):
+    """Cuenta los referidos activos de un usuario (contador del documento de usuario)"""
     try:
+        if usuario is None:
+            usuario = await obtener_usuario(referidor_id)
+        if usuario and "referidos_activos" in usuario:
+            return usuario["referidos_activos"]
+        # Usuario sin contadores (aún no reconstruidos)
         return await referidos_col.count_documents({
             "referidor_id": referidor_id,
             "activo": True
@@ -216,6 +446,90 @@ async def contar_referidos_activos(referidor_id: int):
         logger.error(f"Error contando referidos activos para {referidor_id}: {e}")
         return 0
 
+async def migrar_inventarios(tamano_lote: int = 1000) -> Dict[str, int]:
+    """
+    Fusiona la colección antigua `inventarios` en usuarios.inventario.
+
+    Recorre la colección en lotes y aplica un $inc por usuario con bulk_write.
+    Cada usuario migrado queda marcado con `inventario_migrado`, así que el
+    comando se puede repetir sin duplicar items.
+
+    Returns:
+        Contadores de documentos leídos, migrados y omitidos
+    """
+    leidos = 0
+    migrados = 0
+    operaciones = []
+
+    async def escribir_lote() -> int:
+        if not operaciones:
+            return 0
+        result = await usuarios_col.bulk_write(operaciones, ordered=False)
+        operaciones.clear()
+        return result.modified_count
+
+    cursor = inventarios_col.find({}, {"user_id": 1, "items": 1}, batch_size=tamano_lote)
+    async for inventario in cursor:
+        leidos += 1
+        items = {
+            f"inventario.{item}": cantidad
+            for item, cantidad in (inventario.get("items") or {}).items()
+            if isinstance(cantidad, (int, float)) and cantidad
+        }
+        actualizacion = {"$set": {"inventario_migrado": True}}
+        if items:
+            actualizacion["$inc"] = items
+        operaciones.append(UpdateOne(
+            {"user_id": inventario["user_id"], "inventario_migrado": {"$ne": True}},
+            actualizacion
+        ))
+        if len(operaciones) >= tamano_lote:
+            migrados += await escribir_lote()
+
+    migrados += await escribir_lote()
+    cache_usuarios.limpiar()
+
+    resultado = {"leidos": leidos, "migrados": migrados, "omitidos": leidos - migrados}
+    logger.info(f"✅ Migración de inventarios completada: {resultado}")
+    return resultado
+
+async def reconstruir_contadores_referidos(tamano_lote: int = 1000) -> int:
+    """
+    Reconstruye referidos_total y referidos_activos de los usuarios a partir
+    de la colección de referidos, procesando los resultados en lotes.
+
+    Returns:
+        Número de referidores actualizados
+    """
+    pipeline = [
+        {"$group": {
+            "_id": "$referidor_id",
+            "total": {"$sum": 1},
+            "activos": {"$sum": {"$cond": [{"$eq": ["$activo", True]}, 1, 0]}}
+        }}
+    ]
+    actualizados = 0
+    operaciones = []
+    cursor = referidos_col.aggregate(pipeline, allowDiskUse=True, batchSize=tamano_lote)
+
+    async for grupo in cursor:
+        operaciones.append(UpdateOne(
+            {"user_id": grupo["_id"]},
+            {"$set": {"referidos_total": grupo["total"], "referidos_activos": grupo["activos"]}}
+        ))
+        if len(operaciones) >= tamano_lote:
+            await usuarios_col.bulk_write(operaciones, ordered=False)
+            actualizados += len(operaciones)
+            operaciones = []
+
+    if operaciones:
+        await usuarios_col.bulk_write(operaciones, ordered=False)
+        actualizados += len(operaciones)
+
+    cache_usuarios.limpiar()
+    logger.info(f"✅ Contadores de referidos reconstruidos para {actualizados} usuarios")
+    return actualizados
+
 async def marcar_recompensa_entregada(referido_id: int):
     """Marca que se entregó la recompensa por un referido"""
     try:
@@ -237,62 +551,117 @@ async def recompensa_entregada(referido_id: int):
         logger.error(f"Error verificando recompensa para {referido_id}: {e}")
         return False
 
-async def notificar_recompensa(bot, user_id: int, tipo: str):
+async def notificar_recompensa(bot, user_id: int, tipo: str, cantidad: int = 1):
     """Notifica a un usuario sobre una recompensa recibida"""
     try:
-        mensaje = f"🎉 ¡Felicidades! Has recibido 1 {tipo} por tus referidos."
-        await bot.send_message(user_id, mensaje)
-        logger.info(f"✅ Notificación de recompensa enviada a {user_id}: {tipo}")
+        mensaje = f"🎉 ¡Felicidades! Has recibido {cantidad} {tipo} por tus referidos."
+        cola_envios.encolar(bot, user_id, mensaje)
+        logger.info(f"✅ Notificación de recompensa encolada para {user_id}: {tipo}")
     except Exception as e:
-        logger.error(f"Error enviando notificación de recompensa a {user_id}: {e}")
+        logger.error(f"Error encolando notificación de recompensa para {user_id}: {e}")
+
+def mensaje_nuevo_referido(referido_id: int, referido_name: str) -> str:
+    """Texto del aviso al referidor de un nuevo referido"""
+    return (
+        f"👥 ¡Nuevo referido!\n\n"
+        f"Usuario: {referido_name}\n"
+        f"ID: {referido_id}\n\n"
+        "¡Sigue invitando para obtener más recompensas!"
+    )
+
+def mensaje_has_sido_referido(referidor_name: str) -> str:
+    """Texto del aviso al referido de quién lo invitó"""
+    return (
+        f"🎉 ¡Bienvenido a Mundo Mítico!\n\n"
+        f"Has sido invitado por: {referidor_name}\n\n"
+        "¡Disfruta de tu aventura en el mundo mítico!"
+    )
 
 async def notificar_nuevo_referido(bot, referidor_id: int, referido_id: int, referido_name: str):
     """Notifica a un referidor sobre un nuevo referido"""
     try:
-        mensaje = (
-            f"👥 ¡Nuevo referido!\n\n"
-            f"Usuario: {referido_name}\n"
-            f"ID: {referido_id}\n\n"
-            "¡Sigue invitando para obtener más recompensas!"
-        )
-        await bot.send_message(referidor_id, mensaje)
-        logger.info(f"✅ Notificación de nuevo referido enviada a {referidor_id}")
+        cola_envios.encolar(bot, referidor_id, mensaje_nuevo_referido(referido_id, referido_name))
+        logger.info(f"✅ Notificación de nuevo referido encolada para {referidor_id}")
     except Exception as e:
-        logger.error(f"Error enviando notificación de nuevo referido a {referidor_id}: {e}")
+        logger.error(f"Error encolando notificación de nuevo referido para {referidor_id}: {e}")
 
 async def notificar_has_sido_referido(bot, referido_id: int, referidor_name: str):
     """Notifica a un usuario que ha sido referido"""
     try:
-        mensaje = (
-            f"🎉 ¡Bienvenido a Mundo Mítico!\n\n"
-            f"Has sido invitado por: {referidor_name}\n\n"
-            "¡Disfruta de tu aventura en el mundo mítico!"
-        )
-        await bot.send_message(referido_id, mensaje)
-        logger.info(f"✅ Notificación de referido enviada a {referido_id}")
+        cola_envios.encolar(bot, referido_id, mensaje_has_sido_referido(referidor_name))
+        logger.info(f"✅ Notificación de referido encolada para {referido_id}")
     except Exception as e:
-        logger.error(f"Error enviando notificación de referido a {referido_id}: {e}")
+        logger.error(f"Error encolando notificación de referido para {referido_id}: {e}")
 
-async def verificar_recompensas_referidos(bot, referidor_id: int):
-    """Verifica y entrega recompensas por referidos"""
-    try:
-        referidos = await obtener_referidos(referidor_id)
-        total_referidos = len(referidos)
-        referidos_activos = len([r for r in referidos if r.get("activo", False)])
-        
-        # Recompensa por cada 10 referidos (Hada)
-        if total_referidos >= 10 and total_referidos % 10 == 0:
-            await agregar_item_inventario(referidor_id, "hada", 1)
+async def entregar_recompensas_referidos(bot, referidor_id: int, numero_referido: Optional[int] = None) -> None:
+    """
+    Entrega las recompensas por referidos pendientes del referidor.
+
+    El Hada se entrega cuando `numero_referido` (el número que recibió el
+    referido al contarlo en agregar_referido) es múltiplo de 10. El hito se
+    marca en `hadas_referidos` en la misma escritura que el item, así un
+    trabajo repetido no entrega otra. No depende del total actual: otro
+    referido pudo llegar antes de que corriera el trabajo.
+
+    Para los Elfos solo lee los referidos activos sin recompensa (por
+    índice) y primero los entrega: una sola escritura suma los Elfos al
+    inventario y apunta esos referidos en `elfos_referidos`, con la
+    condición de que ninguno estuviera ya apuntado, así dos verificaciones
+    concurrentes no duplican recompensas. Solo después se marcan los
+    referidos con recompensa_entregada; si eso falla, la siguiente pasada
+    los vuelve a leer, ve que ya se entregaron y solo los marca.
+
+    Raises:
+        Los errores de MongoDB: la cola de trabajos reintenta la entrega
+    """
+    # Recompensa por cada 10 referidos (Hada)
+    if numero_referido and numero_referido % 10 == 0:
+        result = await usuarios_col.update_one(
+            {"user_id": referidor_id, "hadas_referidos": {"$ne": numero_referido}},
+            {"$inc": {"inventario.hada": 1}, "$push": {"hadas_referidos": numero_referido}}
+        )
+        if result.modified_count:
+            invalidar_usuario(referidor_id)
             await notificar_recompensa(bot, referidor_id, "Hada")
-        
-        # Recompensa por referidos activos (Elfo)
-        for referido in referidos:
-            if referido.get("activo", False) and not referido.get("recompensa_entregada", False):
-                await agregar_item_inventario(referidor_id, "elfo", 1)
-                await marcar_recompensa_entregada(referido["referido_id"])
-                await notificar_recompensa(bot, referidor_id, "Elfo")
-        
-        logger.info(f"✅ Recompensas verificadas para {referidor_id}")
+
+    # Recompensa por referidos activos (Elfo)
+    pendientes = await referidos_col.find(
+        {"referidor_id": referidor_id, "activo": True, "recompensa_entregada": False},
+        {"referido_id": 1}
+    ).to_list(length=None)
+
+    if pendientes:
+        nuevos = [p["referido_id"] for p in pendientes]
+        elfos = 0
+        while nuevos:
+            result = await usuarios_col.update_one(
+                {"user_id": referidor_id, "elfos_referidos": {"$nin": nuevos}},
+                {"$inc": {"inventario.elfo": len(nuevos)}, "$push": {"elfos_referidos": {"$each": nuevos}}}
+            )
+            if result.modified_count:
+                elfos = len(nuevos)
+                invalidar_usuario(referidor_id)
+                break
+            # Otra pasada (o una anterior que no llegó a marcarlos) ya entregó alguno
+            usuario = await usuarios_col.find_one({"user_id": referidor_id}, {"elfos_referidos": 1})
+            if usuario is None:
+                raise ValueError(f"Referidor {referidor_id} no encontrado")
+            entregados = set(usuario.get("elfos_referidos", []))
+            nuevos = [referido_id for referido_id in nuevos if referido_id not in entregados]
+
+        await referidos_col.update_many(
+            {"_id": {"$in": [p["_id"] for p in pendientes]}},
+            {"$set": {"recompensa_entregada": True}}
+        )
+        if elfos:
+            await notificar_recompensa(bot, referidor_id, "Elfo", elfos)
+
+    logger.info(f"✅ Recompensas verificadas para {referidor_id}")
+
+async def verificar_recompensas_referidos(bot, referidor_id: int, numero_referido: Optional[int] = None):
+    """Verifica y entrega recompensas por referidos (ver entregar_recompensas_referidos), registrando los errores"""
+    try:
+        await entregar_recompensas_referidos(bot, referidor_id, numero_referido)
     except Exception as e:
         logger.error(f"Error verificando recompensas para {referidor_id}: {e}")
 
@@ -300,13 +669,14 @@ async def procesar_nuevo_referido(bot, referidor_id: int, referido_id: int, refe
     """Procesa un nuevo referido completo"""
     try:
         # Agregar referido
-        if await agregar_referido(referidor_id, referido_id):
+        numero = await agregar_referido(referidor_id, referido_id)
+        if numero is not None:
             # Notificar al referidor
             await notificar_nuevo_referido(bot, referidor_id, referido_id, referido_name)
             # Notificar al referido
             await notificar_has_sido_referido(bot, referido_id, referidor_name)
             # Verificar recompensas
-            await verificar_recompensas_referidos(bot, referidor_id)
+            await verificar_recompensas_referidos(bot, referidor_id, numero)
             logger.info(f"✅ Nuevo referido procesado: {referidor_id} -> {referido_id}")
     except Exception as e:
         logger.error(f"Error procesando nuevo referido {referidor_id} -> {referido_id}: {e}")
@@ -329,24 +699,77 @@ async def usuario_tiene_nft_ghost(user_id: int):
         logger.error(f"Error verificando NFT Ghost para {user_id}: {e}")
         return False
 
+async def ejecutar_compra(user_id: int, item: str, precio: float, accion: str, details: dict = None, cantidad: int = 1) -> Tuple[bool, Optional[float]]:
+    """
+    Compra un item de forma atómica: verifica fondos, descuenta el balance y
+    agrega el item al inventario en una sola actualización condicional del
+    documento de usuario.
+
+    Con replica set el log y el contador global de NFTs se escriben en la
+    misma transacción; sin replica set el log se escribe en lote.
+
+    Args:
+        user_id: ID del usuario
+        item: Clave del item en el inventario
+        precio: Precio total a descontar
+        accion: Nombre de la acción para el log
+        details: Detalles adicionales para el log
+        cantidad: Cantidad de items a agregar
+
+    Returns:
+        Tupla (comprado, nuevo_balance). nuevo_balance es None si no se compró.
+    """
+    filtro_fondos = {"user_id": user_id, "balance": {"$gte": precio}}
+    descuento = {"$inc": {"balance": -precio, f"inventario.{item}": cantidad}}
+    log_data = _crear_log(user_id, accion, details=details)
+
+    if soporta_transacciones:
+        async def comprar(session) -> Optional[dict]:
+            usuario = await usuarios_col.find_one_and_update(
+                filtro_fondos, descuento,
+                projection={"balance": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+            if not usuario:
+                return None
+            await incrementar_contador_nfts(item, cantidad, session=session)
+            # Copia: si la transacción se reintenta, el _id del primer intento no se reutiliza
+            await logs_col.insert_one(dict(log_data), session=session)
+            return usuario
+
+        # with_transaction reintenta los conflictos (TransientTransactionError
+        # y UnknownTransactionCommitResult) que da la contención sobre el usuario
+        async with await client.start_session() as session:
+            usuario = await session.with_transaction(comprar)
+        invalidar_usuario(user_id)
+        if not usuario:
+            return False, None
+        return True, float(usuario["balance"])
+
+    usuario = await usuarios_col.find_one_and_update(
+        filtro_fondos, descuento,
+        projection={"balance": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    invalidar_usuario(user_id)
+    if not usuario:
+        return False, None
+
+    await incrementar_contador_nfts(item, cantidad)
+    await log_action(user_id, accion, details=details)
+    return True, float(usuario["balance"])
+
 async def comprar_nft(user_id: int, nft_tipo: str, precio: float):
     """Compra un NFT para un usuario"""
     try:
-        # Verificar balance
-        balance = await obtener_balance_usuario(user_id)
-        if balance < precio:
+        comprado, _ = await ejecutar_compra(user_id, nft_tipo, precio, "nft_comprado", details={
+            "nft": nft_tipo,
+            "precio": precio
+        })
+        if not comprado:
             return False, "Balance insuficiente"
         
-        # Descontar balance
-        if not await descontar_balance_usuario(user_id, precio):
-            return False, "Error al procesar el pago"
-        
-        # Agregar NFT al inventario
-        if not await agregar_item_inventario(user_id, nft_tipo, 1):
-            # Revertir descuento si falla
-            await agregar_balance_usuario(user_id, precio)
-            return False, "Error al agregar NFT"
-        
         return True, "NFT comprado exitosamente"
     except Exception as e:
         logger.error(f"Error comprando NFT {nft_tipo} para {user_id}: {e}")
@@ -365,19 +788,121 @@ async def obtener_nft_usuario(user_id: int):
         logger.error(f"Error obteniendo NFTs para {user_id}: {e}")
         return {"moguri": 0, "gargola": 0, "ghost": 0}
 
-async def obtener_nfts_activos():
-    """Obtiene todos los NFTs activos en el sistema"""
+async def incrementar_contador_nfts(item: str, cantidad: int, session=None) -> None:
+    """
+    Actualiza el contador global de un NFT rastreado (cantidad negativa para
+    retiradas). El incremento va a un slot aleatorio para repartir escrituras.
+    """
+    if item not in NFTS_RASTREADOS:
+        return
+    try:
+        slot = random.randrange(NFTS_CONTADOR_SLOTS)
+        await contadores_col.update_one(
+            {"_id": f"nfts:{slot}"},
+            {"$inc": {item: cantidad}},
+            upsert=True,
+            session=session
+        )
+    except Exception as e:
+        # La reconciliación periódica corrige la desviación
+        logger.error(f"Error actualizando contador global de {item}: {e}")
+
+async def _leer_contadores_nfts() -> Optional[Dict[str, int]]:
+    """Suma los slots de contadores de NFTs. None si aún no existen."""
+    slots = await contadores_col.find({"_id": {"$regex": "^nfts:"}}).to_list(length=None)
+    if not slots:
+        return None
+    return {nft: sum(slot.get(nft, 0) for slot in slots) for nft in NFTS_RASTREADOS}
+
+async def _tomar_bloqueo_nfts() -> Optional[ObjectId]:
+    """Toma el bloqueo de la reconciliación de NFTs; None si otro proceso lo tiene"""
+    ahora = datetime.datetime.now()
+    propietario = ObjectId()
+    try:
+        # Si el bloqueo está vigente el filtro no coincide y el upsert choca con su _id
+        await contadores_col.update_one(
+            {"_id": NFTS_BLOQUEO_ID, "hasta": {"$lte": ahora}},
+            {"$set": {
+                "hasta": ahora + datetime.timedelta(seconds=NFTS_BLOQUEO_DURACION),
+                "propietario": propietario
+            }},
+            upsert=True
+        )
+        return propietario
+    except DuplicateKeyError:
+        return None
+
+async def reconciliar_nfts_globales() -> Optional[Dict[str, int]]:
+    """
+    Recalcula los totales de NFTs desde los inventarios de los usuarios y corrige la desviación
+    de los contadores globales con un $inc sobre el slot 0.
+
+    La corrección solo es válida si los contadores no cambiaron mientras se
+    sumaban los inventarios: una compra entre las dos lecturas quedaría
+    anulada. Por eso se leen antes y después del total y solo se corrige si
+    coinciden (si no, se repite hasta NFTS_RECONCILIACION_INTENTOS veces y
+    después se deja para la siguiente pasada). Un item entregado sin
+    transacción justo entre su inventario y su contador aún puede dejar una
+    desviación, que corrige la siguiente pasada.
+
+    Un bloqueo en contadores_col impide que dos reconciliaciones (p. ej. la
+    periódica y la primera lectura de obtener_nfts_activos) apliquen la
+    misma corrección dos veces.
+
+    Returns:
+        Corrección aplicada a cada NFT, o None si no se corrigió (otra
+        reconciliación en curso o sin lectura estable)
+    """
+    propietario = await _tomar_bloqueo_nfts()
+    if propietario is None:
+        logger.info("Reconciliación de NFTs en curso en otro proceso")
+        return None
+
     try:
         pipeline = [
             {"$group": {
                 "_id": None,
-                "total_moguri": {"$sum": "$items.moguri"},
-                "total_gargola": {"$sum": "$items.gargola"},
-                "total_ghost": {"$sum": "$items.ghost"}
+                **{nft: {"$sum": f"$inventario.{nft}"} for nft in NFTS_RASTREADOS}
             }}
         ]
-        result = await inventarios_col.aggregate(pipeline).to_list(1)
-        return result[0] if result else {"total_moguri": 0, "total_gargola": 0, "total_ghost": 0}
+        for _ in range(NFTS_RECONCILIACION_INTENTOS):
+            antes = await _leer_contadores_nfts() or {}
+            result = await usuarios_col.aggregate(pipeline, allowDiskUse=True).to_list(1)
+            despues = await _leer_contadores_nfts() or {}
+            if antes == despues:
+                break
+        else:
+            logger.warning("⚠️ Contadores de NFTs en movimiento, reconciliación aplazada")
+            return None
+
+        reales = result[0] if result else {}
+        correccion = {
+            nft: reales.get(nft, 0) - despues.get(nft, 0)
+            for nft in NFTS_RASTREADOS
+        }
+        await contadores_col.update_one(
+            {"_id": "nfts:0"},
+            {"$inc": correccion},
+            upsert=True
+        )
+    finally:
+        # Solo se libera si sigue siendo nuestro (pudo vencer y tomarlo otro)
+        await contadores_col.delete_one({"_id": NFTS_BLOQUEO_ID, "propietario": propietario})
+
+    if any(correccion.values()):
+        logger.warning(f"⚠️ Contadores de NFTs corregidos: {correccion}")
+    return correccion
+
+async def obtener_nfts_activos():
+    """Obtiene todos los NFTs activos en el sistema (contadores globales)"""
+    try:
+        totales = await _leer_contadores_nfts()
+        if totales is None:
+            # Primera lectura: inicializar los contadores desde los inventarios
+            # (si ya lo está haciendo otro proceso, se devuelve lo que haya)
+            await reconciliar_nfts_globales()
+            totales = await _leer_contadores_nfts() or {}
+        return {f"total_{nft}": totales.get(nft, 0) for nft in NFTS_RASTREADOS}
     except Exception as e:
         logger.error(f"Error obteniendo NFTs activos: {e}")
         return {"total_moguri": 0, "total_gargola": 0, "total_ghost": 0}
@@ -399,32 +924,18 @@ async def procesar_compra_item(user_id: int, item: dict) -> dict:
         nombre = item.get("nombre", "Item")
         tipo = item.get("tipo", "criatura")
         
-        # Verificar balance
-        balance = await obtener_balance_usuario(user_id)
-        if balance < precio:
-            return {"success": False, "message": "Balance insuficiente"}
-        
-        # Descontar balance
-        if not await descontar_balance_usuario(user_id, precio):
-            return {"success": False, "message": "Error al procesar el pago"}
-        
-        # Agregar item al inventario
-        if not await agregar_item_inventario(user_id, nombre.lower(), 1):
-            # Revertir descuento si falla
-            await agregar_balance_usuario(user_id, precio)
-            return {"success": False, "message": "Error al agregar item"}
-        
-        # Log de la compra
-        await log_action(user_id, "item_comprado", details={
+        comprado, balance_restante = await ejecutar_compra(user_id, nombre.lower(), precio, "item_comprado", details={
             "item": nombre,
             "tipo": tipo,
             "precio": precio
         })
+        if not comprado:
+            return {"success": False, "message": "Balance insuficiente"}
         
         return {
             "success": True,
             "message": f"{nombre} comprado exitosamente",
-            "balance_restante": balance - precio
+            "balance_restante": balance_restante
         }
     except Exception as e:
         logger.error(f"Error procesando compra de {item.get('nombre', 'item')} para {user_id}: {e}")
@@ -492,7 +1003,7 @@ async def solicitar_retiro(user_id: int, cantidad: float, wallet_address: str):
 
 
 
-async def es_elegible_paquete_bienvenida(user_id: int):
+async def es_elegible_paquete_bienvenida(user_id: int, usuario: dict = None):
     """Verifica si un usuario es elegible para el paquete de bienvenida"""
     try:
         # Verificar si ya lo compró
@@ -504,7 +1015,8 @@ async def es_elegible_paquete_bienvenida(user_id: int):
             return False
         
         # Verificar fecha de registro (primeros 7 días)
-        usuario = await usuarios_col.find_one({"user_id": user_id})
+        if usuario is None:
+            usuario = await obtener_usuario(user_id)
         if not usuario:
             return False
         
@@ -613,24 +1125,113 @@ async def notificar_credito_agregado(bot, user_id: int, cantidad: float, razon:
             f"Razón: {razon}\n\n"
             "¡Tu balance ha sido actualizado!"
         )
-        await bot.send_message(user_id, mensaje)
-        logger.info(f"✅ Notificación de crédito enviada a {user_id}")
+        cola_envios.encolar(bot, user_id, mensaje)
+        logger.info(f"✅ Notificación de crédito encolada para {user_id}")
     except Exception as e:
-        logger.error(f"Error enviando notificación de crédito a {user_id}: {e}")
+        logger.error(f"Error encolando notificación de crédito para {user_id}: {e}")
+
+
+
+def _crear_log(actor_id: int, action: str, target_id: int = None, details: dict = None) -> dict:
+    """Crea el documento de log de una acción"""
+    return {
+        "actor_id": actor_id,
+        "action": action,
+        "target_id": target_id,
+        "details": details or {},
+        "fecha": datetime.datetime.now()
+    }
+
+class EscritorLogs:
+    """
+    Escribe los logs de acciones en lotes con insert_many(ordered=False).
+
+    Un lote se escribe al llegar a `max_lote` documentos o a los `intervalo`
+    segundos del primer documento pendiente. La cola está acotada a
+    `max_pendientes`: si se llena, `registrar` espera (contrapresión).
+    Al detener se escriben todos los pendientes.
+    """
+
+    def __init__(self, max_lote: int, intervalo: float, max_pendientes: int):
+        self.max_lote = max_lote
+        self.intervalo = intervalo
+        self.max_pendientes = max_pendientes
+        self.activo = False
+        self._cola: Optional[asyncio.Queue] = None
+        self._lote: List[dict] = []
+        self._escritura: Optional[asyncio.Future] = None
+
+    def iniciar(self) -> None:
+        """Inicia la escritura en segundo plano"""
+        self._cola = asyncio.Queue(maxsize=self.max_pendientes)
+        self.activo = True
+        iniciar_tarea("escritor_logs", self._ejecutar())
+        al_detener(self.detener)
+
+    async def registrar(self, log_data: dict) -> None:
+        """Encola un log. Si el escritor no está activo lo inserta directamente."""
+        if not self.activo:
+            await logs_col.insert_one(log_data)
+            return
+        await self._cola.put(log_data)
 
+    async def _ejecutar(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._lote.append(await self._cola.get())
+            limite = loop.time() + self.intervalo
+            while len(self._lote) < self.max_lote:
+                if not self._cola.empty():
+                    self._lote.append(self._cola.get_nowait())
+                    continue
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                # asyncio.wait (a diferencia de wait_for) nunca oculta una cancelación
+                siguiente = asyncio.ensure_future(self._cola.get())
+                try:
+                    await asyncio.wait({siguiente}, timeout=restante)
+                finally:
+                    if not siguiente.done():
+                        siguiente.cancel()
+                if siguiente.done() and not siguiente.cancelled():
+                    self._lote.append(siguiente.result())
 
+            lote, self._lote = self._lote, []
+            # La escritura no se cancela a medias al detener
+            self._escritura = asyncio.ensure_future(self._escribir(lote))
+            await asyncio.shield(self._escritura)
+
+    async def _escribir(self, lote: List[dict]) -> None:
+        try:
+            await logs_col.insert_many(lote, ordered=False)
+        except Exception as e:
+            logger.error(f"Error escribiendo lote de {len(lote)} logs: {e}")
+
+    async def detener(self) -> None:
+        """Escribe todos los logs pendientes. Los siguientes se insertan directamente."""
+        if not self.activo:
+            return
+        self.activo = False
+
+        if self._escritura and not self._escritura.done():
+            await self._escritura
+
+        pendientes, self._lote = self._lote, []
+        while not self._cola.empty():
+            pendientes.append(self._cola.get_nowait())
+
+        for inicio in range(0, len(pendientes), self.max_lote):
+            await self._escribir(pendientes[inicio:inicio + self.max_lote])
+        if pendientes:
+            logger.info(f"✅ {len(pendientes)} logs pendientes escritos al detener")
+
+escritor_logs = EscritorLogs(LOGS_LOTE_MAX, LOGS_INTERVALO_ESCRITURA, LOGS_MAX_PENDIENTES)
 
 async def log_action(actor_id: int, action: str, target_id: int = None, details: dict = None):
-    """Registra una acción en el sistema"""
+    """Registra una acción en el sistema (se escribe en lote en segundo plano)"""
     try:
-        log_data = {
-            "actor_id": actor_id,
-            "action": action,
-            "target_id": target_id,
-            "details": details or {},
-            "fecha": datetime.datetime.now()
-        }
-        await logs_col.insert_one(log_data)
+        await escritor_logs.registrar(_crear_log(actor_id, action, target_id, details))
     except Exception as e:
         logger.error(f"Error registrando acción {action} para {actor_id}: {e}")
 
@@ -657,30 +1258,93 @@ async def set_last_promo_time(user_id: int, dt: datetime.datetime):
     except Exception as e:
         logger.error(f"Error estableciendo última promo para {user_id}: {e}")
 
-async def obtener_estadisticas_generales():
-    """Obtiene estadísticas generales del sistema"""
-    try:
-        total_usuarios = await contar_usuarios()
-        total_depositos = await contar_depositos()
-        total_retiros = await contar_retiros()
-        
-        # Calcular volumen total
-        pipeline = [
-            {"$match": {"estado": "procesado"}},
-            {"$group": {
-                "_id": None,
-                "volumen_total": {"$sum": "$cantidad_real"}
+class ServicioEstadisticas:
+    """
+    Mantiene en memoria una instantánea de las estadísticas generales.
+
+    Un refresco en segundo plano calcula todas las métricas en una sola pasada
+    concurrente cada `intervalo` segundos (opcionalmente contra un secundario).
+    Los lectores reciben la última instantánea con su antigüedad, sin consultar
+    las colecciones.
+    """
+
+    def __init__(self, intervalo: float, dias_activos: int, leer_secundario: bool):
+        self.intervalo = intervalo
+        self.dias_activos = dias_activos
+        self.read_preference = ReadPreference.SECONDARY_PREFERRED if leer_secundario else ReadPreference.PRIMARY
+        self._instantanea: Optional[Dict[str, Any]] = None
+        self._actualizada_en: Optional[datetime.datetime] = None
+        self._duracion: float = 0.0
+
+    def iniciar(self) -> None:
+        """Inicia el refresco periódico en segundo plano"""
+        iniciar_tarea_periodica("estadisticas", self.actualizar, self.intervalo)
+
+    async def actualizar(self) -> None:
+        """Recalcula todas las estadísticas en una pasada concurrente"""
+        inicio = time.monotonic()
+        usuarios = usuarios_col.with_options(read_preference=self.read_preference)
+        depositos = depositos_col.with_options(read_preference=self.read_preference)
+        creditos = creditos_col.with_options(read_preference=self.read_preference)
+        fecha_limite = datetime.datetime.now() - datetime.timedelta(days=self.dias_activos)
+
+        # Total y volumen de depósitos en una sola agregación
+        pipeline_depositos = [
+            {"$facet": {
+                "total": [{"$count": "n"}],
+                "volumen": [
+                    {"$match": {"estado": "procesado"}},
+                    {"$group": {"_id": None, "volumen_total": {"$sum": "$cantidad_real"}}}
+                ]
             }}
         ]
-        result = await depositos_col.aggregate(pipeline).to_list(1)
-        volumen_total = result[0]["volumen_total"] if result else 0
-        
-        return {
+
+        total_usuarios, facet, total_retiros, usuarios_activos = await asyncio.gather(
+            usuarios.estimated_document_count(),
+            depositos.aggregate(pipeline_depositos).to_list(1),
+            creditos.count_documents({"tipo": "retiro"}),
+            usuarios.count_documents({"ultima_actividad": {"$gte": fecha_limite}})
+        )
+
+        facet = facet[0] if facet else {}
+        total = facet.get("total") or [{}]
+        volumen = facet.get("volumen") or [{}]
+        self._instantanea = {
             "total_usuarios": total_usuarios,
-            "total_depositos": total_depositos,
+            "total_depositos": total[0].get("n", 0),
             "total_retiros": total_retiros,
-            "volumen_total": volumen_total
+            "volumen_total": volumen[0].get("volumen_total", 0),
+            "usuarios_activos": usuarios_activos
+        }
+        self._actualizada_en = datetime.datetime.now()
+        self._duracion = time.monotonic() - inicio
+
+    def obtener(self) -> Optional[Dict[str, Any]]:
+        """Devuelve la última instantánea con su antigüedad, o None si aún no hay"""
+        if self._instantanea is None:
+            return None
+        return {
+            **self._instantanea,
+            "actualizado_en": self._actualizada_en,
+            "antiguedad_segundos": (datetime.datetime.now() - self._actualizada_en).total_seconds(),
+            "duracion_calculo": self._duracion
         }
+
+servicio_estadisticas = ServicioEstadisticas(
+    ESTADISTICAS_INTERVALO,
+    ESTADISTICAS_DIAS_ACTIVOS,
+    ESTADISTICAS_LEER_SECUNDARIO
+)
+
+async def obtener_estadisticas_generales():
+    """Obtiene estadísticas generales del sistema (instantánea en memoria)"""
+    try:
+        estadisticas = servicio_estadisticas.obtener()
+        if estadisticas is None:
+            # El refresco en segundo plano aún no ha terminado su primera pasada
+            await servicio_estadisticas.actualizar()
+            estadisticas = servicio_estadisticas.obtener()
+        return estadisticas
     except Exception as e:
         logger.error(f"Error obteniendo estadísticas generales: {e}")
         return {
@@ -693,6 +1357,10 @@ async def obtener_estadisticas_generales():
 async def obtener_usuarios_activos(dias: int = 7):
     """Obtiene el número de usuarios activos en los últimos días"""
     try:
+        estadisticas = servicio_estadisticas.obtener()
+        if estadisticas is not None and dias == servicio_estadisticas.dias_activos:
+            return estadisticas["usuarios_activos"]
+
         fecha_limite = datetime.datetime.now() - datetime.timedelta(days=dias)
         return await usuarios_col.count_documents({
             "ultima_actividad": {"$gte": fecha_limite}
@@ -0,0 +1,422 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    EditMessageCaption,
+    EditMessageMedia,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    SendAnimation,
+    SendDocument,
+    SendMessage,
+    SendPhoto,
+    SendVideo
+)
+from utils.logging_config import get_logger
+from utils.segundo_plano import al_detener, ORDEN_SALIDA
+from config.config import (
+    ENVIOS_POR_SEGUNDO,
+    ENVIOS_RAFAGA,
+    ENVIOS_PROCESOS,
+    ENVIOS_INTERVALO_CHAT,
+    ENVIOS_REINTENTOS,
+    ENVIOS_MAX_PENDIENTES,
+    ENVIOS_ESPERA_CIERRE
+)
+
+logger = get_logger(__name__)
+
+# Clases de prioridad (menor = sale antes). Las respuestas de los handlers
+# (PRIORIDAD_INTERACTIVA) no se encolan: esperan su turno con turno()
+PRIORIDAD_INTERACTIVA = 0
+PRIORIDAD_NOTIFICACION = 1
+PRIORIDAD_DIFUSION = 2
+
+# Métodos de la Bot API que cuentan para el límite de mensajes
+METODOS_LIMITADOS = (
+    SendMessage, SendPhoto, SendAnimation, SendDocument, SendVideo,
+    EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup
+)
+
+# Activo en las tareas de envío de la cola: sus peticiones no piden turno
+_envio_de_cola: ContextVar[bool] = ContextVar("envio_de_cola", default=False)
+
+class _Envio:
+    """Un mensaje pendiente y el futuro que recibe el resultado"""
+    __slots__ = ("bot", "chat_id", "texto", "kwargs", "futuro", "intentos")
+
+    def __init__(self, bot: Bot, chat_id: int, texto: str, kwargs: Dict[str, Any], futuro: asyncio.Future):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.texto = texto
+        self.kwargs = kwargs
+        self.futuro = futuro
+        self.intentos = 0
+
+class CuboTokens:
+    """Token bucket: `tasa` tokens por segundo con hasta `capacidad` acumulados"""
+
+    def __init__(self, tasa: float, capacidad: float):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self._ultimo = time.monotonic()
+
+    def espera(self) -> float:
+        """Segundos hasta que haya un token (0 si ya lo hay)"""
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.tasa
+
+    def consumir(self) -> None:
+        self.tokens -= 1
+
+class ColaEnvios:
+    """
+    Cola de mensajes salientes a Telegram.
+
+    Los mensajes se encolan y el llamador sigue sin esperar a Telegram (puede
+    esperar el futuro devuelto si necesita el resultado). Un único bucle los
+    envía respetando:
+
+    - un token bucket de `por_segundo` mensajes (con ráfaga `rafaga`) en este
+      proceso; con varios procesos cada uno recibe su parte (ENVIOS_PROCESOS);
+    - un intervalo mínimo entre mensajes al mismo chat (`intervalo_chat`);
+    - `retry_after` de Telegram: un 429 pausa todos los envíos ese tiempo y
+      el mensaje se reintenta (hasta `reintentos` veces);
+    - prioridades: entre los chats listos siempre sale primero la clase de
+      prioridad menor, y antes que todas las respuestas de los handlers
+      (PRIORIDAD_INTERACTIVA), que el LimitadorEnvios hace pasar por turno().
+
+    Cada (chat, prioridad) es un carril FIFO. Cada chat tiene como mucho un
+    envío en vuelo: el siguiente mensaje del chat no sale hasta que termina
+    el anterior (y un 429 lo devuelve al principio de su carril), así los
+    mensajes de un chat con la misma prioridad llegan en orden.
+    """
+
+    def __init__(self, por_segundo: float, rafaga: float, intervalo_chat: float,
+                 reintentos: int, max_pendientes: int, espera_cierre: float):
+        self.cubo = CuboTokens(por_segundo, rafaga)
+        self.intervalo_chat = intervalo_chat
+        self.reintentos = reintentos
+        self.max_pendientes = max_pendientes
+        self.espera_cierre = espera_cierre
+        self.enviados = 0
+        self.fallidos = 0
+        self.pausas_429 = 0
+        self._carriles: Dict[Tuple[int, int], Deque[_Envio]] = {}
+        # Carriles con trabajo: en espera por el ritmo del chat y listos por prioridad
+        self._esperando: List[Tuple[float, int, Tuple[int, int]]] = []
+        self._listos: List[Tuple[int, int, Tuple[int, int]]] = []
+        self._programados: Set[Tuple[int, int]] = set()
+        # Chats con un envío en vuelo y sus carriles a la espera de que termine
+        self._ocupados: Set[int] = set()
+        self._aparcados: Dict[int, Set[Tuple[int, int]]] = {}
+        # Respuestas interactivas esperando su turno
+        self._turnos: Deque[asyncio.Future] = deque()
+        self._proximo_chat: Dict[int, float] = {}
+        self._secuencia = itertools.count()
+        self._pausa_hasta = 0.0
+        self._pendientes = 0
+        self._en_vuelo: Set[asyncio.Task] = set()
+        self._bucle: Optional[asyncio.Task] = None
+        self._cambio = asyncio.Event()
+        self._vacio = asyncio.Event()
+        self._vacio.set()
+        self.activo = False
+        self.detenida = False
+
+    @property
+    def pendientes(self) -> int:
+        return self._pendientes
+
+    def iniciar(self) -> None:
+        """
+        Inicia el bucle de envío (se llama solo al encolar el primer mensaje).
+
+        No es una tarea de iniciar_tarea, que detener_tareas cancela antes de
+        los cierres: la cola se detiene en el último cierre (ORDEN_SALIDA),
+        cuando el despachador y el webhook ya procesaron sus updates y los
+        handlers no van a pedir más turnos.
+        """
+        self.activo = True
+        self._bucle = asyncio.create_task(self.ejecutar(), name="envios")
+        # Si el bucle termina por lo que sea, nadie se queda esperando turno
+        self._bucle.add_done_callback(lambda _: self._liberar_turnos())
+        al_detener(self.detener, ORDEN_SALIDA)
+
+    def encolar(self, bot: Bot, chat_id: int, texto: str,
+                prioridad: int = PRIORIDAD_NOTIFICACION, **kwargs) -> asyncio.Future:
+        """
+        Encola un send_message y devuelve un futuro con el Message enviado.
+
+        Si la cola está llena el futuro falla con asyncio.QueueFull y, si ya
+        se detuvo, con RuntimeError. Los errores de envío quedan registrados
+        en el log, así que no hace falta esperar el futuro.
+        """
+        futuro = asyncio.get_running_loop().create_future()
+        # Marca la excepción como leída: el error ya se registra aquí
+        futuro.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if self.detenida:
+            logger.warning(f"⚠️ Cola de envíos detenida, mensaje a {chat_id} descartado")
+            futuro.set_exception(RuntimeError("La cola de envíos está detenida"))
+            return futuro
+        if self._pendientes >= self.max_pendientes:
+            logger.warning(f"⚠️ Cola de envíos llena, mensaje a {chat_id} descartado")
+            futuro.set_exception(asyncio.QueueFull())
+            return futuro
+        if not self.activo:
+            self.iniciar()
+
+        self._pendientes += 1
+        self._vacio.clear()
+        clave = (chat_id, prioridad)
+        self._carriles.setdefault(clave, deque()).append(_Envio(bot, chat_id, texto, kwargs, futuro))
+        if chat_id in self._ocupados:
+            self._aparcados.setdefault(chat_id, set()).add(clave)
+        else:
+            self._programar(clave, self._proximo_chat.get(chat_id, 0.0))
+        return futuro
+
+    async def turno(self) -> None:
+        """
+        Espera el turno de una respuesta interactiva (PRIORIDAD_INTERACTIVA).
+
+        Gasta un token del mismo cubo que los mensajes encolados, sale antes
+        que cualquiera de ellos y respeta la pausa de un 429. No aplica el
+        intervalo por chat: responde a una acción del propio usuario. Sin el
+        bucle en marcha (cola detenida) la respuesta pasa sin esperar.
+        """
+        if self.detenida:
+            return
+        if not self.activo:
+            self.iniciar()
+        if self._bucle.done():
+            return
+        futuro = asyncio.get_running_loop().create_future()
+        self._turnos.append(futuro)
+        self._cambio.set()
+        await futuro
+
+    def _liberar_turnos(self) -> None:
+        """Deja pasar a todas las respuestas que esperan turno"""
+        while self._turnos:
+            turno = self._turnos.popleft()
+            if not turno.done():
+                turno.set_result(None)
+
+    def pausar(self, segundos: float) -> None:
+        """Pausa todos los envíos tras un 429 de Telegram"""
+        self.pausas_429 += 1
+        self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+        logger.warning(f"⚠️ Límite de Telegram alcanzado, envíos en pausa {segundos}s")
+
+    def _programar(self, clave: Tuple[int, int], listo_en: float) -> None:
+        # Un carril está como mucho una vez en los montículos
+        if clave in self._programados:
+            return
+        self._programados.add(clave)
+        if listo_en <= time.monotonic():
+            heapq.heappush(self._listos, (clave[1], next(self._secuencia), clave))
+        else:
+            heapq.heappush(self._esperando, (listo_en, next(self._secuencia), clave))
+        self._cambio.set()
+
+    async def _esperar_cambio(self, timeout: Optional[float]) -> None:
+        # asyncio.wait (a diferencia de wait_for) nunca oculta una cancelación
+        cambio = asyncio.ensure_future(self._cambio.wait())
+        try:
+            await asyncio.wait({cambio}, timeout=timeout)
+        finally:
+            if not cambio.done():
+                cambio.cancel()
+
+    async def ejecutar(self) -> None:
+        """Bucle de envío"""
+        while True:
+            self._cambio.clear()
+            ahora = time.monotonic()
+            while self._esperando and self._esperando[0][0] <= ahora:
+                _, secuencia, clave = heapq.heappop(self._esperando)
+                heapq.heappush(self._listos, (clave[1], secuencia, clave))
+
+            if not self._listos and not self._turnos:
+                espera = self._esperando[0][0] - ahora if self._esperando else None
+                await self._esperar_cambio(espera)
+                continue
+
+            espera = max(self._pausa_hasta - ahora, self.cubo.espera())
+            if espera > 0:
+                # Se vuelve a elegir después: puede llegar algo más prioritario
+                await self._esperar_cambio(espera)
+                continue
+
+            if self._turnos:
+                turno = self._turnos.popleft()
+                # Si el handler se canceló mientras esperaba no gasta token
+                if not turno.done():
+                    self.cubo.consumir()
+                    turno.set_result(None)
+                continue
+
+            _, _, clave = heapq.heappop(self._listos)
+            self._programados.discard(clave)
+            chat_id = clave[0]
+            if chat_id in self._ocupados:
+                # Sale cuando termine el envío en vuelo del chat (otra prioridad)
+                self._aparcados.setdefault(chat_id, set()).add(clave)
+                continue
+            # Otro carril del mismo chat (otra prioridad) pudo enviar mientras tanto
+            proximo = self._proximo_chat.get(chat_id, 0.0)
+            if proximo > ahora:
+                self._programar(clave, proximo)
+                continue
+
+            envio = self._carriles[clave].popleft()
+            # Un futuro cancelado (p. ej. difusión cancelada) se descarta sin gastar turno
+            if envio.futuro.cancelled():
+                self._terminar(envio)
+                self._liberar_carril(clave)
+                continue
+
+            self.cubo.consumir()
+            self._proximo_chat[chat_id] = ahora + self.intervalo_chat
+            self._ocupados.add(chat_id)
+            tarea = asyncio.create_task(self._enviar(clave, envio))
+            self._en_vuelo.add(tarea)
+            tarea.add_done_callback(self._en_vuelo.discard)
+
+            if len(self._proximo_chat) > 10000:
+                self._proximo_chat = {
+                    c: t for c, t in self._proximo_chat.items()
+                    if t > ahora or c in self._ocupados
+                }
+
+    def _liberar_carril(self, clave: Tuple[int, int]) -> None:
+        """Vuelve a programar el carril si le quedan mensajes o lo elimina"""
+        if self._carriles.get(clave):
+            self._programar(clave, self._proximo_chat.get(clave[0], 0.0))
+        else:
+            self._carriles.pop(clave, None)
+
+    def _liberar_chat(self, clave: Tuple[int, int]) -> None:
+        """Terminó el envío en vuelo del chat: sus carriles pueden volver a salir"""
+        chat_id = clave[0]
+        self._ocupados.discard(chat_id)
+        for carril in self._aparcados.pop(chat_id, set()) | {clave}:
+            self._liberar_carril(carril)
+
+    async def _enviar(self, clave: Tuple[int, int], envio: _Envio) -> None:
+        # Esta tarea ya tiene su turno: el LimitadorEnvios la deja pasar
+        _envio_de_cola.set(True)
+        try:
+            mensaje = await envio.bot.send_message(envio.chat_id, envio.texto, **envio.kwargs)
+        except TelegramRetryAfter as e:
+            envio.intentos += 1
+            self.pausar(e.retry_after)
+            if envio.intentos <= self.reintentos:
+                # Vuelve al principio de su carril: nada del chat salió mientras tanto
+                self._carriles.setdefault(clave, deque()).appendleft(envio)
+                return
+            self._terminar(envio, excepcion=e)
+        except asyncio.CancelledError:
+            envio.futuro.cancel()
+            raise
+        except Exception as e:
+            self._terminar(envio, excepcion=e)
+        else:
+            self._terminar(envio, resultado=mensaje)
+        finally:
+            self._liberar_chat(clave)
+
+    def _terminar(self, envio: _Envio, resultado: Any = None, excepcion: Optional[BaseException] = None) -> None:
+        self._pendientes -= 1
+        if self._pendientes == 0:
+            self._vacio.set()
+        if envio.futuro.done():
+            return
+        if excepcion is None:
+            self.enviados += 1
+            envio.futuro.set_result(resultado)
+        else:
+            self.fallidos += 1
+            logger.warning(f"No se pudo enviar mensaje a {envio.chat_id}: {excepcion}")
+            envio.futuro.set_exception(excepcion)
+
+    async def detener(self) -> None:
+        """
+        Espera hasta `espera_cierre` segundos a que salgan los pendientes y
+        cancela el resto. Después la cola rechaza los mensajes nuevos.
+        """
+        self.detenida = True
+        self._liberar_turnos()
+        if self._pendientes and self._bucle is not None and not self._bucle.done():
+            vaciado = asyncio.ensure_future(self._vacio.wait())
+            await asyncio.wait({vaciado}, timeout=self.espera_cierre)
+            if not vaciado.done():
+                vaciado.cancel()
+                logger.warning(f"⚠️ {self._pendientes} mensajes sin enviar al detener")
+        if self._bucle is not None:
+            self._bucle.cancel()
+            await asyncio.gather(self._bucle, return_exceptions=True)
+            self._bucle = None
+
+        for tarea in list(self._en_vuelo):
+            tarea.cancel()
+        await asyncio.gather(*self._en_vuelo, return_exceptions=True)
+        for carril in self._carriles.values():
+            for envio in carril:
+                if not envio.futuro.done():
+                    envio.futuro.cancel()
+        self._carriles.clear()
+        self._esperando.clear()
+        self._listos.clear()
+        self._programados.clear()
+        self._ocupados.clear()
+        self._aparcados.clear()
+        self._pendientes = 0
+        self.activo = False
+        logger.info(f"🛑 Cola de envíos detenida ({self.enviados} enviados, {self.fallidos} fallidos, {self.pausas_429} pausas 429)")
+
+class LimitadorEnvios(BaseRequestMiddleware):
+    """
+    Middleware de la sesión del bot: las respuestas de los handlers
+    (message.answer, edit_text...) esperan su turno en la cola de envíos con
+    PRIORIDAD_INTERACTIVA y se reintentan tras un 429.
+    """
+
+    def __init__(self, cola: ColaEnvios):
+        self.cola = cola
+
+    async def __call__(self, make_request, bot: Bot, method):
+        if _envio_de_cola.get() or not isinstance(method, METODOS_LIMITADOS):
+            return await make_request(bot, method)
+        intentos = 0
+        while True:
+            await self.cola.turno()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.cola.pausar(e.retry_after)
+                intentos += 1
+                if intentos > self.cola.reintentos:
+                    raise
+
+# El cubo es local al proceso: el límite del bot se reparte entre los procesos
+# (la ráfaga nunca baja de 1 o el cubo no llegaría a tener un token)
+cola_envios = ColaEnvios(
+    ENVIOS_POR_SEGUNDO / ENVIOS_PROCESOS,
+    max(ENVIOS_RAFAGA / ENVIOS_PROCESOS, 1),
+    ENVIOS_INTERVALO_CHAT,
+    ENVIOS_REINTENTOS,
+    ENVIOS_MAX_PENDIENTES,
+    ENVIOS_ESPERA_CIERRE
+)
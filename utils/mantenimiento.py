@@ -0,0 +1,75 @@
+"""
+Comandos de mantenimiento de la base de datos del proyecto Mundo Mítico
+
+Uso:
+    python utils/mantenimiento.py <comando> [--lote N]
+
+Comandos:
+    reparar_referidos   Reconstruye los contadores de referidos de los usuarios
+    reconciliar_nfts    Corrige los contadores globales de NFTs desde los inventarios
+    migrar_inventarios  Fusiona la colección inventarios en usuarios.inventario
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+
+# Agregar el directorio raíz al path para importaciones
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.logging_config import get_logger
+from utils.database import (
+    init_db,
+    migrar_inventarios as migrar_inventarios_db,
+    reconstruir_contadores_referidos,
+    reconciliar_nfts_globales
+)
+
+logger = get_logger(__name__)
+
+async def reparar_referidos(lote: int) -> None:
+    """Reconstruye referidos_total y referidos_activos desde la colección de referidos"""
+    actualizados = await reconstruir_contadores_referidos(lote)
+    logger.info(f"📊 Referidores actualizados: {actualizados}")
+
+async def reconciliar_nfts(lote: int) -> None:
+    """Corrige la desviación de los contadores globales de NFTs"""
+    correccion = await reconciliar_nfts_globales()
+    if correccion is None:
+        logger.warning("⚠️ No se aplicó ninguna corrección (otra reconciliación en curso o contadores en movimiento)")
+    else:
+        logger.info(f"📊 Corrección aplicada a los contadores de NFTs: {correccion}")
+
+async def migrar_inventarios(lote: int) -> None:
+    """Fusiona los inventarios antiguos y recalcula los contadores de NFTs"""
+    resultado = await migrar_inventarios_db(lote)
+    logger.info(f"📊 Inventarios: {resultado}")
+    await reconciliar_nfts(lote)
+
+COMANDOS = {
+    "reparar_referidos": reparar_referidos,
+    "reconciliar_nfts": reconciliar_nfts,
+    "migrar_inventarios": migrar_inventarios,
+}
+
+async def ejecutar(comando: str, lote: int) -> None:
+    """Inicializa la base de datos y ejecuta el comando indicado"""
+    await init_db()
+    await COMANDOS[comando](lote)
+
+def main():
+    """Función principal para ejecutar los comandos de mantenimiento"""
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base de datos de Mundo Mítico")
+    parser.add_argument("comando", choices=sorted(COMANDOS))
+    parser.add_argument("--lote", type=int, default=1000, help="Tamaño de lote para lecturas y escrituras")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(ejecutar(args.comando, args.lote))
+    except Exception as e:
+        logger.error(f"❌ Error ejecutando {args.comando}: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Muestreo de recompensas por el método alias de Walker para el bot Mundo Mítico
+
+numpy es opcional (requirements-dev.txt): solo vectoriza los sorteos por
+lotes del simulador; el bot sortea sin él.
+"""
+
+import random
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy es opcional: solo acelera los lotes grandes
+    np = None
+
+# Suma que deben tener las probabilidades de una tabla de recompensas
+TOTAL_PROBABILIDADES = 100
+
+class MuestreadorAlias:
+    """
+    Sorteo de una tabla de recompensas en O(1) por extracción.
+
+    La tabla ({clave: {"probabilidad": p, ...}}) se valida y se compila una
+    vez. Cada extracción usa un número aleatorio para elegir columna y otro
+    para decidir entre la entrada de la columna y su alias. El generador se
+    puede sembrar para reproducir resultados.
+    """
+
+    def __init__(self, tabla: Dict[str, Dict[str, Any]], semilla: Optional[int] = None):
+        self.claves = list(tabla)
+        self.entradas = [tabla[clave] for clave in self.claves]
+        pesos = self._validar(tabla)
+
+        n = len(pesos)
+        # Probabilidades escaladas: la media de cada columna es 1
+        escaladas = [peso * n / TOTAL_PROBABILIDADES for peso in pesos]
+        self.umbral = [1.0] * n
+        self.alias = list(range(n))
+
+        pequenas = [i for i, valor in enumerate(escaladas) if valor < 1.0]
+        grandes = [i for i, valor in enumerate(escaladas) if valor >= 1.0]
+        while pequenas and grandes:
+            menor = pequenas.pop()
+            mayor = grandes.pop()
+            self.umbral[menor] = escaladas[menor]
+            self.alias[menor] = mayor
+            escaladas[mayor] -= 1.0 - escaladas[menor]
+            (pequenas if escaladas[mayor] < 1.0 else grandes).append(mayor)
+        # Las columnas restantes quedan llenas (umbral 1.0) salvo error de redondeo
+
+        self.rng = random.Random(semilla)
+        self._np_rng = np.random.default_rng(semilla) if np is not None else None
+        if np is not None:
+            self._np_umbral = np.array(self.umbral)
+            self._np_alias = np.array(self.alias)
+
+    @staticmethod
+    def _validar(tabla: Dict[str, Dict[str, Any]]) -> List[float]:
+        """Comprueba que la tabla no esté vacía y que sus probabilidades sumen 100"""
+        if not tabla:
+            raise ValueError("La tabla de recompensas está vacía")
+
+        pesos = []
+        for clave, config in tabla.items():
+            probabilidad = config.get("probabilidad")
+            if not isinstance(probabilidad, (int, float)) or probabilidad < 0:
+                raise ValueError(f"Probabilidad inválida para '{clave}': {probabilidad!r}")
+            pesos.append(float(probabilidad))
+
+        total = sum(pesos)
+        if abs(total - TOTAL_PROBABILIDADES) > 1e-9:
+            raise ValueError(f"Las probabilidades suman {total}, deben sumar {TOTAL_PROBABILIDADES}")
+        return pesos
+
+    def indice(self) -> int:
+        """Sortea el índice de una entrada"""
+        columna = self.rng.randrange(len(self.umbral))
+        return columna if self.rng.random() < self.umbral[columna] else self.alias[columna]
+
+    def muestrear(self) -> Dict[str, Any]:
+        """Sortea una recompensa de la tabla"""
+        return self.entradas[self.indice()]
+
+    def _indices_np(self, n: int):
+        """Sortea `n` índices como array de numpy"""
+        columnas = self._np_rng.integers(0, len(self.umbral), size=n)
+        aceptadas = self._np_rng.random(n) < self._np_umbral[columnas]
+        return np.where(aceptadas, columnas, self._np_alias[columnas])
+
+    def indices(self, n: int) -> List[int]:
+        """Sortea `n` índices (vectorizado con numpy si está disponible)"""
+        if n <= 0:
+            return []
+        if self._np_rng is None:
+            return [self.indice() for _ in range(n)]
+        return self._indices_np(n).tolist()
+
+    def muestrear_lote(self, n: int) -> List[Dict[str, Any]]:
+        """Sortea `n` recompensas"""
+        return [self.entradas[i] for i in self.indices(n)]
+
+    def conteos(self, n: int) -> Dict[str, int]:
+        """Sortea `n` recompensas y devuelve cuántas veces salió cada clave"""
+        if n > 0 and self._np_rng is not None:
+            totales = np.bincount(self._indices_np(n), minlength=len(self.claves))
+            return {clave: int(total) for clave, total in zip(self.claves, totales)}
+
+        resultado = dict.fromkeys(self.claves, 0)
+        for i in self.indices(n):
+            resultado[self.claves[i]] += 1
+        return resultado
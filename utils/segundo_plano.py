@@ -0,0 +1,92 @@
+"""
+Gestión de tareas en segundo plano para el bot Mundo Mítico
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Coroutine, Dict, List, Tuple
+
+from utils.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Tareas en ejecución por nombre
+_tareas: Dict[str, asyncio.Task] = {}
+
+# Orden de los cierres: primero la entrada de updates (procesa los pendientes),
+# después los servicios que usan los handlers y al final la salida a Telegram
+ORDEN_ENTRADA = 0
+ORDEN_SERVICIOS = 1
+ORDEN_SALIDA = 2
+
+# (orden, función) a ejecutar al detener, después de cancelar las tareas
+_al_detener: List[Tuple[int, Callable[[], Awaitable]]] = []
+
+def iniciar_tarea(nombre: str, coro: Coroutine) -> asyncio.Task:
+    """
+    Inicia una tarea en segundo plano si no hay otra con el mismo nombre activa.
+
+    Args:
+        nombre: Nombre único de la tarea
+        coro: Corrutina a ejecutar
+
+    Returns:
+        La tarea en ejecución
+    """
+    tarea = _tareas.get(nombre)
+    if tarea and not tarea.done():
+        coro.close()
+        return tarea
+
+    tarea = asyncio.create_task(coro, name=nombre)
+    _tareas[nombre] = tarea
+    logger.info(f"✅ Tarea en segundo plano iniciada: {nombre}")
+    return tarea
+
+async def ejecutar_periodicamente(nombre: str, funcion: Callable[[], Awaitable], intervalo: float) -> None:
+    """
+    Ejecuta una función asíncrona cada `intervalo` segundos sin detenerse por errores.
+
+    Args:
+        nombre: Nombre de la tarea (para los logs)
+        funcion: Función asíncrona sin argumentos
+        intervalo: Segundos entre ejecuciones
+    """
+    while True:
+        try:
+            await funcion()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error en tarea periódica {nombre}: {e}")
+        await asyncio.sleep(intervalo)
+
+def iniciar_tarea_periodica(nombre: str, funcion: Callable[[], Awaitable], intervalo: float) -> asyncio.Task:
+    """Inicia una tarea que ejecuta `funcion` cada `intervalo` segundos"""
+    return iniciar_tarea(nombre, ejecutar_periodicamente(nombre, funcion, intervalo))
+
+def al_detener(funcion: Callable[[], Awaitable], orden: int = ORDEN_SERVICIOS) -> None:
+    """
+    Registra una función asíncrona a ejecutar al detener (p. ej. vaciar búferes).
+
+    Las funciones se ejecutan por `orden` y, con el mismo orden, en el orden
+    en que se registraron.
+    """
+    if all(registrada != funcion for _, registrada in _al_detener):
+        _al_detener.append((orden, funcion))
+
+async def detener_tareas() -> None:
+    """Cancela todas las tareas en segundo plano, espera a que terminen y ejecuta los cierres"""
+    tareas = [tarea for tarea in _tareas.values() if not tarea.done()]
+    for tarea in tareas:
+        tarea.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
+    _tareas.clear()
+    if tareas:
+        logger.info(f"🛑 {len(tareas)} tareas en segundo plano detenidas")
+
+    for _, funcion in sorted(_al_detener, key=lambda registro: registro[0]):
+        try:
+            await funcion()
+        except Exception as e:
+            logger.error(f"Error al detener {getattr(funcion, '__qualname__', funcion)}: {e}")
+    _al_detener.clear()
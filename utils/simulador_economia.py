@@ -0,0 +1,162 @@
+"""
+Simulador de la economía de las actividades de explorar del proyecto Mundo Mítico
+
+Simula jugadores-día con muestreo multinomial por lotes (numpy) y reporta,
+por actividad, la emisión de TON, la inflación de items y la varianza de los
+pagos. Sirve para revisar un cambio en las tablas antes de desplegarlo.
+
+Requiere numpy, que no es dependencia del bot: pip install -r requirements-dev.txt
+
+Uso:
+    python utils/simulador_economia.py [--jugadores 100000] [--dias 30]
+        [--cajas-dia 1] [--tablas propuesta.json] [--semilla 42]
+
+El archivo --tablas es un JSON con actividades a sobrescribir, por ejemplo:
+    {"pelea": {"cooldown": 8, "recompensas": {"nada": {"probabilidad": 40},
+               "ganar": {"probabilidad": 60, "ton": 0.1}}}}
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Any, Dict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Agregar el directorio raíz al path para importaciones
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.actividades import ACTIVIDADES, ACTIVIDAD_CAJA_SORPRESA
+from utils.muestreo import MuestreadorAlias, TOTAL_PROBABILIDADES
+
+# Jugadores-día por lote (acota la memoria de la matriz de conteos)
+TAMANO_LOTE = 1_000_000
+
+def jugadas_por_dia(config: Dict[str, Any], cajas_dia: int) -> int:
+    """Jugadas diarias de un jugador que usa la actividad cada vez que puede"""
+    if config.get("cooldown"):
+        return max(1, int(24 // config["cooldown"]))
+    return cajas_dia
+
+def cargar_actividades(ruta: str = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Copia ACTIVIDADES y aplica encima las actividades del archivo JSON.
+
+    Incluye la Caja Sorpresa aunque esté desactivada en el bot, para poder
+    revisar su tabla antes de aprobarla.
+    """
+    actividades = {"caja_sorpresa": dict(ACTIVIDAD_CAJA_SORPRESA)}
+    actividades.update((nombre, dict(config)) for nombre, config in ACTIVIDADES.items())
+    if ruta:
+        with open(ruta, encoding="utf-8") as archivo:
+            for nombre, cambios in json.load(archivo).items():
+                actividades.setdefault(nombre, {"costo": 0, "cooldown": None}).update(cambios)
+
+    for nombre, config in actividades.items():
+        try:
+            MuestreadorAlias._validar(config["recompensas"])
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"Tabla de recompensas inválida en '{nombre}': {e}")
+    return actividades
+
+def simular_actividad(rng, config: Dict[str, Any], jugadores_dia: int, jugadas: int) -> Dict[str, Any]:
+    """
+    Simula `jugadores_dia` jugadores-día de una actividad con `jugadas` usos cada uno.
+
+    Cada fila de la matriz de conteos es un jugador-día: cuántas veces salió
+    cada recompensa en sus `jugadas`. Los pagos se obtienen con productos
+    matriciales, sin bucles por jugada.
+    """
+    recompensas = config["recompensas"]
+    probabilidades = np.array([r["probabilidad"] for r in recompensas.values()]) / TOTAL_PROBABILIDADES
+    ton = np.array([r.get("ton", 0.0) for r in recompensas.values()])
+    items = sorted({r["item"] for r in recompensas.values() if "item" in r})
+    cantidades = np.array([
+        [r.get("cantidad", 0) if r.get("item") == item else 0 for item in items]
+        for r in recompensas.values()
+    ], dtype=np.int64).reshape(len(recompensas), len(items))
+    costo = float(config.get("costo") or 0)
+
+    netos = np.empty(jugadores_dia, dtype=np.float64)
+    items_emitidos = np.zeros(len(items), dtype=np.int64)
+    for inicio in range(0, jugadores_dia, TAMANO_LOTE):
+        filas = min(TAMANO_LOTE, jugadores_dia - inicio)
+        conteos = rng.multinomial(jugadas, probabilidades, size=filas)
+        netos[inicio:inicio + filas] = conteos @ ton - jugadas * costo
+        items_emitidos += (conteos @ cantidades).sum(axis=0)
+
+    ejecuciones = jugadores_dia * jugadas
+    return {
+        "jugadas_dia": jugadas,
+        "ejecuciones": ejecuciones,
+        "ton_cobrado": ejecuciones * costo,
+        "ton_neto": float(netos.sum()),
+        "ton_esperado_por_jugada": float(probabilidades @ ton - costo),
+        "neto_jugador_dia": {
+            "media": float(netos.mean()),
+            "desviacion": float(netos.std()),
+            "p1": float(np.percentile(netos, 1)),
+            "p99": float(np.percentile(netos, 99)),
+        },
+        "items": {item: int(total) for item, total in zip(items, items_emitidos)},
+        "items_jugador_dia": {item: int(total) / jugadores_dia for item, total in zip(items, items_emitidos)},
+    }
+
+def imprimir_reporte(resultados: Dict[str, Dict[str, Any]], jugadores: int, dias: int, segundos: float) -> None:
+    """Imprime el reporte por actividad y los totales"""
+    print(f"\n📊 Simulación: {jugadores} jugadores x {dias} días ({segundos:.2f}s)\n")
+    ton_total = 0.0
+    items_total: Dict[str, int] = {}
+    for nombre, r in resultados.items():
+        neto = r["neto_jugador_dia"]
+        print(f"• {nombre} ({r['jugadas_dia']} jugadas/día, {r['ejecuciones']} ejecuciones)")
+        print(f"    TON cobrado:          {r['ton_cobrado']:.4f}")
+        print(f"    TON neto emitido:     {r['ton_neto']:.4f} (esperado por jugada {r['ton_esperado_por_jugada']:+.5f})")
+        print(f"    Neto por jugador-día: media {neto['media']:+.5f}, desv {neto['desviacion']:.5f}, "
+              f"p1 {neto['p1']:+.4f}, p99 {neto['p99']:+.4f}")
+        for item, total in r["items"].items():
+            print(f"    {item}: {total} emitidos ({r['items_jugador_dia'][item]:.4f} por jugador-día)")
+        ton_total += r["ton_neto"]
+        for item, total in r["items"].items():
+            items_total[item] = items_total.get(item, 0) + total
+
+    print(f"\nTotal TON neto emitido: {ton_total:.4f} ({ton_total / (jugadores * dias):+.5f} por jugador-día)")
+    for item, total in sorted(items_total.items()):
+        print(f"Total {item}: {total}")
+
+def main():
+    """Función principal del simulador"""
+    parser = argparse.ArgumentParser(description="Simulador de la economía de explorar de Mundo Mítico")
+    parser.add_argument("--jugadores", type=int, default=100_000)
+    parser.add_argument("--dias", type=int, default=30)
+    parser.add_argument("--cajas-dia", type=int, default=1, help="Usos diarios de actividades sin cooldown")
+    parser.add_argument("--tablas", help="JSON con actividades a sobrescribir")
+    parser.add_argument("--semilla", type=int, default=None)
+    args = parser.parse_args()
+
+    if np is None:
+        print("❌ El simulador requiere numpy (pip install -r requirements-dev.txt)")
+        sys.exit(1)
+
+    try:
+        actividades = cargar_actividades(args.tablas)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    rng = np.random.default_rng(args.semilla)
+    jugadores_dia = args.jugadores * args.dias
+    inicio = time.perf_counter()
+    resultados = {
+        nombre: simular_actividad(rng, config, jugadores_dia, jugadas_por_dia(config, args.cajas_dia))
+        for nombre, config in actividades.items()
+    }
+    imprimir_reporte(resultados, args.jugadores, args.dias, time.perf_counter() - inicio)
+
+if __name__ == "__main__":
+    main()
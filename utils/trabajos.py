@@ -0,0 +1,187 @@
+"""
+Cola de trabajos en segundo plano respaldada por MongoDB para el bot Mundo Mítico
+"""
+
+import asyncio
+import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from aiogram import Bot
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from utils.database import trabajos_col
+from utils.logging_config import get_logger
+from utils.segundo_plano import iniciar_tarea
+from config.config import (
+    TRABAJOS_WORKERS,
+    TRABAJOS_INTERVALO,
+    TRABAJOS_BLOQUEO,
+    TRABAJOS_MAX_INTENTOS
+)
+
+logger = get_logger(__name__)
+
+# Espera antes del primer reintento; se duplica en cada intento (máximo 1 hora)
+ESPERA_REINTENTO_BASE = 5  # segundos
+
+FuncionTrabajo = Callable[[Bot, Dict[str, Any]], Awaitable[None]]
+
+class ColaTrabajos:
+    """
+    Trabajos duraderos en la colección `trabajos`.
+
+    Cada trabajo tiene un `tipo` (con su función registrada), sus `datos` y
+    una `clave` única: encolar dos veces la misma clave no crea otro trabajo
+    (idempotencia). Los workers reclaman trabajos con un find_one_and_update
+    atómico que los pasa a "en_proceso" con un bloqueo de `bloqueo` segundos;
+    si el proceso muere a mitad, al vencer el bloqueo otro worker lo reclama.
+    Un error reprograma el trabajo con espera creciente hasta `max_intentos`
+    y después queda como "fallido". La entrega es al menos una vez, así que
+    las funciones deben tolerar repetirse.
+    """
+
+    def __init__(self, workers: int, intervalo: float, bloqueo: float, max_intentos: int):
+        self.workers = workers
+        self.intervalo = intervalo
+        self.bloqueo = bloqueo
+        self.max_intentos = max_intentos
+        self.completados = 0
+        self.fallidos = 0
+        self._funciones: Dict[str, FuncionTrabajo] = {}
+        self._nuevo = asyncio.Event()
+        self._bot: Optional[Bot] = None
+
+    def registrar(self, tipo: str, funcion: FuncionTrabajo) -> None:
+        """Registra la función `funcion(bot, datos)` que ejecuta los trabajos de `tipo`"""
+        if tipo in self._funciones:
+            raise ValueError(f"Tipo de trabajo registrado dos veces: {tipo!r}")
+        self._funciones[tipo] = funcion
+
+    async def encolar(self, tipo: str, datos: Dict[str, Any], clave: str, session=None) -> bool:
+        """
+        Encola un trabajo. Devuelve False si ya existía uno con la misma clave.
+
+        Con `session` el trabajo se escribe en la transacción de esa sesión
+        (dentro de una transacción la clave duplicada la aborta).
+        """
+        ahora = datetime.datetime.now()
+        try:
+            await trabajos_col.insert_one({
+                "tipo": tipo,
+                "datos": datos,
+                "clave": clave,
+                "estado": "pendiente",
+                "intentos": 0,
+                "disponible_en": ahora,
+                "fecha_creacion": ahora
+            }, session=session)
+        except DuplicateKeyError:
+            return False
+        self._nuevo.set()
+        return True
+
+    async def reclamar(self) -> Optional[dict]:
+        """
+        Reclama el trabajo disponible más antiguo.
+
+        `disponible_en` es a la vez la hora del próximo intento (pendiente) y
+        el fin del bloqueo (en proceso), así ambos casos usan el mismo índice.
+        """
+        ahora = datetime.datetime.now()
+        return await trabajos_col.find_one_and_update(
+            {"estado": {"$in": ["pendiente", "en_proceso"]}, "disponible_en": {"$lte": ahora}},
+            {
+                "$set": {
+                    "estado": "en_proceso",
+                    "disponible_en": ahora + datetime.timedelta(seconds=self.bloqueo),
+                    "reclamo": ObjectId()
+                },
+                "$inc": {"intentos": 1}
+            },
+            sort=[("disponible_en", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _procesar(self, trabajo: dict) -> None:
+        # Solo actualiza quien tiene el reclamo vigente (el bloqueo pudo vencer)
+        filtro = {"_id": trabajo["_id"], "reclamo": trabajo["reclamo"]}
+        funcion = self._funciones.get(trabajo["tipo"])
+        error = None
+        if funcion is None:
+            error = f"tipo de trabajo desconocido: {trabajo['tipo']}"
+        elif trabajo["intentos"] > self.max_intentos:
+            error = "bloqueo vencido demasiadas veces"
+        else:
+            try:
+                await funcion(self._bot, trabajo["datos"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e)
+
+        ahora = datetime.datetime.now()
+        if error is None:
+            self.completados += 1
+            await trabajos_col.update_one(filtro, {
+                "$set": {"estado": "completado", "fecha_fin": ahora},
+                "$unset": {"reclamo": ""}
+            })
+        elif trabajo["intentos"] >= self.max_intentos or funcion is None:
+            self.fallidos += 1
+            logger.error(f"❌ Trabajo {trabajo['clave']} fallido tras {trabajo['intentos']} intentos: {error}")
+            await trabajos_col.update_one(filtro, {
+                "$set": {"estado": "fallido", "error": error},
+                "$unset": {"reclamo": ""}
+            })
+        else:
+            espera = min(ESPERA_REINTENTO_BASE * 2 ** (trabajo["intentos"] - 1), 3600)
+            logger.warning(f"⚠️ Trabajo {trabajo['clave']} falló (intento {trabajo['intentos']}), reintento en {espera}s: {error}")
+            await trabajos_col.update_one(filtro, {
+                "$set": {
+                    "estado": "pendiente",
+                    "error": error,
+                    "disponible_en": ahora + datetime.timedelta(seconds=espera)
+                },
+                "$unset": {"reclamo": ""}
+            })
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                trabajo = await self.reclamar()
+                if trabajo is not None:
+                    await self._procesar(trabajo)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en la cola de trabajos: {e}")
+
+            # Sin trabajo: espera al intervalo o a que se encole uno en este proceso
+            self._nuevo.clear()
+            nuevo = asyncio.ensure_future(self._nuevo.wait())
+            try:
+                await asyncio.wait({nuevo}, timeout=self.intervalo)
+            finally:
+                if not nuevo.done():
+                    nuevo.cancel()
+
+    def iniciar(self, bot: Bot) -> None:
+        """Inicia los workers que ejecutan los trabajos"""
+        self._bot = bot
+        for indice in range(self.workers):
+            iniciar_tarea(f"trabajos_{indice}", self._worker())
+
+    async def resumen(self) -> Dict[str, int]:
+        """Número de trabajos por estado"""
+        conteos: List[dict] = await trabajos_col.aggregate([
+            {"$group": {"_id": "$estado", "total": {"$sum": 1}}}
+        ]).to_list(length=None)
+        return {conteo["_id"]: conteo["total"] for conteo in conteos}
+
+cola_trabajos = ColaTrabajos(
+    TRABAJOS_WORKERS,
+    TRABAJOS_INTERVALO,
+    TRABAJOS_BLOQUEO,
+    TRABAJOS_MAX_INTENTOS
+)